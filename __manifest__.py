@@ -7,7 +7,8 @@
     'website': '',
     'category': 'Human Resources/payroll',
     'license': 'LGPL-3',
-    'depends': ['base', 'employee_3c', 'project_3c', 'timesheet_3c'],  # depends on Project 3C for task/tag models
+    'depends': ['base', 'web', 'employee_3c', 'project_3c', 'timesheet_3c'],  # depends on Project 3C for task/tag models
+    'external_dependencies': {'python': ['xlsxwriter']},
     'data': [
         'security/security.xml',
         'security/ir.model.access.csv',
@@ -15,6 +16,9 @@
         'views/actions.xml',
     'data/sequence.xml',
     'data/kpi_default_quality.xml',
+    'data/kpi_cron.xml',
+    'data/payroll_cron.xml',
+    'data/analytics_export_data.xml',
     'data/vn_params_data.xml',
     'data/rule_structure_data.xml',
     'data/rule_updates.xml',
@@ -34,7 +38,14 @@
         'views/kpi_label_views.xml',
         'views/kpi_quality_views.xml',
         'views/kpi_period_views.xml',
+        'views/kpi_job_views.xml',
         'views/payslip_views.xml',
+        'views/ytd_views.xml',
+        'views/analytics_export_views.xml',
+        'views/payslip_pdf_views.xml',
+        'report/payslip_report.xml',
+        'views/payroll_summary_views.xml',
+        'views/pit_finalization_views.xml',
         'views/kpi_adjust_views.xml',
         'views/menu.xml',
     ],
@@ -7,5 +7,13 @@ from . import sheet
 from . import salary_profile
 from . import kpi
 from . import kpi_engine
+from . import kpi_task_log
 from . import kpi_sheet
+from . import kpi_job
 from . import kpi_adjust
+from . import run_pipeline
+from . import ytd
+from . import pit_finalization
+from . import payroll_summary
+from . import payslip_pdf
+from . import analytics_export
@@ -0,0 +1,227 @@
+import logging
+import os
+import time
+from datetime import timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: without it exports are skipped, never written in another format
+    pa = pq = None
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError, ValidationError
+
+_logger = logging.getLogger(__name__)
+
+# Rows fetched and written per batch inside one partition
+EXPORT_BATCH_ROWS = 50000
+# System parameter holding the directory every export must write under (default <data_dir>/payroll_analytics)
+EXPORT_ROOT_PARAM = "payroll_3c.analytics_export_root"
+# Rows changed by transactions still open at export time carry an older write_date; stop the window
+# this far in the past so they are picked up by the next run instead of falling behind the watermark
+WATERMARK_LAG = timedelta(minutes=10)
+
+# dataset -> (columns [(name, type)], SQL yielding those columns plus write_date, year, month)
+DATASETS = {
+    "payslip_line": ([
+        ("id", "int"), ("payslip_id", "int"), ("run_id", "int"), ("employee_id", "int"), ("department_id", "int"),
+        ("state", "str"), ("date_from", "date"), ("date_to", "date"), ("code", "str"), ("name", "str"),
+        ("category_code", "str"), ("category_type", "str"), ("amount", "float"), ("quantity", "float"),
+        ("total", "float"), ("write_date", "datetime"),
+    ], """
+        SELECT l.id, l.payslip_id, p.run_id, p.employee_id, p.employee_department_id AS department_id,
+               p.state, p.date_from, p.date_to, l.code, l.name, c.code AS category_code, c.type AS category_type,
+               l.amount::float8 AS amount, l.quantity::float8 AS quantity,
+               (COALESCE(l.amount, 0) * COALESCE(l.quantity, 0))::float8 AS total,
+               GREATEST(l.write_date, p.write_date) AS write_date,
+               EXTRACT(YEAR FROM p.date_to)::int AS year, EXTRACT(MONTH FROM p.date_to)::int AS month
+          FROM payroll_payslip_line l
+          JOIN payroll_payslip p ON p.id = l.payslip_id
+     LEFT JOIN payroll_category c ON c.id = l.category_id
+    """),
+    "kpi_record": ([
+        ("id", "int"), ("employee_id", "int"), ("period_id", "int"), ("period_start", "date"), ("period_end", "date"),
+        ("group_code", "str"), ("score", "float"), ("details", "str"), ("write_date", "datetime"),
+    ], """
+        SELECT r.id, r.employee_id, r.period_id, pe.date_start AS period_start, pe.date_end AS period_end,
+               g.code AS group_code, r.score::float8 AS score, r.details::text AS details, r.write_date,
+               EXTRACT(YEAR FROM pe.date_start)::int AS year, EXTRACT(MONTH FROM pe.date_start)::int AS month
+          FROM payroll_kpi_record r
+          JOIN payroll_kpi_period pe ON pe.id = r.period_id
+          JOIN payroll_kpi_group g ON g.id = r.group_id
+    """),
+    "sheet_line": ([
+        ("id", "int"), ("sheet_id", "int"), ("run_id", "int"), ("employee_id", "int"), ("values", "str"),
+        ("write_date", "datetime"),
+    ], """
+        SELECT sl.id, sl.sheet_id, s.run_id, sl.employee_id, sl.values,
+               GREATEST(sl.write_date, s.write_date) AS write_date, s.year, s.month
+          FROM payroll_sheet_line sl
+          JOIN payroll_sheet s ON s.id = sl.sheet_id
+    """),
+}
+
+DATASET_SELECTION = [
+    ("payslip_line", "Payslip lines"),
+    ("kpi_record", "KPI records"),
+    ("sheet_line", "Payroll sheet lines"),
+]
+
+
+def _arrow_schema(columns):
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(), "date": pa.date32(),
+             "datetime": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+class PayrollAnalyticsExport(models.Model):
+    """Incremental export of one dataset to Hive-style partitions: <directory>/<dataset>/year=YYYY/month=MM/.
+
+    Every run appends one part file per touched partition with the rows whose write_date is past the
+    watermark, so a row may appear in several parts: readers keep the latest write_date per id.
+    Deleted rows are not exported.
+    """
+    _name = "payroll.analytics.export"
+    _description = "Payroll Analytics Export"
+    _order = "dataset"
+
+    name = fields.Char(required=True)
+    dataset = fields.Selection(DATASET_SELECTION, required=True)
+    directory = fields.Char(
+        required=True, default=lambda self: self._export_root(), groups="base.group_system",
+        help="Local directory on the Odoo server receiving the partitioned files. "
+             "Must be an absolute path under the payroll_3c.analytics_export_root system parameter.")
+    active = fields.Boolean(default=True)
+    watermark = fields.Datetime(
+        string="Exported up to", readonly=True,
+        help="Rows written up to this time are exported. Reset it to re-export the whole history.")
+    file_format = fields.Char(string="Format", compute="_compute_file_format")
+    last_run = fields.Datetime(readonly=True)
+    last_row_count = fields.Integer(string="Rows (last run)", readonly=True)
+    last_file_count = fields.Integer(string="Files (last run)", readonly=True)
+    last_duration = fields.Float(string="Duration (s)", digits=(16, 2), readonly=True)
+
+    _sql_constraints = [
+        ("analytics_dataset_unique", "unique(dataset)", "One export per dataset."),
+    ]
+
+    @api.model
+    def _export_root(self):
+        root = self.env["ir.config_parameter"].sudo().get_param(EXPORT_ROOT_PARAM) or \
+            os.path.join(tools.config["data_dir"], "payroll_analytics")
+        return os.path.realpath(root)
+
+    def _checked_directory(self):
+        """Resolved export directory; raises when it is not an absolute path inside the configured root."""
+        self.ensure_one()
+        directory = self.sudo().directory or ""
+        root = self._export_root()
+        resolved = os.path.realpath(directory)
+        if not os.path.isabs(directory) or os.path.commonpath([root, resolved]) != root:
+            raise ValidationError(_("The export directory of %s must be an absolute path under %s.") % (self.name, root))
+        return resolved
+
+    @api.constrains("directory")
+    def _check_directory(self):
+        for rec in self:
+            rec._checked_directory()
+
+    def _compute_file_format(self):
+        for rec in self:
+            rec.file_format = "Parquet (zstd)" if pa else _("Unavailable: install pyarrow")
+
+    def _partitions(self, query, since, until):
+        self.env.cr.execute(f"""
+            SELECT DISTINCT q.year, q.month FROM ({query}) q
+             WHERE (%(since)s IS NULL OR q.write_date > %(since)s) AND q.write_date <= %(until)s
+               AND q.year IS NOT NULL AND q.month IS NOT NULL
+          ORDER BY 1, 2
+        """, {"since": since, "until": until})
+        return self.env.cr.fetchall()
+
+    def _iter_batches(self, columns, query, since, until, year, month):
+        names = ", ".join("q.%s" % name for name, _kind in columns)
+        self.env.cr.execute(f"""
+            SELECT {names} FROM ({query}) q
+             WHERE (%(since)s IS NULL OR q.write_date > %(since)s) AND q.write_date <= %(until)s
+               AND q.year = %(year)s AND q.month = %(month)s
+          ORDER BY q.id
+        """, {"since": since, "until": until, "year": year, "month": month})
+        while True:
+            rows = self.env.cr.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                return
+            yield rows
+
+    def _write_partition(self, path, columns, batches):
+        """Write `batches` of row tuples to `path` through a temporary name; returns the row count."""
+        tmp_path = path + ".tmp"
+        count = 0
+        schema = _arrow_schema(columns)
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            for rows in batches:
+                data = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(data, schema)], schema=schema))
+                count += len(rows)
+        # Readers never see a half-written part
+        os.replace(tmp_path, path)
+        return count
+
+    def _export(self):
+        self.ensure_one()
+        if not pa:
+            # A dataset directory only ever holds Parquet parts, so BI tools read it as one table
+            raise UserError(_("The Python package pyarrow is required to write Parquet analytics files."))
+        started = time.perf_counter()
+        columns, query = DATASETS[self.dataset]
+        for model in ("payroll.payslip.line", "payroll.payslip", "payroll.kpi_record", "payroll.sheet.line", "payroll.sheet"):
+            self.env[model].flush_model()
+        until = fields.Datetime.now() - WATERMARK_LAG
+        if self.watermark and self.watermark >= until:
+            return
+        since = self.watermark or None
+        directory = self._checked_directory()
+        stamp = until.strftime("%Y%m%d%H%M%S")
+        rows = files = 0
+        for year, month in self._partitions(query, since, until):
+            folder = os.path.join(directory, self.dataset, "year=%04d" % year, "month=%02d" % month)
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, "part-%s.parquet" % stamp)
+            rows += self._write_partition(path, columns, self._iter_batches(columns, query, since, until, year, month))
+            files += 1
+        self.write({
+            "watermark": until,
+            "last_run": fields.Datetime.now(),
+            "last_row_count": rows,
+            "last_file_count": files,
+            "last_duration": time.perf_counter() - started,
+        })
+        _logger.info("[payroll.analytics.export] %s: %s rows in %s files (%.2fs)",
+                     self.dataset, rows, files, time.perf_counter() - started)
+
+    def action_export_now(self):
+        for rec in self:
+            try:
+                rec._export()
+            except OSError as e:
+                raise UserError(_("Cannot write the %s export: %s") % (rec.dataset, e))
+        return True
+
+    def action_reset_watermark(self):
+        self.write({"watermark": False})
+        return True
+
+    @api.model
+    def _cron_export(self):
+        if not pa:
+            _logger.warning("[payroll.analytics.export] pyarrow is not installed, analytics export skipped")
+            return
+        for rec in self.search([]):
+            try:
+                rec._export()
+                self.env.cr.commit()
+            except Exception:
+                self.env.cr.rollback()
+                _logger.exception("[payroll.analytics.export] export of %s failed", rec.dataset)
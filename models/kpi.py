@@ -1,5 +1,30 @@
+import hashlib
+import json
+from datetime import timedelta
 from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools.lru import LRU
+
+# Tasks written by transactions still open when a compute starts carry an older write_date; the watermark
+# is set this far before the compute's transaction time so the next run still sees them
+KPI_WATERMARK_LAG = timedelta(minutes=10)
+
+# Rendered KPI breakdown tables, keyed by (db, kind, details digest, label config stamp)
+_KPI_HTML_CACHE = LRU(4096)
+
+
+def kpi_html_cache_key(env, kind, payload, stamp):
+    """Cache key for a rendered KPI table: digest of the JSON payload plus the label config stamp."""
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return (env.cr.dbname, kind, digest, stamp)
+
+
+def kpi_html_cache_get(key):
+    return _KPI_HTML_CACHE.get(key)
+
+
+def kpi_html_cache_set(key, html):
+    _KPI_HTML_CACHE[key] = html
 
 
 class PayrollKpiGroup(models.Model):
@@ -37,6 +62,36 @@ class PayrollKpiLabel(models.Model):
         ("kpi_label_unique", "unique(group_id, tag_id)", "Each tag can appear only once in a group"),
     ]
 
+    @api.model
+    def _names_stamp(self):
+        """Last change of anything a KPI details table shows from configuration
+        (label/tag names, label and group weights), read as one aggregate per model through the ORM.
+        The label count catches deleted labels, which leave no write_date behind."""
+        stamp = []
+        for model, aggregates in (('payroll.kpi_label', ['write_date:max', '__count']),
+                                  ('payroll.kpi_group', ['write_date:max']),
+                                  ('project3c.tag', ['write_date:max'])):
+            Model = self.env[model].sudo().with_context(active_test=False)
+            [row] = Model._read_group([], aggregates=aggregates)
+            stamp += [str(v) for v in row]
+        return tuple(stamp)
+
+    @api.model
+    def _details_map(self, label_ids):
+        """Resolve display data for many labels at once: {label_id: {name, tag_name, weight, group_weight}}."""
+        res = {}
+        if not label_ids:
+            return res
+        labels = self.sudo().with_context(active_test=False).browse(list(label_ids)).exists()
+        for lab in labels:
+            res[lab.id] = {
+                'name': lab.name,
+                'tag_name': lab.tag_id.name if lab.tag_id else '',
+                'weight': lab.weight,
+                'group_weight': lab.group_id.weight if lab.group_id else 0.0,
+            }
+        return res
+
 
 class PayrollKpiQualityProfile(models.Model):
     _name = "payroll.kpi_quality_profile"
@@ -64,6 +119,10 @@ class PayrollKpiPeriod(models.Model):
         ("closed", "Closed"),
     ], default="draft", required=True)
     active = fields.Boolean(default=True)
+    last_compute_date = fields.Datetime(
+        string="Last KPI Compute", readonly=True, copy=False,
+        help="Watermark of the last KPI compute: an incremental compute only redoes employees "
+             "whose tasks changed after this time.")
 
     @api.constrains("date_start", "date_end")
     def _check_dates(self):
@@ -71,6 +130,110 @@ class PayrollKpiPeriod(models.Model):
             if rec.date_start and rec.date_end and rec.date_start > rec.date_end:
                 raise ValidationError(_("Start date must be before or equal to End date"))
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        periods = super().create(vals_list)
+        periods._invalidate_payslip_kpi_period()
+        return periods
+
+    def write(self, vals):
+        if {'date_start', 'date_end', 'active'} & set(vals):
+            # Slips of the old date ranges lose their link, slips of the new ones gain it
+            self._invalidate_payslip_kpi_period()
+            res = super().write(vals)
+            self._invalidate_payslip_kpi_period()
+            return res
+        return super().write(vals)
+
+    def _invalidate_payslip_kpi_period(self):
+        Payslip = self.env['payroll.payslip']
+        for period in self:
+            Payslip._mark_kpi_links_to_recompute('kpi_period_id', [
+                ('date_from', '=', period.date_start),
+                ('date_to', '=', period.date_end),
+            ])
+
+    def _compute_kpi_incremental(self, quality_profile=None, overdue_threshold_days=7, employees=None, since=None):
+        """Recompute KPI of employees whose tasks changed since last_compute_date.
+
+        Without a watermark every employee with a user is computed. The watermark is the database
+        transaction time minus KPI_WATERMARK_LAG, so tasks written during the compute or committed late by
+        concurrent transactions are picked up by the next run.
+        With `employees` only those are looked at (e.g. the employees of one payroll batch), from the later
+        of the watermark and `since`; the period watermark and state are then left alone, since the other
+        employees were not recomputed.
+        Returns the recomputed employees.
+        """
+        self.ensure_one()
+        if self.state == 'closed':
+            raise UserError(_("Cannot compute KPI for a closed KPI Period."))
+        Engine = self.env['payroll.kpi_engine']
+        Employee = self.env['employee3c.employee.base']
+        qprof = quality_profile or self.env['payroll.kpi_quality_profile'].search([('active', '=', True)], limit=1)
+        if not qprof:
+            raise UserError(_("No KPI Quality Profile configured."))
+        started_at = self.env.cr.now() - KPI_WATERMARK_LAG
+        scoped = employees is not None
+        watermark = self.last_compute_date
+        if scoped and since and (not watermark or since > watermark):
+            watermark = since
+        if watermark:
+            employees = Engine.changed_employees_since(watermark, employees=employees)
+        elif scoped:
+            employees = employees.filtered('user_id')
+        else:
+            employees = Employee.search([('user_id', '!=', False)])
+        if employees:
+            groups = self.env['payroll.kpi_group'].search([('active', '=', True)])
+            labels = self.env['payroll.kpi_label'].search([('active', '=', True)])
+            counts_by_emp = {
+                emp.id: Engine.aggregate_employee_label_counts(
+                    emp, self, labels, overdue_threshold_days=overdue_threshold_days)
+                for emp in employees
+            }
+            metrics_by_emp = Engine.compute_group_metrics_bulk(counts_by_emp, qprof, groups, labels)
+            _records, totals = Engine.upsert_kpi_records_batch(self, metrics_by_emp)
+            for sheet in self.env['payroll.kpi_sheet'].search([('period_id', '=', self.id)]):
+                sheet._update_lines_from_metrics(metrics_by_emp, totals, create_missing=False)
+        if scoped:
+            return employees
+        vals = {'last_compute_date': started_at}
+        if self.state == 'draft':
+            vals['state'] = 'computed'
+        self.write(vals)
+        return employees
+
+    def action_compute_kpi_incremental(self):
+        for period in self:
+            period._compute_kpi_incremental()
+        return True
+
+    @api.model
+    def _cron_compute_kpi_incremental(self):
+        """Nightly: keep KPI of open periods current from tasks changed since the last run."""
+        today = fields.Date.context_today(self)
+        periods = self.search([
+            ('state', '!=', 'closed'),
+            ('date_start', '<=', today),
+            ('date_end', '>=', today - timedelta(days=31)),
+        ])
+        for period in periods:
+            period._compute_kpi_incremental()
+            # Keep finished periods even if a later one fails
+            self.env.cr.commit()
+
+    def action_open_rescore_wizard(self):
+        """Open the re-score wizard for this period (stored counts, no task scan)."""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Re-score KPI'),
+            'res_model': 'payroll.kpi.rescore.wizard',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {'default_period_id': self.id},
+        }
+
 
 class PayrollKpiRecord(models.Model):
     _name = "payroll.kpi_record"
@@ -93,60 +256,112 @@ class PayrollKpiRecord(models.Model):
         ),
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._invalidate_payslip_kpi_records()
+        return records
+
+    def write(self, vals):
+        if {'employee_id', 'period_id'} & set(vals):
+            self._invalidate_payslip_kpi_records()
+            res = super().write(vals)
+            self._invalidate_payslip_kpi_records()
+            return res
+        return super().write(vals)
+
+    def unlink(self):
+        domain = self._payslip_kpi_domain()
+        res = super().unlink()
+        if domain:
+            self.env['payroll.payslip']._mark_kpi_links_to_recompute('kpi_record_ids', domain)
+        return res
+
+    def _payslip_kpi_domain(self):
+        if not self:
+            return []
+        return [
+            ('employee_id', 'in', self.employee_id.ids),
+            ('kpi_period_id', 'in', self.period_id.ids),
+        ]
+
+    def _invalidate_payslip_kpi_records(self):
+        """Flag payslips of the affected employees/periods so their stored kpi_record_ids follow."""
+        domain = self._payslip_kpi_domain()
+        if domain:
+            self.env['payroll.payslip']._mark_kpi_links_to_recompute('kpi_record_ids', domain)
+
     def _compute_details_html(self):
+        """Render from cache when details and label configuration are unchanged; label and tag
+        names of every cache miss are resolved with one prefetch across the recordset."""
+        stamp = self.env['payroll.kpi_label']._names_stamp()
+        missing = []
         for rec in self:
-            html = [
-                '<div class="o_form_view">',
-                '<table class="o_list_view table table-sm table-striped table-hover">',
-                '<thead><tr>',
-                '<th>Tên nhãn</th>',
-                '<th>Tên tag</th>',
-                '<th>Nhóm</th>',
-                '<th>Công việc được giao</th>',
-                '<th>Hoàn thành đúng hạn</th>',
-                '<th>Hoàn thành muộn</th>',
-                '<th>Quá hạn</th>',
-                '<th>Trọng số</th>',
-                '<th>Điểm KPI quy đổi (%)</th>',
-                '</tr></thead><tbody>'
-            ]
-
             details = rec.details or {}
-            labels_info = details.get('labels') or []
-            # Map label_id -> record for names and tag
-            label_ids = [x.get('label_id') for x in labels_info if x.get('label_id')]
-            label_map = {}
-            if label_ids:
-                Label = rec.env['payroll.kpi_label']
-                for lab in Label.browse(label_ids).exists():
-                    label_map[lab.id] = lab
             group_code = rec.group_id.code or (details.get('code') if isinstance(details, dict) else '') or ''
+            key = kpi_html_cache_key(self.env, 'record', [group_code, details], stamp)
+            html = kpi_html_cache_get(key)
+            if html is None:
+                missing.append((rec, key, group_code, details))
+            else:
+                rec.details_html = html
+        if not missing:
+            return
+        label_ids = {
+            x.get('label_id')
+            for _rec, _key, _code, details in missing
+            for x in (details.get('labels') or [])
+            if x.get('label_id')
+        }
+        label_map = self.env['payroll.kpi_label']._details_map(label_ids)
+        for rec, key, group_code, details in missing:
+            html = self._render_details_html(details, group_code, label_map)
+            kpi_html_cache_set(key, html)
+            rec.details_html = html
+
+    @api.model
+    def _render_details_html(self, details, group_code, label_map):
+        html = [
+            '<div class="o_form_view">',
+            '<table class="o_list_view table table-sm table-striped table-hover">',
+            '<thead><tr>',
+            '<th>Tên nhãn</th>',
+            '<th>Tên tag</th>',
+            '<th>Nhóm</th>',
+            '<th>Công việc được giao</th>',
+            '<th>Hoàn thành đúng hạn</th>',
+            '<th>Hoàn thành muộn</th>',
+            '<th>Quá hạn</th>',
+            '<th>Trọng số</th>',
+            '<th>Điểm KPI quy đổi (%)</th>',
+            '</tr></thead><tbody>'
+        ]
+
+        # Build rows
+        for row in (details.get('labels') or []):
+            lab_id = row.get('label_id')
+            lab = label_map.get(lab_id)
+            label_name = lab['name'] if lab else str(lab_id or '')
+            tag_name = lab['tag_name'] if lab else ''
+            assigned = int(row.get('assigned') or 0)
+            ontime = int(row.get('ontime') or 0)
+            late = int(row.get('late') or 0)
+            overdue = int(row.get('overdue') or 0)
+            weight = float(row.get('weight') or 0.0)
+            e_g = float(row.get('E_G') or 0.0)
+            kpi_pct = (e_g / assigned * 100.0) if assigned else 0.0
+
+            html.append('<tr>')
+            html.append(f'<td>{label_name}</td>')
+            html.append(f'<td>{tag_name}</td>')
+            html.append(f'<td>{group_code}</td>')
+            html.append(f'<td style="text-align:right">{assigned}</td>')
+            html.append(f'<td style="text-align:right">{ontime}</td>')
+            html.append(f'<td style="text-align:right">{late}</td>')
+            html.append(f'<td style="text-align:right">{overdue}</td>')
+            html.append(f'<td style="text-align:right">{weight:.2f}</td>')
+            html.append(f'<td style="text-align:right">{kpi_pct:.2f}</td>')
+            html.append('</tr>')
 
-            # Build rows
-            for row in labels_info:
-                lab_id = row.get('label_id')
-                lab = label_map.get(lab_id)
-                label_name = lab.name if lab else str(lab_id or '')
-                tag_name = lab.tag_id.name if (lab and lab.tag_id) else ''
-                assigned = int(row.get('assigned') or 0)
-                ontime = int(row.get('ontime') or 0)
-                late = int(row.get('late') or 0)
-                overdue = int(row.get('overdue') or 0)
-                weight = float(row.get('weight') or 0.0)
-                e_g = float(row.get('E_G') or 0.0)
-                kpi_pct = (e_g / assigned * 100.0) if assigned else 0.0
-
-                html.append('<tr>')
-                html.append(f'<td>{label_name}</td>')
-                html.append(f'<td>{tag_name}</td>')
-                html.append(f'<td>{group_code}</td>')
-                html.append(f'<td style="text-align:right">{assigned}</td>')
-                html.append(f'<td style="text-align:right">{ontime}</td>')
-                html.append(f'<td style="text-align:right">{late}</td>')
-                html.append(f'<td style="text-align:right">{overdue}</td>')
-                html.append(f'<td style="text-align:right">{weight:.2f}</td>')
-                html.append(f'<td style="text-align:right">{kpi_pct:.2f}</td>')
-                html.append('</tr>')
-
-            html.append('</tbody></table></div>')
-            rec.details_html = ''.join(html)
+        html.append('</tbody></table></div>')
+        return ''.join(html)
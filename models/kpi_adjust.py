@@ -104,3 +104,57 @@ class PayrollKpiAdjustRecord(models.Model):
             else:
                 recs |= self.create(vals)
         return recs
+
+    @api.model
+    def sync_auto_for_payslips(self, payslips):
+        """Batch variant of sync_auto_for_employee_period for many payslips.
+
+        Variable values are resolved for all employees of a KPI period in one pass, existing auto lines
+        are loaded with one search, unchanged lines are skipped and missing ones created in one batch.
+        """
+        payslips = payslips.filtered(lambda p: p.employee_id and p.kpi_period_id)
+        Rule = self.env["payroll.kpi_adjust_rule"].sudo()
+        rules = Rule.search([("active", "=", True), ("source_type", "=", "auto"), ("variable_key", "!=", False)])
+        if not payslips or not rules:
+            return self.browse()
+        var_keys = set(rules.mapped("variable_key"))
+        Variable = self.env['payroll.variable']
+        recs = self.browse()
+        to_create = []
+        for period in payslips.kpi_period_id:
+            slips = payslips.filtered(lambda p: p.kpi_period_id == period)
+            try:
+                var_maps = Variable.compute_values_for_employees(
+                    slips.employee_id, period.date_start, period.date_end, keys=var_keys)
+            except Exception:
+                var_maps = {}
+            existing = self.search([
+                ("period_id", "=", period.id),
+                ("rule_id", "in", rules.ids),
+                ("payslip_id", "in", slips.ids),
+            ])
+            by_key = {(r.payslip_id.id, r.rule_id.id): r for r in existing}
+            for slip in slips:
+                var_map = var_maps.get(slip.employee_id.id) or {}
+                for r in rules:
+                    raw = var_map.get(r.variable_key)
+                    try:
+                        occ = int(float(raw or 0))
+                    except Exception:
+                        occ = 0
+                    rec = by_key.get((slip.id, r.id))
+                    if rec:
+                        if rec.occurrences != occ:
+                            rec.write({"occurrences": occ})
+                        recs |= rec
+                    else:
+                        to_create.append({
+                            "employee_id": slip.employee_id.id,
+                            "period_id": period.id,
+                            "payslip_id": slip.id,
+                            "rule_id": r.id,
+                            "occurrences": occ,
+                        })
+        if to_create:
+            recs |= self.create(to_create)
+        return recs
@@ -1,5 +1,21 @@
+import json
 from datetime import timedelta
 from odoo import models, fields
+from odoo.tools import float_compare
+
+try:
+    import numpy as np
+except ImportError:  # optional: vectorized KPI metrics fall back to the per-employee path
+    np = None
+
+# Column order of the count tensor used by compute_group_metrics_matrix
+KPI_COUNT_COLUMNS = ('assigned', 'ontime', 'late', 'overdue')
+
+# Bucket codes returned by kpi_classify_tasks_bulk; index 0 means excluded
+KPI_BUCKETS = (None, 'ontime', 'late', 'overdue')
+KPI_BUCKET_EXCLUDED, KPI_BUCKET_ONTIME, KPI_BUCKET_LATE, KPI_BUCKET_OVERDUE = range(4)
+
+_US_PER_DAY = 86400 * 1000000
 
 
 class PayrollKpiEngine(models.AbstractModel):
@@ -46,6 +62,58 @@ class PayrollKpiEngine(models.AbstractModel):
             return "late"
         return "overdue"
 
+    def kpi_classify_tasks_bulk(self, states, done_dates, due_dates, overdue_threshold_days=7):
+        """
+        Classify many tasks at once with the same rules as kpi_classify_task.
+
+        `states`, `done_dates` and `due_dates` are parallel sequences (one item per task; missing
+        datetimes may be False/None). Returns (codes, delay_days): codes index into KPI_BUCKETS
+        (0 = excluded, 1 = ontime, 2 = late, 3 = overdue) and delay_days is the ceil-day delay of
+        completed late/overdue tasks (0 otherwise).
+
+        The ceil rule matches timedelta semantics of the single-task helper: a delay counts one more
+        day when it has a non-zero seconds part; sub-second remainders are ignored.
+        """
+        n = len(states)
+        if np is None or not n:
+            codes, delays = [], []
+            for state, done, due in zip(states, done_dates, due_dates):
+                code, delay_days = KPI_BUCKET_EXCLUDED, 0
+                if state == "done" and done and due:
+                    if done <= due:
+                        code = KPI_BUCKET_ONTIME
+                    else:
+                        delay = done - due
+                        delay_days = delay.days if delay.seconds == 0 else delay.days + 1
+                        code = KPI_BUCKET_LATE if delay_days <= overdue_threshold_days else KPI_BUCKET_OVERDUE
+                codes.append(code)
+                delays.append(delay_days)
+            return codes, delays
+
+        done = np.array([d or None for d in done_dates], dtype="datetime64[us]")
+        due = np.array([d or None for d in due_dates], dtype="datetime64[us]")
+        valid = (np.asarray(states, dtype=object) == "done") & ~np.isnat(done) & ~np.isnat(due)
+        # NaT rows produce garbage deltas; they are masked out by `valid`
+        delay_us = np.where(valid, (done - due).astype("int64"), 0)
+        is_late = valid & (delay_us > 0)
+        whole_days, rest_us = np.divmod(delay_us, _US_PER_DAY)
+        delay_days = np.where(is_late, whole_days + ((rest_us // 1000000) != 0), 0)
+
+        codes = np.zeros(n, dtype=np.int8)
+        codes[valid & ~is_late] = KPI_BUCKET_ONTIME
+        codes[is_late & (delay_days <= overdue_threshold_days)] = KPI_BUCKET_LATE
+        codes[is_late & (delay_days > overdue_threshold_days)] = KPI_BUCKET_OVERDUE
+        return codes.tolist(), delay_days.tolist()
+
+    def classify_task_records(self, tasks, overdue_threshold_days=7):
+        """Bulk-classify a project3c.task recordset. Returns (codes, delay_days) aligned with `tasks`."""
+        return self.kpi_classify_tasks_bulk(
+            [getattr(t, "state", None) for t in tasks],
+            [getattr(t, "done_date", None) for t in tasks],
+            [getattr(t, "due_date", None) for t in tasks],
+            overdue_threshold_days=overdue_threshold_days,
+        )
+
     def aggregate_employee_label_counts(self, employee, period, labels, overdue_threshold_days=7):
         """
         Aggregate assigned and completed counts per KPI label for a given employee and period.
@@ -64,7 +132,7 @@ class PayrollKpiEngine(models.AbstractModel):
         Assumptions:
         - Assigned = tasks where assignee_id == employee.user_id and due_date in [start, end].
         - A task can count toward multiple labels if it has multiple tags configured.
-        - Completed classification uses kpi_classify_task rules; tasks w/o deadline or not done are excluded from ontime/late/overdue.
+        - Completed classification uses kpi_classify_task rules (via kpi_classify_tasks_bulk); tasks w/o deadline or not done are excluded from ontime/late/overdue.
         """
         res = {}
         if not employee or not employee.user_id:
@@ -103,9 +171,9 @@ class PayrollKpiEngine(models.AbstractModel):
         ]
         tasks = Task.search(domain)
 
-        # Iterate tasks and update per-label counters
-        classify = self.kpi_classify_task
-        for t in tasks:
+        # Classify every task in one pass, then update per-label counters
+        codes, _delays = self.classify_task_records(tasks, overdue_threshold_days=overdue_threshold_days)
+        for t, code in zip(tasks, codes):
             # Assigned per matching label
             for tag in t.tag_ids:
                 labs = label_by_tag.get(tag.id)
@@ -116,8 +184,8 @@ class PayrollKpiEngine(models.AbstractModel):
                     entry["assigned"] += 1
 
             # Completed breakdown per matching label
-            bucket = classify(t, overdue_threshold_days=overdue_threshold_days)
-            if bucket in ("ontime", "late", "overdue"):
+            bucket = KPI_BUCKETS[code]
+            if bucket:
                 for tag in t.tag_ids:
                     labs = label_by_tag.get(tag.id)
                     if not labs:
@@ -128,6 +196,34 @@ class PayrollKpiEngine(models.AbstractModel):
 
         return res
 
+    def changed_employees_since(self, since, employees=None):
+        """
+        Return employees assigned to project3c.task rows written after `since`.
+
+        Tag changes on a task go through the task's write and bump its write_date, so one grouped
+        query over write_date covers both task fields and tag links. Tasks whose due date moved out
+        of a period are included too; the subsequent aggregate simply stops counting them.
+        Previous assignees of reassigned or deleted tasks come from payroll.kpi_task_log.
+        With `employees`, only tasks of their users are looked at and a subset of them is returned.
+        """
+        Task = self.env["project3c.task"]
+        Employee = self.env["employee3c.employee.base"]
+        domain = [("write_date", ">", since), ("assignee_id", "!=", False)]
+        scope_user_ids = None
+        if employees is not None:
+            if not employees.user_id:
+                return Employee
+            scope_user_ids = employees.user_id.ids
+            domain.append(("assignee_id", "in", scope_user_ids))
+        rows = Task.read_group(domain, ["assignee_id"], ["assignee_id"])
+        user_ids = {r["assignee_id"][0] for r in rows if r.get("assignee_id")}
+        user_ids |= self.env["payroll.kpi_task_log"].user_ids_since(since, scope_user_ids)
+        if not user_ids:
+            return Employee
+        if employees is not None:
+            return employees.filtered(lambda e: e.user_id.id in user_ids)
+        return Employee.search([("user_id", "in", list(user_ids))])
+
     def compute_group_metrics(self, counts_by_label, quality_profile, groups):
         """
         Compute E_G per label and aggregate per-group metrics.
@@ -158,31 +254,7 @@ class PayrollKpiEngine(models.AbstractModel):
           }
         }
         """
-        # Normalize groups into a mapping
-        group_map = {}
-        if isinstance(groups, dict):
-            for gid, info in groups.items():
-                group_map[gid] = {
-                    'group_id': gid,
-                    'code': info.get('code'),
-                    'name': info.get('name'),
-                    'weight': float(info.get('weight', 0.0)),
-                    'num': 0.0,
-                    'den': 0.0,
-                    'labels': [],
-                }
-        else:
-            # assume recordset
-            for g in groups:
-                group_map[g.id] = {
-                    'group_id': g.id,
-                    'code': g.code,
-                    'name': g.name,
-                    'weight': float(g.weight or 0.0),
-                    'num': 0.0,
-                    'den': 0.0,
-                    'labels': [],
-                }
+        group_map = self._normalize_groups(groups)
 
         coef_on = float(quality_profile.coef_ontime or 0.0)
         coef_late = float(quality_profile.coef_late or 0.0)
@@ -230,6 +302,267 @@ class PayrollKpiEngine(models.AbstractModel):
             'groups': group_map,
         }
 
+    def _normalize_groups(self, groups):
+        """Normalize a payroll.kpi_group recordset or a dict {group_id: {code,name,weight}}
+        into the per-group accumulator mapping used by compute_group_metrics."""
+        group_map = {}
+        if isinstance(groups, dict):
+            for gid, info in groups.items():
+                group_map[gid] = {
+                    'group_id': gid,
+                    'code': info.get('code'),
+                    'name': info.get('name'),
+                    'weight': float(info.get('weight', 0.0)),
+                    'num': 0.0,
+                    'den': 0.0,
+                    'labels': [],
+                }
+        else:
+            # assume recordset
+            for g in groups:
+                group_map[g.id] = {
+                    'group_id': g.id,
+                    'code': g.code,
+                    'name': g.name,
+                    'weight': float(g.weight or 0.0),
+                    'num': 0.0,
+                    'den': 0.0,
+                    'labels': [],
+                }
+        return group_map
+
+    def build_count_tensor(self, counts_by_employee, label_ids):
+        """
+        Stack per-employee label counts into a tensor for compute_group_metrics_matrix.
+
+        Params:
+        - counts_by_employee: dict {employee_id: counts_by_label} (see aggregate_employee_label_counts)
+        - label_ids: ordered list of label ids (tensor axis 1)
+
+        Returns (employee_ids, counts, present) where counts has shape
+        (employees, labels, 4) with columns KPI_COUNT_COLUMNS and present is a boolean
+        (employees, labels) mask of the labels each employee actually had counts for.
+        """
+        employee_ids = list(counts_by_employee.keys())
+        counts = np.zeros((len(employee_ids), len(label_ids), len(KPI_COUNT_COLUMNS)), dtype=np.float64)
+        present = np.zeros((len(employee_ids), len(label_ids)), dtype=bool)
+        col_by_label = {lid: j for j, lid in enumerate(label_ids)}
+        for i, emp_id in enumerate(employee_ids):
+            for lab_id, data in (counts_by_employee[emp_id] or {}).items():
+                j = col_by_label.get(lab_id)
+                if j is None:
+                    continue
+                present[i, j] = True
+                for k, key in enumerate(KPI_COUNT_COLUMNS):
+                    counts[i, j, k] = float(data.get(key, 0) or 0)
+        return employee_ids, counts, present
+
+    def compute_group_metrics_matrix(self, counts, label_ids, label_weights, label_group_ids,
+                                     quality_profile, groups, present=None):
+        """
+        Vectorized compute_group_metrics over all employees at once.
+
+        Params:
+        - counts: array (employees, labels, 4) with columns KPI_COUNT_COLUMNS
+        - label_ids, label_weights, label_group_ids: per-label sequences aligned with axis 1
+        - quality_profile, groups: as for compute_group_metrics
+        - present: optional (employees, labels) mask from build_count_tensor; labels outside the
+          mask contribute zero and are left out of the materialized details
+
+        Returns dict of arrays:
+        {
+          'group_ids': [gid, ...],            # axis 1 of the group arrays
+          'groups': normalized group info (code/name/weight) keyed by gid,
+          'label_ids', 'label_weights', 'label_group_ids': per-label inputs (weights normalized),
+          'counts': the input tensor,
+          'E_G': (employees, labels),
+          'num', 'den', 'ratio', 'score': (employees, groups),
+          'total_score': (employees,),
+        }
+
+        Group sums are accumulated label by label in the same order as compute_group_metrics,
+        so results are bit-identical to the per-employee function; only the employee axis is vectorized.
+        """
+        group_map = self._normalize_groups(groups)
+        group_ids = list(group_map.keys())
+        col_by_group = {gid: j for j, gid in enumerate(group_ids)}
+        n_emp = counts.shape[0]
+
+        coef_on = float(quality_profile.coef_ontime or 0.0)
+        coef_late = float(quality_profile.coef_late or 0.0)
+        coef_over = float(quality_profile.coef_overdue or 0.0)
+        weights = [float(w or 1.0) for w in label_weights]
+
+        assigned = counts[:, :, 0]
+        e_g = counts[:, :, 1] * coef_on + counts[:, :, 2] * coef_late + counts[:, :, 3] * coef_over
+
+        num = np.zeros((n_emp, len(group_ids)), dtype=np.float64)
+        den = np.zeros((n_emp, len(group_ids)), dtype=np.float64)
+        for j, gid in enumerate(label_group_ids):
+            g = col_by_group.get(gid)
+            if g is None:
+                # Skip labels whose group is not in scope
+                continue
+            num[:, g] += e_g[:, j] * weights[j]
+            den[:, g] += assigned[:, j] * 1.0 * weights[j]
+
+        ratio = np.divide(num, den, out=np.zeros_like(num), where=den != 0)
+        group_weights = np.array([group_map[gid]['weight'] for gid in group_ids], dtype=np.float64)
+        score = ratio * group_weights
+        total = np.zeros(n_emp, dtype=np.float64)
+        for g in range(len(group_ids)):
+            total += score[:, g]
+
+        return {
+            'group_ids': group_ids,
+            'groups': group_map,
+            'label_ids': list(label_ids),
+            'label_weights': weights,
+            'label_group_ids': list(label_group_ids),
+            'counts': counts,
+            'present': present,
+            'E_G': e_g,
+            'num': num,
+            'den': den,
+            'ratio': ratio,
+            'score': score,
+            'total_score': total,
+        }
+
+    def materialize_group_metrics(self, matrix, row):
+        """Build the compute_group_metrics-shaped dict for one employee row of a matrix result.
+        Only call this for rows that are about to be persisted."""
+        groups = {}
+        for g, gid in enumerate(matrix['group_ids']):
+            info = matrix['groups'][gid]
+            groups[gid] = {
+                'group_id': gid,
+                'code': info['code'],
+                'name': info['name'],
+                'weight': info['weight'],
+                'num': float(matrix['num'][row, g]),
+                'den': float(matrix['den'][row, g]),
+                'labels': [],
+                'ratio': float(matrix['ratio'][row, g]),
+                'score': float(matrix['score'][row, g]),
+            }
+        counts = matrix['counts']
+        present = matrix['present']
+        for j, lab_id in enumerate(matrix['label_ids']):
+            gentry = groups.get(matrix['label_group_ids'][j])
+            if gentry is None or (present is not None and not present[row, j]):
+                continue
+            gentry['labels'].append({
+                'label_id': lab_id,
+                'weight': matrix['label_weights'][j],
+                'assigned': int(counts[row, j, 0]),
+                'ontime': int(counts[row, j, 1]),
+                'late': int(counts[row, j, 2]),
+                'overdue': int(counts[row, j, 3]),
+                'E_G': float(matrix['E_G'][row, j]),
+            })
+        return {
+            'total_score': float(matrix['total_score'][row]),
+            'groups': groups,
+        }
+
+    def compute_group_metrics_bulk(self, counts_by_employee, quality_profile, groups, labels):
+        """
+        Compute metrics for many employees: {employee_id: metrics}.
+
+        Uses compute_group_metrics_matrix when NumPy is available, otherwise falls back to
+        compute_group_metrics per employee. Both paths return identical figures.
+        """
+        if np is None or not counts_by_employee:
+            return {
+                emp_id: self.compute_group_metrics(counts, quality_profile, groups)
+                for emp_id, counts in counts_by_employee.items()
+            }
+        label_ids = labels.ids
+        employee_ids, counts, present = self.build_count_tensor(counts_by_employee, label_ids)
+        matrix = self.compute_group_metrics_matrix(
+            counts,
+            label_ids,
+            [lab.weight or 1.0 for lab in labels],
+            [lab.group_id.id if lab.group_id else False for lab in labels],
+            quality_profile,
+            groups,
+            present=present,
+        )
+        return {emp_id: self.materialize_group_metrics(matrix, i) for i, emp_id in enumerate(employee_ids)}
+
+    def counts_from_records(self, records, labels):
+        """
+        Rebuild counts_by_label per employee from the label counts stored in payroll.kpi_record.details.
+
+        Label weight and group come from the current label configuration so that re-scoring picks up
+        weight changes. Labels that are no longer in `labels` are dropped, labels without stored counts
+        are treated as zero (a full compute is needed to count tasks for newly added labels).
+
+        Returns {employee_id: counts_by_label} with labels in the same order as `labels`.
+        """
+        label_order = {lab.id: idx for idx, lab in enumerate(labels)}
+        labels_by_id = {lab.id: lab for lab in labels}
+        res = {}
+        for rec in records:
+            details = rec.details or {}
+            emp_counts = res.setdefault(rec.employee_id.id, {})
+            for row in (details.get('labels') or []):
+                lab = labels_by_id.get(row.get('label_id'))
+                if not lab:
+                    continue
+                emp_counts[lab.id] = {
+                    'label_id': lab.id,
+                    'group_id': lab.group_id.id if lab.group_id else False,
+                    'weight': lab.weight or 1.0,
+                    'assigned': int(row.get('assigned') or 0),
+                    'ontime': int(row.get('ontime') or 0),
+                    'late': int(row.get('late') or 0),
+                    'overdue': int(row.get('overdue') or 0),
+                }
+        for emp_id, emp_counts in res.items():
+            res[emp_id] = dict(sorted(emp_counts.items(), key=lambda kv: label_order[kv[0]]))
+        return res
+
+    def rescore_period(self, period, quality_profile, employee_ids=None):
+        """
+        Recompute E_G, ratios and scores of a period from stored counts only (no project3c.task access).
+
+        Returns (metrics_by_employee, old_totals) where old_totals is {employee_id: sum of stored scores}.
+        Nothing is written; pass the metrics to upsert_kpi_records_batch to apply them.
+        """
+        domain = [('period_id', '=', period.id)]
+        if employee_ids is not None:
+            domain.append(('employee_id', 'in', list(employee_ids)))
+        records = self.env['payroll.kpi_record'].search(domain)
+        groups = self.env['payroll.kpi_group'].search([('active', '=', True)])
+        labels = self.env['payroll.kpi_label'].search([('active', '=', True)])
+
+        old_totals = {}
+        for rec in records:
+            old_totals[rec.employee_id.id] = old_totals.get(rec.employee_id.id, 0.0) + float(rec.score or 0.0)
+        counts_by_emp = self.counts_from_records(records, labels)
+        metrics_by_emp = self.compute_group_metrics_bulk(counts_by_emp, quality_profile, groups, labels)
+        return metrics_by_emp, old_totals
+
+    def _kpi_record_details(self, g):
+        """Build the details JSON stored on payroll.kpi_record for one group entry of metrics."""
+        return {
+            'code': g.get('code'),
+            'name': g.get('name'),
+            'weight': float(g.get('weight', 0.0) or 0.0),
+            'num': float(g.get('num', 0.0) or 0.0),
+            'den': float(g.get('den', 0.0) or 0.0),
+            'ratio': float(g.get('ratio', 0.0) or 0.0),
+            'labels': g.get('labels', []),
+        }
+
+    @staticmethod
+    def _json_normalize(value):
+        """Round-trip a value through JSON so it compares equal to what a Json field returns
+        (dict keys become strings, tuples become lists)."""
+        return json.loads(json.dumps(value or {}))
+
     def upsert_kpi_records(self, employee, period, metrics):
         """
         Persist KPI records per group for an employee and period using computed metrics.
@@ -240,39 +573,67 @@ class PayrollKpiEngine(models.AbstractModel):
         """
         if not employee or not period or not metrics:
             return self.env["payroll.kpi_record"], 0.0
+        records, totals = self.upsert_kpi_records_batch(period, {employee.id: metrics})
+        return records, totals.get(employee.id, 0.0)
 
-        KpiRecord = self.env["payroll.kpi_record"]
-        records = self.env["payroll.kpi_record"]
-        total = float(metrics.get('total_score', 0.0) or 0.0)
-
-        groups = metrics.get('groups') or {}
-        for gid, g in groups.items():
-            vals = {
-                'employee_id': employee.id,
-                'period_id': period.id,
-                'group_id': gid,
-                'score': float(g.get('score', 0.0) or 0.0),
-                'details': {
-                    'code': g.get('code'),
-                    'name': g.get('name'),
-                    'weight': float(g.get('weight', 0.0) or 0.0),
-                    'num': float(g.get('num', 0.0) or 0.0),
-                    'den': float(g.get('den', 0.0) or 0.0),
-                    'ratio': float(g.get('ratio', 0.0) or 0.0),
-                    'labels': g.get('labels', []),
-                }
-            }
+    def upsert_kpi_records_batch(self, period, metrics_by_employee):
+        """
+        Persist KPI records of many employees for one period in a handful of statements.
 
-            existing = KpiRecord.search([
-                ('employee_id', '=', employee.id),
-                ('period_id', '=', period.id),
-                ('group_id', '=', gid),
-            ], limit=1)
-            if existing:
-                existing.write(vals)
-                records |= existing
-            else:
-                rec = KpiRecord.create(vals)
-                records |= rec
+        Params:
+        - period: payroll.kpi_period record
+        - metrics_by_employee: dict {employee_id: metrics} as returned by compute_group_metrics
 
-        return records, total
+        Existing records of the period are loaded with a single search and indexed by
+        (employee_id, group_id). Rows whose score (at the field's precision) and details are unchanged
+        are skipped, changed rows are grouped by identical values and written with one write() per
+        group, and missing rows are inserted with one multi-record create.
+
+        Returns (records, totals) where records is the recordset of all created/updated/unchanged
+        records and totals is {employee_id: total_score}.
+        """
+        KpiRecord = self.env["payroll.kpi_record"]
+        totals = {}
+        if not period or not metrics_by_employee:
+            return KpiRecord, totals
+
+        existing = KpiRecord.search([
+            ('period_id', '=', period.id),
+            ('employee_id', 'in', list(metrics_by_employee.keys())),
+        ])
+        by_key = {(r.employee_id.id, r.group_id.id): r for r in existing}
+        digits = KpiRecord._fields['score'].get_digits(self.env)
+
+        records = KpiRecord
+        to_create = []
+        to_update = {}
+        for emp_id, metrics in metrics_by_employee.items():
+            metrics = metrics or {}
+            totals[emp_id] = float(metrics.get('total_score', 0.0) or 0.0)
+            for gid, g in (metrics.get('groups') or {}).items():
+                score = float(g.get('score', 0.0) or 0.0)
+                details = self._kpi_record_details(g)
+                rec = by_key.get((emp_id, gid))
+                if not rec:
+                    to_create.append({
+                        'employee_id': emp_id,
+                        'period_id': period.id,
+                        'group_id': gid,
+                        'score': score,
+                        'details': details,
+                    })
+                    continue
+                records |= rec
+                same_score = float_compare(rec.score, score, precision_digits=digits[1]) == 0 if digits \
+                    else rec.score == score
+                if same_score and rec.details == self._json_normalize(details):
+                    continue
+                group_key = (score, json.dumps(details, sort_keys=True))
+                to_update.setdefault(group_key, [KpiRecord, score, details])[0] |= rec
+
+        # Scores and details repeat across employees (e.g. no tasks, full marks), so groups stay few
+        for recs, score, details in to_update.values():
+            recs.write({'score': score, 'details': details})
+        if to_create:
+            records |= KpiRecord.create(to_create)
+        return records, totals
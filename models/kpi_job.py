@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .kpi import KPI_WATERMARK_LAG
+
+_logger = logging.getLogger(__name__)
+
+# Seconds a single cron run may spend on chunks before re-triggering itself. Kept well below the
+# default worker limit_time_real (120 s); override with the system parameter below
+JOB_TIME_BUDGET = 75
+JOB_TIME_BUDGET_PARAM = "payroll_3c.kpi_job_time_budget"
+
+
+def job_time_budget(env, param, default):
+    """Seconds of cron time from system parameter `param`, falling back to `default` when unset or invalid."""
+    try:
+        budget = int(env["ir.config_parameter"].sudo().get_param(param, default))
+    except (TypeError, ValueError):
+        return default
+    return budget if budget > 0 else default
+
+
+class PayrollKpiJob(models.Model):
+    _name = "payroll.kpi_job"
+    _description = "KPI Background Computation Job"
+    _order = "id desc"
+
+    name = fields.Char(required=True)
+    period_id = fields.Many2one("payroll.kpi_period", string="KPI Period", required=True, ondelete="cascade")
+    sheet_id = fields.Many2one("payroll.kpi_sheet", string="KPI Sheet", ondelete="cascade")
+    quality_profile_id = fields.Many2one(
+        "payroll.kpi_quality_profile", string="Quality Profile", required=True, ondelete="restrict"
+    )
+    overdue_threshold_days = fields.Integer(string="Overdue threshold (days)", default=7)
+    set_watermark = fields.Boolean(
+        help="Full-scope compute: set the period's last KPI compute date when the job finishes.")
+    # Ordered employee ids to process; next_index points at the first one not yet committed
+    employee_ids = fields.Json(string="Employees")
+    chunk_size = fields.Integer(default=200)
+    next_index = fields.Integer(string="Processed", default=0, readonly=True)
+    total_count = fields.Integer(string="Employees to process", readonly=True)
+    state = fields.Selection([
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+        ("cancel", "Cancelled"),
+    ], default="pending", required=True, readonly=True)
+    date_start = fields.Datetime(string="Started", readonly=True)
+    date_done = fields.Datetime(string="Finished", readonly=True)
+    last_error = fields.Text(readonly=True)
+    progress = fields.Float(string="Progress (%)", compute="_compute_progress")
+    eta = fields.Datetime(string="Estimated End", compute="_compute_progress")
+
+    _sql_constraints = [
+        ("kpi_job_chunk_size_pos", "CHECK(chunk_size > 0)", "Chunk size must be > 0"),
+    ]
+
+    @api.depends("next_index", "total_count", "date_start", "state")
+    def _compute_progress(self):
+        now = fields.Datetime.now()
+        for job in self:
+            total = job.total_count or 0
+            done = min(job.next_index or 0, total)
+            job.progress = (done * 100.0 / total) if total else (100.0 if job.state == "done" else 0.0)
+            job.eta = False
+            if job.state == "running" and job.date_start and 0 < done < total:
+                elapsed = (now - job.date_start).total_seconds()
+                job.eta = now + timedelta(seconds=elapsed / done * (total - done))
+
+    @api.model
+    def enqueue(self, period, quality_profile, employees, sheet=None, overdue_threshold_days=7, set_watermark=False):
+        """Create a pending job for `employees` and wake up the KPI job cron. Returns the job."""
+        emp_ids = employees.ids
+        job = self.create({
+            "name": _("KPI %s") % (sheet.name if sheet else period.name),
+            "period_id": period.id,
+            "sheet_id": sheet.id if sheet else False,
+            "quality_profile_id": quality_profile.id,
+            "overdue_threshold_days": overdue_threshold_days,
+            "set_watermark": set_watermark,
+            "employee_ids": emp_ids,
+            "total_count": len(emp_ids),
+        })
+        cron = self.env.ref("payroll_3c.ir_cron_kpi_jobs", raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return job
+
+    def _commit(self):
+        # Never commit inside tests; the test transaction is rolled back as a whole
+        if not getattr(threading.current_thread(), "testing", False):
+            self.env.cr.commit()
+
+    def _process(self, deadline):
+        """Process chunks until done or `deadline` (time.time()) is reached.
+
+        Each chunk (KPI records of every group of its employees, sheet lines and next_index) is written
+        in one transaction, so a crash rolls back at most the current chunk and never leaves an employee
+        with only part of its groups. Returns True when the job is finished.
+        """
+        self.ensure_one()
+        Engine = self.env["payroll.kpi_engine"]
+        Employee = self.env["employee3c.employee.base"]
+        if self.state == "pending":
+            self.write({"state": "running", "date_start": fields.Datetime.now()})
+            self._commit()
+
+        groups = self.env["payroll.kpi_group"].search([("active", "=", True)])
+        labels = self.env["payroll.kpi_label"].search([("active", "=", True)])
+        emp_ids = self.employee_ids or []
+        size = self.chunk_size or 200
+        while self.next_index < len(emp_ids):
+            if time.time() > deadline:
+                return False
+            # Pick up a cancel issued from the UI since the last commit
+            self.invalidate_recordset(["state"])
+            if self.state == "cancel":
+                return True
+            start = self.next_index
+            chunk = emp_ids[start:start + size]
+            try:
+                employees = Employee.browse(chunk).exists()
+                counts_by_emp = {
+                    emp.id: Engine.aggregate_employee_label_counts(
+                        emp, self.period_id, labels, overdue_threshold_days=self.overdue_threshold_days or 7)
+                    for emp in employees
+                }
+                metrics_by_emp = Engine.compute_group_metrics_bulk(counts_by_emp, self.quality_profile_id, groups, labels)
+                _records, totals = Engine.upsert_kpi_records_batch(self.period_id, metrics_by_emp)
+                if self.sheet_id:
+                    self.sheet_id._update_lines_from_metrics(metrics_by_emp, totals)
+                self.next_index = start + len(chunk)
+                self.env.flush_all()
+                self._commit()
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.exception("[payroll.kpi_job] job %s failed at employee #%s", self.id, start)
+                self.write({"state": "failed", "last_error": str(e)})
+                self._commit()
+                return True
+
+        if self.sheet_id:
+            self.sheet_id._finalize_compute(emp_ids)
+        if self.set_watermark:
+            self.period_id.last_compute_date = self.create_date - KPI_WATERMARK_LAG
+        if self.period_id.state == "draft":
+            self.period_id.state = "computed"
+        self.write({"state": "done", "date_done": fields.Datetime.now()})
+        self._commit()
+        return True
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Run pending jobs and resume running ones (e.g. after a worker crash or timeout)."""
+        deadline = time.time() + job_time_budget(self.env, JOB_TIME_BUDGET_PARAM, JOB_TIME_BUDGET)
+        for job in self.search([("state", "in", ("pending", "running"))], order="id"):
+            if not job._process(deadline):
+                # Out of time: continue from the last committed chunk in a fresh cron run
+                self.env.ref("payroll_3c.ir_cron_kpi_jobs")._trigger()
+                return
+
+    def action_resume(self):
+        """Re-queue failed or cancelled jobs; processing restarts at the first uncommitted chunk."""
+        for job in self:
+            if job.state not in ("failed", "cancel"):
+                raise UserError(_("Only failed or cancelled jobs can be resumed."))
+        for job in self:
+            job.write({"state": "running" if job.date_start else "pending", "last_error": False})
+        self.env.ref("payroll_3c.ir_cron_kpi_jobs")._trigger()
+        return True
+
+    def action_cancel(self):
+        self.filtered(lambda j: j.state in ("pending", "running")).write({"state": "cancel"})
+        return True
@@ -1,5 +1,6 @@
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from odoo.tools import float_compare
 import json
 
 
@@ -31,6 +32,10 @@ class PayrollKpiSheet(models.Model):
     ], default="draft")
 
     line_ids = fields.One2many("payroll.kpi_sheet.line", "sheet_id", string="Lines")
+    job_id = fields.Many2one("payroll.kpi_job", string="KPI Job", readonly=True, copy=False)
+    job_state = fields.Selection(related="job_id.state", string="Job Status")
+    job_progress = fields.Float(related="job_id.progress", string="Progress (%)")
+    job_eta = fields.Datetime(related="job_id.eta", string="Estimated End")
 
     @api.onchange("run_id")
     def _onchange_run_id_fill_name_and_period(self):
@@ -65,6 +70,72 @@ class PayrollKpiSheet(models.Model):
         self.quality_profile_id = prof.id
         return prof
 
+    def _update_lines_from_metrics(self, metrics_by_emp, totals, create_missing=True):
+        """Write KPI totals/details into this sheet's lines, skipping lines whose figures are unchanged.
+        Lines for employees without one are created in a single batch unless create_missing is False.
+        """
+        self.ensure_one()
+        Engine = self.env['payroll.kpi_engine']
+        lines_by_emp = {l.employee_id.id: l for l in self.line_ids}
+        lines_to_create = []
+        for emp_id, metrics in metrics_by_emp.items():
+            total = totals.get(emp_id, 0.0)
+            details = {
+                'total_score': total,
+                'groups': metrics.get('groups', {}),
+            }
+            line = lines_by_emp.get(emp_id)
+            if not line:
+                if create_missing:
+                    lines_to_create.append({
+                        'sheet_id': self.id,
+                        'employee_id': emp_id,
+                        'total_score': total,
+                        'details': details,
+                    })
+            elif (float_compare(line.total_score, total, precision_digits=4) != 0
+                  or line.details != Engine._json_normalize(details)):
+                line.write({'total_score': total, 'details': details})
+        if lines_to_create:
+            self.env['payroll.kpi_sheet.line'].create(lines_to_create)
+
+    def _ensure_period(self):
+        """Return the sheet's KPI period, deriving (or creating) it from the payroll cycle dates."""
+        self.ensure_one()
+        if not self.run_id:
+            raise UserError(_("KPI Sheet must be linked to a Payroll Cycle."))
+        # Ensure period from run dates
+        d_from = getattr(self.run_id, 'date_start', None) or getattr(self.run_id, 'date_from', None)
+        d_to = getattr(self.run_id, 'date_end', None) or getattr(self.run_id, 'date_to', None)
+        if not (d_from and d_to):
+            raise UserError(_("Payroll Cycle is missing date range."))
+
+        period = self.period_id
+        if not period:
+            Period = self.env['payroll.kpi_period']
+            period = Period.search([
+                ('date_start', '=', d_from),
+                ('date_end', '=', d_to),
+            ], limit=1)
+            if not period:
+                period = Period.create({
+                    'name': f"KPI {d_from} - {d_to}",
+                    'date_start': d_from,
+                    'date_end': d_to,
+                    'state': 'draft',
+                })
+            self.period_id = period.id
+        return period
+
+    def _finalize_compute(self, employee_ids):
+        """Remove lines for employees no longer in the run and mark the sheet done."""
+        self.ensure_one()
+        keep_emp_ids = set(employee_ids)
+        lines_to_remove = self.line_ids.filtered(lambda l: l.employee_id.id not in keep_emp_ids)
+        if lines_to_remove:
+            lines_to_remove.unlink()
+        self.state = 'done'
+
     def action_compute_kpi(self):
         """Compute KPI for all employees in the linked payroll cycle and persist records.
         - Aligns KPI period with the payroll run date range.
@@ -76,30 +147,7 @@ class PayrollKpiSheet(models.Model):
         Label = self.env['payroll.kpi_label']
 
         for sheet in self:
-            if not sheet.run_id:
-                raise UserError(_("KPI Sheet must be linked to a Payroll Cycle."))
-            # Ensure period from run dates
-            d_from = getattr(sheet.run_id, 'date_start', None) or getattr(sheet.run_id, 'date_from', None)
-            d_to = getattr(sheet.run_id, 'date_end', None) or getattr(sheet.run_id, 'date_to', None)
-            if not (d_from and d_to):
-                raise UserError(_("Payroll Cycle is missing date range."))
-
-            # Ensure period exists
-            period = sheet.period_id
-            if not period:
-                Period = self.env['payroll.kpi_period']
-                period = Period.search([
-                    ('date_start', '=', d_from),
-                    ('date_end', '=', d_to),
-                ], limit=1)
-                if not period:
-                    period = Period.create({
-                        'name': f"KPI {d_from} - {d_to}",
-                        'date_start': d_from,
-                        'date_end': d_to,
-                        'state': 'draft',
-                    })
-                sheet.period_id = period.id
+            period = sheet._ensure_period()
 
             # Ensure quality profile
             qprof = sheet._ensure_quality_profile()
@@ -116,36 +164,42 @@ class PayrollKpiSheet(models.Model):
                     sheet.line_ids.unlink()
                 continue
 
-            # Index existing lines by employee to update
-            lines_by_emp = {l.employee_id.id: l for l in sheet.line_ids}
-            keep_emp_ids = set()
-
-            for emp in employees:
-                counts = Engine.aggregate_employee_label_counts(emp, period, labels)
-                metrics = Engine.compute_group_metrics(counts, qprof, groups)
-                _records, total = Engine.upsert_kpi_records(emp, period, metrics)
-
-                details = {
-                    'total_score': total,
-                    'groups': metrics.get('groups', {}),
-                }
-
-                if emp.id in lines_by_emp:
-                    line = lines_by_emp[emp.id]
-                    line.write({'total_score': total, 'details': details})
-                else:
-                    self.env['payroll.kpi_sheet.line'].create({
-                        'sheet_id': sheet.id,
-                        'employee_id': emp.id,
-                        'total_score': total,
-                        'details': details,
-                    })
-                keep_emp_ids.add(emp.id)
-
-            # Remove lines for employees no longer in run
-            lines_to_remove = sheet.line_ids.filtered(lambda l: l.employee_id.id not in keep_emp_ids)
-            if lines_to_remove:
-                lines_to_remove.unlink()
+            counts_by_emp = {
+                emp.id: Engine.aggregate_employee_label_counts(emp, period, labels)
+                for emp in employees
+            }
+            metrics_by_emp = Engine.compute_group_metrics_bulk(counts_by_emp, qprof, groups, labels)
+            _records, totals = Engine.upsert_kpi_records_batch(period, metrics_by_emp)
+            sheet._update_lines_from_metrics(metrics_by_emp, totals)
+            sheet._finalize_compute(metrics_by_emp.keys())
+        return True
 
-            sheet.state = 'done'
+    def action_compute_kpi_background(self):
+        """Queue KPI computation of the cycle's employees as a background job (see payroll.kpi_job)."""
+        Job = self.env['payroll.kpi_job']
+        for sheet in self:
+            if sheet.job_id and sheet.job_id.state in ('pending', 'running'):
+                raise UserError(_("A KPI computation is already in progress for this sheet."))
+            period = sheet._ensure_period()
+            qprof = sheet._ensure_quality_profile()
+            employees = sheet.run_id.slip_ids.mapped('employee_id')
+            sheet.job_id = Job.enqueue(period, qprof, employees, sheet=sheet)
         return True
+
+    def action_open_rescore_wizard(self):
+        """Open the re-score wizard for this sheet's KPI period (stored counts, no task scan)."""
+        self.ensure_one()
+        if not self.period_id:
+            raise UserError(_("KPI Sheet has no KPI Period to re-score."))
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Re-score KPI'),
+            'res_model': 'payroll.kpi.rescore.wizard',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {
+                'default_period_id': self.period_id.id,
+                'default_sheet_id': self.id,
+                'default_quality_profile_id': self.quality_profile_id.id,
+            },
+        }
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+# Log rows older than this are dropped by the autovacuum; KPI periods are recomputed well within it
+KPI_TASK_LOG_RETENTION = timedelta(days=120)
+
+
+class PayrollKpiTaskLog(models.Model):
+    """Users who lost a task, by reassignment or deletion.
+
+    Their tasks' write_date no longer points at them (or the row is gone), so the incremental KPI compute
+    reads this log next to the task write_dates to recompute them too.
+    """
+    _name = "payroll.kpi_task_log"
+    _description = "KPI Task Reassignment / Deletion Log"
+    _order = "id desc"
+
+    user_id = fields.Many2one("res.users", string="Previous assignee", required=True, index=True, ondelete="cascade")
+    task_ref = fields.Integer(string="Task ID", help="Id of the task; it may no longer exist.")
+    reason = fields.Selection([("reassign", "Reassigned"), ("unlink", "Deleted")], required=True)
+
+    @api.model
+    def _log_tasks(self, tasks, reason):
+        vals_list = [{"user_id": task.assignee_id.id, "task_ref": task.id, "reason": reason}
+                     for task in tasks if task.assignee_id]
+        if vals_list:
+            self.sudo().create(vals_list)
+
+    @api.model
+    def user_ids_since(self, since, user_ids=None):
+        """Ids of users who lost a task after `since`, optionally among `user_ids`."""
+        domain = [("create_date", ">", since)]
+        if user_ids is not None:
+            domain.append(("user_id", "in", user_ids))
+        rows = self.sudo().read_group(domain, ["user_id"], ["user_id"])
+        return {r["user_id"][0] for r in rows if r.get("user_id")}
+
+    @api.autovacuum
+    def _gc_task_log(self):
+        self.sudo().search([("create_date", "<", fields.Datetime.now() - KPI_TASK_LOG_RETENTION)]).unlink()
+
+
+class Project3cTask(models.Model):
+    _inherit = "project3c.task"
+
+    def write(self, vals):
+        if "assignee_id" in vals:
+            self.env["payroll.kpi_task_log"]._log_tasks(
+                self.filtered(lambda t: t.assignee_id.id != vals["assignee_id"]), "reassign")
+        return super().write(vals)
+
+    def unlink(self):
+        self.env["payroll.kpi_task_log"]._log_tasks(self, "unlink")
+        return super().unlink()
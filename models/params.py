@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from odoo import fields, models
+from odoo import api, fields, models, tools
+
+from .pit import DEFAULT_PIT_BRACKETS, PitTable
 
 
 class PayrollVNParams(models.Model):
@@ -16,11 +18,22 @@ class PayrollVNParams(models.Model):
     bhyt_rate_cmp = fields.Float(string="BHYT Company %", default=3.0)
     bhtn_rate_emp = fields.Float(string="BHTN Employee %", default=1.0)
     bhtn_rate_cmp = fields.Float(string="BHTN Company %", default=1.0)
+    pit_bracket_ids = fields.One2many("payroll.vn.pit.bracket", "params_id", string="PIT Brackets")
+    # Payslip headline totals (payroll.payslip._compute_totals)
+    gross_code = fields.Char(string="Gross code", help="Rule code holding gross pay. Empty: sum of earning lines except the net code.")
+    net_code = fields.Char(string="Net code", default="NET", help="Rule code holding net pay. Missing: gross - deductions.")
 
     _sql_constraints = [
         ("vn_params_singleton_name_unique", "unique(name)", "VN Parameters must be unique."),
     ]
 
+    def write(self, vals):
+        res = super().write(vals)
+        # Stored payslip totals are derived from these codes of the params in use
+        if {'gross_code', 'net_code'} & set(vals) and self._get_default_params() in self:
+            self.env['payroll.payslip'].sudo()._recompute_all_totals()
+        return res
+
     def action_open_singleton(self):
         rec = self.search([], limit=1)
         if not rec:
@@ -48,3 +61,71 @@ class PayrollVNParams(models.Model):
                 'bhtn_rate_cmp': 1.0,
             })
         return True
+
+    # ---------- PIT engine (tables from pit_bracket_ids, see models/pit.py) ----------
+    @api.model
+    def _get_default_params(self):
+        rec = self.env.ref('payroll_3c.vn_params_default', raise_if_not_found=False)
+        return rec or self.search([], limit=1)
+
+    @tools.ormcache('self.id', 'date')
+    def _pit_brackets_as_of(self, date):
+        """(upper_bound, rate) tuples of the bracket set effective on `date`: latest date_from <= date."""
+        brackets = self.pit_bracket_ids.filtered(lambda b: not b.date_from or b.date_from <= date)
+        if not brackets:
+            return tuple(DEFAULT_PIT_BRACKETS)
+        start = max(b.date_from or fields.Date.to_date('1900-01-01') for b in brackets)
+        current = brackets.filtered(lambda b: (b.date_from or fields.Date.to_date('1900-01-01')) == start)
+        current = current.sorted(lambda b: (not b.upper_bound, b.upper_bound))
+        return tuple((b.upper_bound or None, b.rate / 100.0) for b in current)
+
+    def pit_table(self, date=None):
+        """PitTable effective on `date` (default today); built once per params record and date."""
+        params = self[:1] or self._get_default_params()
+        date = fields.Date.to_date(date) or fields.Date.context_today(self)
+        if not params:
+            return PitTable(DEFAULT_PIT_BRACKETS)
+        return PitTable(params.sudo()._pit_brackets_as_of(date))
+
+    def pit_tax(self, taxable, date=None):
+        return self.pit_table(date).tax(taxable)
+
+    def pit_tax_batch(self, taxables, date=None):
+        """Tax for a sequence of taxable incomes in one call (vectorized when numpy is available)."""
+        return self.pit_table(date).tax_many(taxables)
+
+    def pit_gross_from_net(self, net, date=None, deduction=0.0, insurance_rate=0.0, insurance_fixed=0.0):
+        """Gross salary giving `net` after insurance and PIT; insurance_rate in percent like the BH* rates."""
+        return self.pit_table(date).gross_from_net(
+            net, deduction=deduction, insurance_rate=(insurance_rate or 0.0) / 100.0, insurance_fixed=insurance_fixed)
+
+
+class PayrollVNPitBracket(models.Model):
+    _name = "payroll.vn.pit.bracket"
+    _description = "VN PIT Bracket"
+    _order = "params_id, date_from desc, upper_bound"
+
+    params_id = fields.Many2one("payroll.vn.params", required=True, ondelete="cascade", index=True)
+    date_from = fields.Date(string="Effective From", help="Brackets sharing the latest date on or before the payslip date apply.")
+    upper_bound = fields.Float(string="Taxable up to", help="Monthly taxable income (VND) ending this bracket; 0 for the top bracket.")
+    rate = fields.Float(string="Rate (%)", required=True)
+
+    _sql_constraints = [
+        ("pit_bracket_rate_range", "CHECK(rate >= 0 AND rate < 100)", "PIT rate must be in [0, 100)."),
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        recs = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return recs
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
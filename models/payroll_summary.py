@@ -0,0 +1,76 @@
+from odoo import api, fields, models
+
+# Key of cr.precommit.data holding the batch ids whose summary rows must be rebuilt at commit
+SUMMARY_DIRTY_KEY = "payroll_summary_run_ids"
+
+
+class PayrollSummary(models.Model):
+    """Payslip line totals per (batch, department, category, code, slip state), maintained in SQL.
+
+    Rows of a batch are rebuilt with one DELETE + INSERT ... SELECT ... GROUP BY just before the transaction
+    commits, for every batch whose slips or lines changed in it, so reports read a few rows per month
+    instead of grouping every payslip line.
+    """
+    _name = "payroll.summary"
+    _description = "Payroll Summary"
+    _order = "date desc, run_id, department_id, code"
+    _rec_name = "code"
+
+    run_id = fields.Many2one("payroll.payslip.run", string="Batch", readonly=True, ondelete="cascade", index=True)
+    date = fields.Date(string="Period", readonly=True, index=True)
+    department_id = fields.Many2one("employee3c.department", string="Phòng ban", readonly=True)
+    category_id = fields.Many2one("payroll.category", string="Category", readonly=True)
+    category_type = fields.Selection(
+        [("earn", "Earning"), ("ded", "Deduction"), ("contrib", "Contribution")], string="Category Type", readonly=True)
+    code = fields.Char(string="Rule Code", readonly=True)
+    state = fields.Selection([
+        ("draft", "Draft"),
+        ("to_approve", "To Approve"),
+        ("approved", "Approved"),
+        ("done", "Done"),
+    ], string="Payslip Status", readonly=True)
+    total = fields.Float(readonly=True)
+    line_count = fields.Integer(string="Lines", readonly=True)
+
+    def init(self):
+        # Full rebuild on install/upgrade; afterwards only touched batches are refreshed
+        self.env.cr.execute("SELECT id FROM payroll_payslip_run")
+        self._refresh_runs([r[0] for r in self.env.cr.fetchall()])
+
+    @api.model
+    def _mark_runs_dirty(self, run_ids):
+        """Schedule the summary rebuild of `run_ids` once, right before the current transaction commits."""
+        run_ids = {rid for rid in run_ids if rid}
+        if not run_ids:
+            return
+        data = self.env.cr.precommit.data
+        if SUMMARY_DIRTY_KEY not in data:
+            data[SUMMARY_DIRTY_KEY] = set()
+            self.env.cr.precommit.add(self._refresh_dirty_runs)
+        data[SUMMARY_DIRTY_KEY] |= run_ids
+
+    def _refresh_dirty_runs(self):
+        run_ids = self.env.cr.precommit.data.pop(SUMMARY_DIRTY_KEY, set())
+        self._refresh_runs(list(run_ids))
+
+    @api.model
+    def _refresh_runs(self, run_ids):
+        if not run_ids:
+            return
+        self.env["payroll.payslip.line"].flush_model()
+        self.env["payroll.payslip"].flush_model()
+        self.env.cr.execute("DELETE FROM payroll_summary WHERE run_id = ANY(%s)", [run_ids])
+        self.env.cr.execute("""
+            INSERT INTO payroll_summary (run_id, date, department_id, category_id, category_type, code, state,
+                                         total, line_count, create_uid, create_date, write_uid, write_date)
+            SELECT r.id, r.date_start, p.employee_department_id, l.category_id, c.type, l.code, p.state,
+                   SUM(COALESCE(l.amount, 0) * COALESCE(l.quantity, 0)), COUNT(*),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM payroll_payslip_line l
+              JOIN payroll_payslip p ON p.id = l.payslip_id
+              JOIN payroll_payslip_run r ON r.id = p.run_id
+         LEFT JOIN payroll_category c ON c.id = l.category_id
+             WHERE r.id = ANY(%(runs)s) AND p.state != 'cancel'
+          GROUP BY r.id, r.date_start, p.employee_department_id, l.category_id, c.type, l.code, p.state
+        """, {"runs": run_ids, "uid": self.env.uid})
+        self.invalidate_model()
@@ -1,8 +1,31 @@
 # -*- coding: utf-8 -*-
 import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError  # <-- ensure import
 from odoo.tools.safe_eval import safe_eval
+from .kpi import KPI_WATERMARK_LAG, kpi_html_cache_key, kpi_html_cache_get, kpi_html_cache_set
+from .run_pipeline import PIPELINE_STAGES
+from .pit import DEFAULT_PIT_BRACKETS, PitTable
+
+_logger = logging.getLogger(__name__)
+
+# payroll.payslip.run fields copied to its payroll.sheet; writing any of them re-syncs the sheet
+SHEET_SYNC_FIELDS = {'date_start', 'date_end', 'month', 'year'}
+# Payslip fields that move its lines between payroll.summary rows
+SUMMARY_SLIP_FIELDS = {'state', 'run_id', 'employee_id'}
+
+# Stored headline totals and the payslips recomputed per flush when the VN params codes change
+TOTAL_FIELDS = ['gross_amount', 'deduction_amount', 'net_amount', 'employer_cost']
+TOTALS_RECOMPUTE_CHUNK = 1000
+
+# Net-to-gross solver: iteration cap per slip and accepted |net - target| in VND
+GROSS_UP_MAX_ITER = 30
+GROSS_UP_TOLERANCE = 1.0
 
 
 class PayrollPayslip(models.Model):
@@ -47,17 +70,76 @@ class PayrollPayslip(models.Model):
     sheet_values = fields.Text(string="Sheet JSON", compute='_compute_sheet_values', readonly=True, store=False)
 
     # KPI integration for this payslip period
-    kpi_period_id = fields.Many2one('payroll.kpi_period', string='KPI Period', compute='_compute_kpi_period', store=False, readonly=True)
-    kpi_record_ids = fields.Many2many('payroll.kpi_record', string='KPI Records', compute='_compute_kpi_records', store=False, readonly=True)
-    kpi_total_score = fields.Float(string='KPI Total (%)', compute='_compute_kpi_total', store=False, readonly=True)
+    # Stored and computed per recordset; payroll.kpi_period / payroll.kpi_record trigger recomputes
+    kpi_period_id = fields.Many2one('payroll.kpi_period', string='KPI Period', compute='_compute_kpi_period', store=True, readonly=True, index=True)
+    kpi_record_ids = fields.Many2many(
+        'payroll.kpi_record', 'payroll_payslip_kpi_record_rel', 'payslip_id', 'record_id',
+        string='KPI Records', compute='_compute_kpi_records', store=True, readonly=True)
+    kpi_total_score = fields.Float(string='KPI Total (%)', compute='_compute_kpi_total', store=True, readonly=True)
+    # Not stored: only the payslip form shows it, so list views never build the HTML
     kpi_details_html = fields.Html(string='KPI Breakdown', compute='_compute_kpi_html', sanitize=False)
     # KPI adjustments
-    kpi_adj_add = fields.Float(string='KPI Cộng (%)', compute='_compute_kpi_adjustments', store=False, readonly=True)
-    kpi_adj_sub = fields.Float(string='KPI Trừ (%)', compute='_compute_kpi_adjustments', store=False, readonly=True)
-    kpi_adj_net = fields.Float(string='KPI Cộng/Trừ (ròng %)', compute='_compute_kpi_adjustments', store=False, readonly=True)
-    kpi_final_total = fields.Float(string='KPI Cuối cùng (%)', compute='_compute_kpi_adjustments', store=False, readonly=True)
+    # Pure reads of adjust_record_ids; auto lines are synced by payroll.payslip.run.action_sync_kpi_adjustments
+    kpi_adj_add = fields.Float(string='KPI Cộng (%)', compute='_compute_kpi_adjustments', store=True, readonly=True)
+    kpi_adj_sub = fields.Float(string='KPI Trừ (%)', compute='_compute_kpi_adjustments', store=True, readonly=True)
+    kpi_adj_net = fields.Float(string='KPI Cộng/Trừ (ròng %)', compute='_compute_kpi_adjustments', store=True, readonly=True)
+    kpi_final_total = fields.Float(string='KPI Cuối cùng (%)', compute='_compute_kpi_adjustments', store=True, readonly=True)
     adjust_record_ids = fields.One2many('payroll.kpi_adjust_record', 'payslip_id', string='KPI Adjustments')
 
+    # Net-to-gross (guaranteed net) results, written by payroll.payslip.run.action_compute_gross_up
+    net_target = fields.Float(string='Net mục tiêu', readonly=True, copy=False)
+    gross_up_gross = fields.Float(string='Gross giải được', readonly=True, copy=False)
+    gross_up_state = fields.Selection([
+        ('converged', 'Converged'),
+        ('max_iter', 'Iteration cap reached'),
+        ('no_root', 'No gross reaches the target'),
+    ], string='Gross-up', readonly=True, copy=False)
+    gross_up_iterations = fields.Integer(string='Gross-up iterations', readonly=True, copy=False)
+    gross_up_residual = fields.Float(string='Net - target', readonly=True, copy=False)
+    # Set while the slip's line totals are included in payroll.ytd (state done)
+    ytd_posted = fields.Boolean(readonly=True, copy=False)
+    # Headline totals, stored so lists, filters and sorting never load lines
+    gross_amount = fields.Float(string='Gross', compute='_compute_totals', store=True, readonly=True)
+    deduction_amount = fields.Float(string='Deductions', compute='_compute_totals', store=True, readonly=True)
+    net_amount = fields.Float(string='Net', compute='_compute_totals', store=True, readonly=True, index=True)
+    employer_cost = fields.Float(string='Employer Cost', compute='_compute_totals', store=True, readonly=True)
+
+    @api.depends('line_ids.amount', 'line_ids.quantity', 'line_ids.code', 'line_ids.category_id.type')
+    def _compute_totals(self):
+        """Gross/net from the VN params codes when present, otherwise by category type:
+        gross = earnings except net, deductions = 'ded', employer cost = gross + 'contrib'."""
+        params = self.env['payroll.vn.params'].sudo()._get_default_params()
+        gross_code = params.gross_code if params else False
+        net_code = params.net_code if params else 'NET'
+        for slip in self:
+            by_code = {}
+            by_type = {'earn': 0.0, 'ded': 0.0, 'contrib': 0.0}
+            for line in slip.line_ids:
+                total = float(line.amount or 0.0) * float(line.quantity or 0.0)
+                by_code[line.code] = by_code.get(line.code, 0.0) + total
+                ctype = line.category_id.type
+                if ctype in by_type and line.code != net_code:
+                    by_type[ctype] += total
+            gross = by_code[gross_code] if gross_code and gross_code in by_code else by_type['earn']
+            slip.gross_amount = gross
+            slip.deduction_amount = by_type['ded']
+            slip.net_amount = by_code[net_code] if net_code and net_code in by_code else gross - by_type['ded']
+            slip.employer_cost = gross + by_type['contrib']
+
+    @api.model
+    def _recompute_all_totals(self):
+        """Recompute the stored totals of every payslip (the gross/net codes of the VN params changed),
+        chunk by chunk so only one chunk of lines is cached at a time."""
+        self.env.flush_all()
+        slips = self.search([])
+        for start in range(0, len(slips), TOTALS_RECOMPUTE_CHUNK):
+            chunk = slips[start:start + TOTALS_RECOMPUTE_CHUNK]
+            for fname in TOTAL_FIELDS:
+                self.env.add_to_compute(self._fields[fname], chunk)
+            chunk.flush_recordset(TOTAL_FIELDS)
+            chunk.line_ids.invalidate_recordset()
+            chunk.invalidate_recordset()
+
     def _compute_employee_user(self):
         """Deprecated: replaced by related field 'employee_user_id'. Keep for backward compatibility."""
         for rec in self:
@@ -71,19 +153,48 @@ class PayrollPayslip(models.Model):
             rec.employee_avatar_html = f"<div style='width:64px;height:64px;border-radius:50%;background:#ddd;display:flex;align-items:center;justify-content:center;font-weight:bold;'>{initials}</div>"
 
     @api.model
-    def create(self, vals):
-        # Ensure a meaningful name
-        if not vals.get('name') or vals.get('name') == '/':
-            vals['name'] = '/'
-        rec = super().create(vals)
-        if rec.name == '/' or not rec.name:
-            # derive year/month from date_from or today
+    def _reserve_sequence_numbers(self, seq, count):
+        """Take `count` consecutive numbers of `seq` in one statement."""
+        if seq.implementation == 'standard':
+            self.env.cr.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)", ('ir_sequence_%03d' % seq.id, count))
+            return [row[0] for row in self.env.cr.fetchall()]
+        first = seq._update_nogap(seq.number_increment * count)
+        return [first + i * seq.number_increment for i in range(count)]
+
+    @api.model
+    def _assign_names(self, vals_list):
+        """Fill 'name' of vals without one from a block of payroll.payslip sequence numbers.
+        The prefix follows each slip's date_from, e.g. PS/2024/05/0001."""
+        pending = [vals for vals in vals_list if not vals.get('name') or vals.get('name') == '/']
+        if not pending:
+            return
+        seq = self.env['ir.sequence'].sudo().search([
+            ('code', '=', 'payroll.payslip'),
+            ('company_id', 'in', [self.env.company.id, False]),
+        ], order='company_id', limit=1)
+        if not seq or seq.use_date_range:
+            for vals in pending:
+                vals['name'] = self.env['ir.sequence'].next_by_code(
+                    'payroll.payslip', sequence_date=vals.get('date_from')) or '/'
+            return
+        numbers = self._reserve_sequence_numbers(seq, len(pending))
+        prefixes = {}
+        for vals, number in zip(pending, numbers):
             try:
-                d = fields.Date.from_string(rec.date_from) if rec.date_from else fields.Date.context_today(self)
+                d = fields.Date.to_date(vals.get('date_from')) or fields.Date.context_today(self)
             except Exception:
                 d = fields.Date.context_today(self)
-            rec.name = f"PS/{d.year}/{d.month:02d}/{rec.id:04d}"
-        return rec
+            if d not in prefixes:
+                prefixes[d] = seq._get_prefix_suffix(date=d)
+            prefix, suffix = prefixes[d]
+            vals['name'] = prefix + '%%0%sd' % seq.padding % number + suffix
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Ensure a meaningful name, assigned in the same INSERT
+        self._assign_names(vals_list)
+        return super().create(vals_list)
 
     def _compute_sheet_line(self):
         SheetLine = self.env['payroll.sheet.line']
@@ -110,55 +221,58 @@ class PayrollPayslip(models.Model):
         for rec in self:
             rec.sheet_values = rec.sheet_line_id.values if rec.sheet_line_id else False
 
+    @api.depends('date_from', 'date_to')
     def _compute_kpi_period(self):
+        """Match KPI periods by exact date range with one search for the whole recordset."""
         Period = self.env['payroll.kpi_period'].sudo()
+        ranges = {(rec.date_from, rec.date_to) for rec in self if rec.date_from and rec.date_to}
+        period_by_range = {}
+        if ranges:
+            periods = Period.search([
+                ('date_start', 'in', list({r[0] for r in ranges})),
+                ('date_end', 'in', list({r[1] for r in ranges})),
+            ])
+            for period in periods:
+                # Keep the first match per range, like search(limit=1) with the model order
+                period_by_range.setdefault((period.date_start, period.date_end), period.id)
         for rec in self:
-            if rec.date_from and rec.date_to:
-                period = Period.search([
-                    ('date_start', '=', rec.date_from),
-                    ('date_end', '=', rec.date_to),
-                ], limit=1)
-                rec.kpi_period_id = period.id if period else False
-            else:
-                rec.kpi_period_id = False
+            rec.kpi_period_id = period_by_range.get((rec.date_from, rec.date_to), False)
 
+    @api.depends('employee_id', 'kpi_period_id')
     def _compute_kpi_records(self):
-        Record = self.env['payroll.kpi_record']
+        Record = self.env['payroll.kpi_record'].sudo()
+        todo = self.filtered(lambda r: r.employee_id and r.kpi_period_id)
+        ids_by_key = {}
+        if todo:
+            records = Record.search([
+                ('employee_id', 'in', todo.employee_id.ids),
+                ('period_id', 'in', todo.kpi_period_id.ids),
+            ])
+            for r in records:
+                ids_by_key.setdefault((r.employee_id.id, r.period_id.id), []).append(r.id)
         for rec in self:
-            if rec.employee_id and rec.kpi_period_id:
-                records = Record.search([
-                    ('employee_id', '=', rec.employee_id.id),
-                    ('period_id', '=', rec.kpi_period_id.id),
-                ])
-                rec.kpi_record_ids = [(6, 0, records.ids)]
-            else:
-                rec.kpi_record_ids = [(6, 0, [])]
+            ids = ids_by_key.get((rec.employee_id.id, rec.kpi_period_id.id), [])
+            rec.kpi_record_ids = [(6, 0, ids)]
 
+    @api.depends('kpi_total_score', 'adjust_record_ids.total_points', 'adjust_record_ids.kind')
     def _compute_kpi_adjustments(self):
-        Adjust = self.env['payroll.kpi_adjust_record']
         for rec in self:
             add_total = 0.0
             sub_total = 0.0
-            if rec.employee_id and rec.kpi_period_id:
-                # Ensure auto adjustments are synced
-                try:
-                    self.env['payroll.kpi_adjust_record'].sudo().sync_auto_for_employee_period(rec.employee_id, rec.kpi_period_id, payslip=rec)
-                except Exception:
-                    pass
-                # Compute totals only from lines attached to this payslip
-                lines = rec.adjust_record_ids
-                for l in lines:
-                    pts = float(l.total_points or 0.0)
-                    if l.kind == 'add':
-                        add_total += pts
-                    else:
-                        sub_total += pts
+            # Compute totals only from lines attached to this payslip
+            for l in rec.adjust_record_ids:
+                pts = float(l.total_points or 0.0)
+                if l.kind == 'add':
+                    add_total += pts
+                else:
+                    sub_total += pts
             net = add_total - sub_total
             rec.kpi_adj_add = add_total
             rec.kpi_adj_sub = sub_total
             rec.kpi_adj_net = net
             rec.kpi_final_total = (rec.kpi_total_score or 0.0) + net
 
+    @api.depends('kpi_record_ids.score')
     def _compute_kpi_total(self):
         for rec in self:
             total = 0.0
@@ -169,145 +283,163 @@ class PayrollPayslip(models.Model):
                 total = 0.0
             rec.kpi_total_score = total
 
+    @api.model
+    def _mark_kpi_links_to_recompute(self, field_name, domain):
+        """Flag payslips matching domain for recompute of a stored KPI link field.
+        Used by payroll.kpi_period / payroll.kpi_record, whose changes are not visible via @api.depends."""
+        slips = self.sudo().search(domain)
+        if slips:
+            self.env.add_to_compute(self._fields[field_name], slips)
+
     def _compute_kpi_html(self):
+        """Consolidated label-level KPI table, cached by the records' details and label configuration.
+        Label data for all cache misses is resolved with one prefetch across the recordset."""
+        stamp = self.env['payroll.kpi_label']._names_stamp()
+        missing = []
         for rec in self:
-            # Build a consolidated label-level table across all KPI records of this payslip
-            header = (
-                '<div class="o_form_view">'
-                '<table class="o_list_view table table-sm table-striped table-hover">'
-                '<thead><tr>'
-                '<th>Mô tả</th>'
-                '<th>Tên tag</th>'
-                '<th>Nhóm</th>'
-                '<th>Được giao</th>'
-                '<th>Đúng hạn</th>'
-                '<th>Hoàn thành muộn</th>'
-                '<th>Quá hạn</th>'
-                '<th>Trọng số</th>'
-                '<th>Điểm KPI quy đổi(%)</th>'
-                '</tr></thead><tbody>'
-            )
-            rows_html = []
             # Collect labels from all kpi_record_ids
             label_rows = []
-            label_ids = set()
             for r in rec.kpi_record_ids:
                 details = r.details or {}
                 group_code = r.group_id.code or (details.get('code') if isinstance(details, dict) else '') or ''
                 for row in (details.get('labels') or []):
-                    lab_id = row.get('label_id')
-                    if lab_id:
-                        label_ids.add(lab_id)
                     label_rows.append((group_code, row))
+            key = kpi_html_cache_key(self.env, 'payslip', label_rows, stamp)
+            html = kpi_html_cache_get(key)
+            if html is None:
+                missing.append((rec, key, label_rows))
+            else:
+                rec.kpi_details_html = html or False
+        if not missing:
+            return
+        label_ids = {row.get('label_id') for _rec, _key, rows in missing for _code, row in rows if row.get('label_id')}
+        labels_map = self.env['payroll.kpi_label']._details_map(label_ids)
+        for rec, key, label_rows in missing:
+            html = self._render_kpi_html(label_rows, labels_map)
+            # Cache empty tables as '' so they are not rebuilt either
+            kpi_html_cache_set(key, html or '')
+            rec.kpi_details_html = html
 
-            # Map label_id -> label record (for names and tag)
-            labels_map = {}
-            if label_ids:
-                Label = rec.env['payroll.kpi_label'].sudo()
-                for lab in Label.browse(list(label_ids)).exists():
-                    labels_map[lab.id] = lab
-
-            # Sort by group, then label name
-            def _sort_key(item):
-                gcode, row = item
-                lab = labels_map.get(row.get('label_id'))
-                lname = lab.name if lab else ''
-                return (gcode or '', lname)
-
-            label_rows.sort(key=_sort_key)
-
-            # Pre-compute per-group stats for proper distribution within group
-            group_stats = {}
-            for gcode, row in label_rows:
-                lab = labels_map.get(row.get('label_id'))
-                if gcode not in group_stats:
-                    group_stats[gcode] = {
-                        'label_count': 0,
-                        'total_weight': 0.0,
-                        'total_assigned': 0.0,
-                        'total_E_G': 0.0,
-                        'sum_weight_times_assigned': 0.0,
-                        'sum_EG_times_weight': 0.0,
-                        'group_weight': 0.0,
-                    }
-                st = group_stats[gcode]
-                st['label_count'] += 1
-                # label configured weight
-                try:
-                    w = float(row.get('weight') or (lab.weight if lab else 0.0) or 0.0)
-                except Exception:
-                    w = 0.0
-                st['total_weight'] += w
-                # sums for ratio
-                try:
-                    assigned_v = float(row.get('assigned') or 0.0)
-                    st['total_assigned'] += assigned_v
-                except Exception:
-                    assigned_v = 0.0
-                try:
-                    e_g_v = float(row.get('E_G') or 0.0)
-                    st['total_E_G'] += e_g_v
-                except Exception:
-                    e_g_v = 0.0
-                # accumulate E_G * weight for weighted ratio (match engine)
-                try:
-                    st['sum_EG_times_weight'] += float(w) * float(e_g_v)
-                except Exception:
-                    pass
-                # denominator for contribution share inside group: weight * assigned
-                try:
-                    st['sum_weight_times_assigned'] += float(w) * float(assigned_v)
-                except Exception:
-                    pass
-                # group weight (%) from model
-                try:
-                    st['group_weight'] = float(lab.group_id.weight or 0.0) if lab and lab.group_id else (st['group_weight'] or 0.0)
-                except Exception:
-                    pass
-
-            for group_code, row in label_rows:
-                lab = labels_map.get(row.get('label_id'))
-                label_name = lab.name if lab else str(row.get('label_id') or '')
-                tag_name = lab.tag_id.name if (lab and lab.tag_id) else ''
-                assigned = int(row.get('assigned') or 0)
-                ontime = int(row.get('ontime') or 0)
-                late = int(row.get('late') or 0)
-                overdue = int(row.get('overdue') or 0)
-                weight = float(row.get('weight') or (lab.weight if lab else 0.0) or 0.0)
-                e_g = float(row.get('E_G') or 0.0)
-                # Distribution inside group: share by (label weight * assigned)
-                st = group_stats.get(group_code, {})
-                total_w = float(st.get('total_weight') or 0.0)
-                cnt = int(st.get('label_count') or 0)
-                denom = float(st.get('sum_weight_times_assigned') or 0.0)
-                if denom > 0.0:
-                    share = (weight * float(assigned)) / denom
-                else:
-                    # Fallback when no assignments at all: use weight proportion or equal share
-                    share = (weight / total_w) if total_w > 0.0 else (1.0 / cnt if cnt else 0.0)
-                # Group achieved ratio (weighted to match engine): num/den
-                num_w = float(st.get('sum_EG_times_weight') or 0.0)
-                den_w = float(st.get('sum_weight_times_assigned') or 0.0)
-                ratio_g = (num_w / den_w) if den_w else 0.0
-                group_weight = float(st.get('group_weight') or 0.0)
-                # Final contribution of this label within group's weighted KPI
-                kpi_pct_weighted = share * ratio_g * group_weight
-                rows_html.append(
-                    '<tr>'
-                    f'<td>{label_name}</td>'
-                    f'<td>{tag_name}</td>'
-                    f'<td>{group_code}</td>'
-                    f'<td style="text-align:center">{assigned}</td>'
-                    f'<td style="text-align:center">{ontime}</td>'
-                    f'<td style="text-align:center">{late}</td>'
-                    f'<td style="text-align:center">{overdue}</td>'
-                    f'<td style="text-align:center">{weight:.2f}</td>'
-                    f'<td style="text-align:center">{kpi_pct_weighted:.2f}</td>'
-                    '</tr>'
-                )
-
-            footer = '</tbody></table></div>'
-            rec.kpi_details_html = header + ''.join(rows_html) + footer if rows_html else False
+    @api.model
+    def _render_kpi_html(self, label_rows, labels_map):
+        header = (
+            '<div class="o_form_view">'
+            '<table class="o_list_view table table-sm table-striped table-hover">'
+            '<thead><tr>'
+            '<th>Mô tả</th>'
+            '<th>Tên tag</th>'
+            '<th>Nhóm</th>'
+            '<th>Được giao</th>'
+            '<th>Đúng hạn</th>'
+            '<th>Hoàn thành muộn</th>'
+            '<th>Quá hạn</th>'
+            '<th>Trọng số</th>'
+            '<th>Điểm KPI quy đổi(%)</th>'
+            '</tr></thead><tbody>'
+        )
+        rows_html = []
+
+        # Sort by group, then label name
+        def _sort_key(item):
+            gcode, row = item
+            lab = labels_map.get(row.get('label_id'))
+            lname = lab['name'] if lab else ''
+            return (gcode or '', lname)
+
+        label_rows = sorted(label_rows, key=_sort_key)
+
+        # Pre-compute per-group stats for proper distribution within group
+        group_stats = {}
+        for gcode, row in label_rows:
+            lab = labels_map.get(row.get('label_id'))
+            if gcode not in group_stats:
+                group_stats[gcode] = {
+                    'label_count': 0,
+                    'total_weight': 0.0,
+                    'total_assigned': 0.0,
+                    'total_E_G': 0.0,
+                    'sum_weight_times_assigned': 0.0,
+                    'sum_EG_times_weight': 0.0,
+                    'group_weight': 0.0,
+                }
+            st = group_stats[gcode]
+            st['label_count'] += 1
+            # label configured weight
+            try:
+                w = float(row.get('weight') or (lab['weight'] if lab else 0.0) or 0.0)
+            except Exception:
+                w = 0.0
+            st['total_weight'] += w
+            # sums for ratio
+            try:
+                assigned_v = float(row.get('assigned') or 0.0)
+                st['total_assigned'] += assigned_v
+            except Exception:
+                assigned_v = 0.0
+            try:
+                e_g_v = float(row.get('E_G') or 0.0)
+                st['total_E_G'] += e_g_v
+            except Exception:
+                e_g_v = 0.0
+            # accumulate E_G * weight for weighted ratio (match engine)
+            try:
+                st['sum_EG_times_weight'] += float(w) * float(e_g_v)
+            except Exception:
+                pass
+            # denominator for contribution share inside group: weight * assigned
+            try:
+                st['sum_weight_times_assigned'] += float(w) * float(assigned_v)
+            except Exception:
+                pass
+            # group weight (%) from model
+            try:
+                st['group_weight'] = float(lab['group_weight'] or 0.0) if lab else (st['group_weight'] or 0.0)
+            except Exception:
+                pass
+
+        for group_code, row in label_rows:
+            lab = labels_map.get(row.get('label_id'))
+            label_name = lab['name'] if lab else str(row.get('label_id') or '')
+            tag_name = lab['tag_name'] if lab else ''
+            assigned = int(row.get('assigned') or 0)
+            ontime = int(row.get('ontime') or 0)
+            late = int(row.get('late') or 0)
+            overdue = int(row.get('overdue') or 0)
+            weight = float(row.get('weight') or (lab['weight'] if lab else 0.0) or 0.0)
+            e_g = float(row.get('E_G') or 0.0)
+            # Distribution inside group: share by (label weight * assigned)
+            st = group_stats.get(group_code, {})
+            total_w = float(st.get('total_weight') or 0.0)
+            cnt = int(st.get('label_count') or 0)
+            denom = float(st.get('sum_weight_times_assigned') or 0.0)
+            if denom > 0.0:
+                share = (weight * float(assigned)) / denom
+            else:
+                # Fallback when no assignments at all: use weight proportion or equal share
+                share = (weight / total_w) if total_w > 0.0 else (1.0 / cnt if cnt else 0.0)
+            # Group achieved ratio (weighted to match engine): num/den
+            num_w = float(st.get('sum_EG_times_weight') or 0.0)
+            den_w = float(st.get('sum_weight_times_assigned') or 0.0)
+            ratio_g = (num_w / den_w) if den_w else 0.0
+            group_weight = float(st.get('group_weight') or 0.0)
+            # Final contribution of this label within group's weighted KPI
+            kpi_pct_weighted = share * ratio_g * group_weight
+            rows_html.append(
+                '<tr>'
+                f'<td>{label_name}</td>'
+                f'<td>{tag_name}</td>'
+                f'<td>{group_code}</td>'
+                f'<td style="text-align:center">{assigned}</td>'
+                f'<td style="text-align:center">{ontime}</td>'
+                f'<td style="text-align:center">{late}</td>'
+                f'<td style="text-align:center">{overdue}</td>'
+                f'<td style="text-align:center">{weight:.2f}</td>'
+                f'<td style="text-align:center">{kpi_pct_weighted:.2f}</td>'
+                '</tr>'
+            )
+
+        footer = '</tbody></table></div>'
+        return header + ''.join(rows_html) + footer if rows_html else False
 
     # ---------- Helper to expose KPI figures as variables for formulas ----------
     def _build_kpi_variables(self):
@@ -391,7 +523,8 @@ class PayrollPayslip(models.Model):
                 return None
         # payroll profile source
         if source == 'payroll':
-            prof = self.env['payroll.salary.profile'].search([('employee_id', '=', self.employee_id.id)], limit=1)
+            prof = self.env['payroll.salary.profile'].get_profiles_as_of(
+                self.employee_id.ids, self.date_to).get(self.employee_id.id)
             if prof:
                 try:
                     return float(getattr(prof, 'base_wage', None) or 0.0)
@@ -399,89 +532,158 @@ class PayrollPayslip(models.Model):
                     return None
         return None
 
+    def _prepare_rule_eval(self, params, pit_tables):
+        """Inputs of rule evaluation for one slip: (sorted active rules, variable map, PIT table).
+        `pit_tables` caches PIT tables by date across slips."""
+        self.ensure_one()
+        slip = self
+        # Validate structure and rules
+        if not slip.structure_id:
+            raise UserError(_("Phiếu lương thiếu Cấu trúc lương (Salary Structure). Hãy chọn cấu trúc trước khi Compute."))
+        active_rules = slip.structure_id.rule_ids.filtered(lambda r: r.active)
+        if not active_rules:
+            raise UserError(_("Cấu trúc lương '%s' chưa có Salary Rule đang Active.") % (slip.structure_id.display_name))
+        # Chuẩn bị biến catalog cho công thức (V/vars)
+        try:
+            var_map = self.env['payroll.variable'].with_context(run_id=slip.run_id.id).compute_values_for_employee(
+                slip.employee_id, slip.date_from, slip.date_to)
+        except Exception:
+            var_map = {}
+        # Bổ sung biến KPI động cho kỳ lương hiện tại: KPI_TOTAL và KPI_<GROUP_CODE>
+        try:
+            kpi_vars = slip._build_kpi_variables()
+            if kpi_vars:
+                var_map.update(kpi_vars)
+        except Exception:
+            # Không chặn nếu không lấy được KPI
+            pass
+        rules = active_rules.sorted(key=lambda r: (r.sequence, r.id))
+        # Effective-dated PIT table of the slip period: pit(taxable), pit_gross_up(net, ...)
+        if slip.date_to not in pit_tables:
+            pit_tables[slip.date_to] = params.pit_table(slip.date_to)
+        return rules, var_map, pit_tables[slip.date_to]
+
+    def _evaluate_rules(self, rules, var_map, pit_table, extra=None):
+        """Evaluate `rules` in order for this slip. Returns (codes, line values); nothing is written.
+        `extra` adds names to the formula context (e.g. the candidate gross of the gross-up solver)."""
+        self.ensure_one()
+        new_lines = []
+        codes = {}
+        local_base = {
+            'slip': self,
+            'employee': self.employee_id,
+            'env': self.env,
+            'get_code': lambda c: codes.get(c, 0.0),
+            'V': var_map,
+            'vars': var_map,
+            'pit': pit_table.tax,
+            # insurance_rate in percent, like the BH* rates of VN params
+            'pit_gross_up': lambda net, deduction=0.0, insurance_rate=0.0, insurance_fixed=0.0:
+                pit_table.gross_from_net(net, deduction, (insurance_rate or 0.0) / 100.0, insurance_fixed),
+        }
+        if extra:
+            local_base.update(extra)
+        for rule in rules:
+            # Condition
+            passed = True
+            if rule.condition == 'python':
+                loc = dict(local_base)
+                try:
+                    safe_eval(rule.condition_python or 'result = True', loc, mode='exec', nocopy=True)
+                    passed = bool(loc.get('result', False))
+                except Exception:
+                    passed = False
+            if not passed:
+                continue
+            # Amount
+            amount = 0.0
+            qty = 1.0
+            if rule.amount_type == 'fixed':
+                amount = float(rule.amount_fix or 0.0)
+            elif rule.amount_type == 'percent':
+                base_amt = float(codes.get(rule.amount_base_code or '', 0.0))
+                amount = base_amt * float(rule.amount_percent or 0.0) / 100.0
+            elif rule.amount_type == 'python':
+                loc = dict(local_base)
+                try:
+                    safe_eval(rule.amount_python or 'result = 0.0', loc, mode='exec', nocopy=True)
+                    amount = float(loc.get('result', 0.0))
+                except Exception:
+                    # If formula fails, keep amount=0 but continue building other lines
+                    amount = 0.0
+            # Accumulate and stage line
+            codes[rule.code] = amount
+            new_lines.append({
+                'name': rule.name,
+                'code': rule.code,
+                'sequence': rule.sequence,
+                'amount': amount,
+                'quantity': qty,
+                'category_id': rule.category_id.id,
+                'rule_id': rule.id,
+            })
+        return codes, new_lines
+
     def action_compute_lines(self):
         """Compute/update lines strictly from active salary rules in the structure.
         - Only evaluate configured rules (no post-process overrides, no fallbacks)
         - Expose variable catalog as V/vars for Python formulas
+        - Expose PIT helpers pit(taxable) and pit_gross_up(net, deduction, insurance_rate, insurance_fixed)
+        - Expose YTD['CODE']: totals of the employee's done slips in the same year (excluding this one)
+        - Expose RETRO['CODE']: retroactive deltas carried on this slip (see payroll.retro.wizard)
         - Resulting lines match active rules only
         """
+        Params = self.env['payroll.vn.params'].sudo()._get_default_params()
+        YTD = self.env['payroll.ytd'].sudo()
+        pit_tables = {}
+        ytd = self._ytd_context()
         for slip in self:
-            # Validate structure and rules
-            if not slip.structure_id:
-                raise UserError(_("Phiếu lương thiếu Cấu trúc lương (Salary Structure). Hãy chọn cấu trúc trước khi Compute."))
-            active_rules = slip.structure_id.rule_ids.filtered(lambda r: r.active)
-            if not active_rules:
-                raise UserError(_("Cấu trúc lương '%s' chưa có Salary Rule đang Active.") % (slip.structure_id.display_name))
-            # 1) Build rule-based lines
-            new_lines = []
-            codes = {}
-            # Chuẩn bị biến catalog cho công thức (V/vars)
-            try:
-                var_map = self.env['payroll.variable'].with_context(run_id=slip.run_id.id).compute_values_for_employee(
-                    slip.employee_id, slip.date_from, slip.date_to)
-            except Exception:
-                var_map = {}
-            # Bổ sung biến KPI động cho kỳ lương hiện tại: KPI_TOTAL và KPI_<GROUP_CODE>
-            try:
-                kpi_vars = slip._build_kpi_variables()
-                if kpi_vars:
-                    var_map.update(kpi_vars)
-            except Exception:
-                # Không chặn nếu không lấy được KPI
-                pass
-            rules = active_rules.sorted(key=lambda r: (r.sequence, r.id))
-            local_base = {
-                'slip': slip,
-                'employee': slip.employee_id,
-                'env': self.env,
-                'get_code': lambda c: codes.get(c, 0.0),
-                'V': var_map,
-                'vars': var_map,
-            }
-            for rule in rules:
-                # Condition
-                passed = True
-                if rule.condition == 'python':
-                    loc = dict(local_base)
-                    try:
-                        safe_eval(rule.condition_python or 'result = True', loc, mode='exec', nocopy=True)
-                        passed = bool(loc.get('result', False))
-                    except Exception:
-                        passed = False
-                if not passed:
-                    continue
-                # Amount
-                amount = 0.0
-                qty = 1.0
-                if rule.amount_type == 'fixed':
-                    amount = float(rule.amount_fix or 0.0)
-                elif rule.amount_type == 'percent':
-                    base_amt = float(codes.get(rule.amount_base_code or '', 0.0))
-                    amount = base_amt * float(rule.amount_percent or 0.0) / 100.0
-                elif rule.amount_type == 'python':
-                    loc = dict(local_base)
-                    try:
-                        safe_eval(rule.amount_python or 'result = 0.0', loc, mode='exec', nocopy=True)
-                        amount = float(loc.get('result', 0.0))
-                    except Exception:
-                        # If formula fails, keep amount=0 but continue building other lines
-                        amount = 0.0
-                # Accumulate and stage line
-                codes[rule.code] = amount
-                new_lines.append({
-                    'name': rule.name,
-                    'code': rule.code,
-                    'sequence': rule.sequence,
-                    'amount': amount,
-                    'quantity': qty,
-                    'category_id': rule.category_id.id,
-                    'rule_id': rule.id,
-                })
-
+            rules, var_map, pit_table = slip._prepare_rule_eval(Params, pit_tables)
+            var_map, extra = slip._gross_up_inputs(var_map, slip._rule_extra_context(ytd))
+            _codes, new_lines = slip._evaluate_rules(rules, var_map, pit_table, extra=extra)
+            # A done slip's lines are counted in payroll.ytd: take the old ones out, post the new ones
+            if slip.ytd_posted:
+                YTD._apply_payslips(slip, -1)
             # Replace existing lines with computed ones
-            slip.write({'line_ids': [(5, 0, 0)] + [(0, 0, vals) for vals in new_lines]})
+            slip.write({'line_ids': slip._rule_line_commands(new_lines)})
+            if slip.ytd_posted:
+                YTD._apply_payslips(slip, 1)
         return True
 
+    def _rule_extra_context(self, ytd):
+        """YTD['CODE'] and RETRO['CODE'] (sum of retro delta lines carried on this slip) for formulas.
+
+        A done slip is already counted in payroll.ytd, so its own line totals are taken out of YTD again.
+        """
+        self.ensure_one()
+        retro = {}
+        for line in self.line_ids.filtered('retro_slip_id'):
+            retro[line.retro_code] = retro.get(line.retro_code, 0.0) + float(line.total or 0.0)
+        year_to_date = ytd.get(self.id, {})
+        if self.ytd_posted:
+            # Keep the defaultdict: formulas read YTD['X'] for codes the employee has no total for yet
+            year_to_date = defaultdict(float, year_to_date)
+            for line in self.line_ids:
+                if line.code:
+                    year_to_date[line.code] -= float(line.amount or 0.0) * float(line.quantity or 0.0)
+        return {'YTD': year_to_date, 'RETRO': retro}
+
+    def _gross_up_inputs(self, var_map, extra):
+        """Guaranteed-net slip solved by the batch: evaluate at the solved gross, i.e. with
+        V[gross_up_key] and gross_up set as in the solver's last evaluation. Slips not converged
+        (max_iter, no_root) or no longer on guaranteed net are unchanged."""
+        self.ensure_one()
+        if not (self.net_target and self.gross_up_state == 'converged'):
+            return var_map, extra
+        gross = self.gross_up_gross
+        return dict(var_map, **{self.run_id.gross_up_key or 'base_wage': gross}), dict(extra, gross_up=gross)
+
+    def _rule_line_commands(self, new_lines):
+        """x2many commands replacing the rule lines with `new_lines`; retro delta lines are kept."""
+        self.ensure_one()
+        return [(2, line.id) for line in self.line_ids if not line.retro_slip_id] + \
+            [(0, 0, vals) for vals in new_lines]
+
     def _compute_statutory_and_net(self, gross_salary, base_wage_used):
         """Deprecated: Computation now fully driven by salary rules. Keep for backward-compatibility (no-op)."""
         return True
@@ -491,13 +693,11 @@ class PayrollPayslip(models.Model):
         - Re-sync auto adjustments for this payslip
         - Return a UI notification
         """
-        for rec in self:
-            try:
-                self.env['payroll.kpi_adjust_record'].sudo().sync_auto_for_employee_period(
-                    rec.employee_id, rec.kpi_period_id, payslip=rec)
-            except Exception:
-                # Do not block UI on sync errors; values will remain as-is
-                pass
+        try:
+            self.env['payroll.kpi_adjust_record'].sudo().sync_auto_for_payslips(self)
+        except Exception:
+            # Do not block UI on sync errors; values will remain as-is
+            pass
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
@@ -510,7 +710,8 @@ class PayrollPayslip(models.Model):
 
     @staticmethod
     def _vn_pit_progressive(taxable):
-        """Vietnam monthly PIT progressive computation without quick deduction.
+        """Vietnam monthly PIT progressive computation without quick deduction (default 2009 table;
+        rules should prefer the effective-dated table exposed as `pit` / payroll.vn.params.pit_tax).
         Brackets (VND):
           0-5m: 5%
           5-10m: 10%
@@ -520,31 +721,35 @@ class PayrollPayslip(models.Model):
           52-80m: 30%
           >80m: 35%
         """
-        t = float(taxable or 0.0)
-        if t <= 0:
-            return 0.0
-        brackets = [
-            (5_000_000.0, 0.05),
-            (10_000_000.0, 0.10),
-            (18_000_000.0, 0.15),
-            (32_000_000.0, 0.20),
-            (52_000_000.0, 0.25),
-            (80_000_000.0, 0.30),
-        ]
-        tax = 0.0
-        prev_cap = 0.0
-        for cap, rate in brackets:
-            if t > cap:
-                tax += (cap - prev_cap) * rate
-                prev_cap = cap
-            else:
-                tax += (t - prev_cap) * rate
-                return tax
-        # above last cap
-        tax += (t - prev_cap) * 0.35
-        return tax
+        return PitTable(DEFAULT_PIT_BRACKETS).tax(taxable)
 
     # Header actions for state changes
+    def write(self, vals):
+        if SUMMARY_SLIP_FIELDS.intersection(vals):
+            self.env['payroll.summary']._mark_runs_dirty(self.mapped('run_id').ids + [vals.get('run_id')])
+        if 'state' not in vals:
+            return super().write(vals)
+        YTD = self.env['payroll.ytd'].sudo()
+        if vals['state'] != 'done':
+            # Leaving done (cancel, reset to draft, ...): take the slips back out of the YTD totals
+            leaving = self.filtered('ytd_posted')
+            if leaving:
+                YTD._apply_payslips(leaving, -1)
+                super(PayrollPayslip, leaving).write({'ytd_posted': False})
+        res = super().write(vals)
+        if vals['state'] == 'done':
+            entering = self.filtered(lambda s: not s.ytd_posted)
+            if entering:
+                YTD._apply_payslips(entering, 1)
+                super(PayrollPayslip, entering).write({'ytd_posted': True})
+        return res
+
+    def _ytd_context(self):
+        """{slip_id: YTD mapping} with totals of done slips of the slip's employee and year, in one query."""
+        maps = self.env['payroll.ytd'].sudo().get_ytd_maps(
+            self.mapped('employee_id').ids, {s.date_to.year for s in self if s.date_to})
+        return {s.id: maps[(s.employee_id.id, s.date_to.year)] for s in self if s.date_to}
+
     def action_reset_to_draft(self):
         self.write({'state': 'draft'})
         return True
@@ -570,6 +775,7 @@ class PayrollPayslip(models.Model):
             # Business rule: do not allow deleting completed payslips
             if rec.state == 'done':
                 raise UserError(_("Không thể xóa phiếu lương ở trạng thái Done."))
+        self.env['payroll.summary']._mark_runs_dirty(self.mapped('run_id').ids)
         return super().unlink()
 
 
@@ -587,6 +793,9 @@ class PayrollPayslipLine(models.Model):
     total = fields.Float(compute="_compute_total", store=False)
     category_id = fields.Many2one("payroll.category", string="Category")
     rule_id = fields.Many2one("payroll.rule", string="Rule")
+    # Retroactive delta lines (payroll.retro.wizard): survive recomputes of the slip they are carried on
+    retro_slip_id = fields.Many2one("payroll.payslip", string="Retro of", ondelete="set null", index=True, readonly=True)
+    retro_code = fields.Char(string="Retro code", readonly=True)
 
     @api.depends("amount", "quantity")
     def _compute_total(self):
@@ -596,6 +805,27 @@ class PayrollPayslipLine(models.Model):
             except Exception:
                 rec.total = 0.0
 
+    # payroll.summary rows of the batch are rebuilt at commit whenever its lines change
+    def _mark_summary_dirty(self):
+        self.env['payroll.summary']._mark_runs_dirty(self.mapped('payslip_id.run_id').ids)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._mark_summary_dirty()
+        return lines
+
+    def write(self, vals):
+        self._mark_summary_dirty()
+        res = super().write(vals)
+        if 'payslip_id' in vals:
+            self._mark_summary_dirty()
+        return res
+
+    def unlink(self):
+        self._mark_summary_dirty()
+        return super().unlink()
+
 
 class PayrollPayslipRun(models.Model):
     _name = "payroll.payslip.run"
@@ -610,6 +840,36 @@ class PayrollPayslipRun(models.Model):
     slip_ids = fields.One2many("payroll.payslip", "run_id", string="Payslips")
     sheet_ids = fields.One2many("payroll.sheet", "run_id", string="Payroll Sheets")
     sheet_id = fields.Many2one("payroll.sheet", string="Payroll Sheet", compute="_compute_sheet_id", store=False, readonly=True)
+    precompute_date = fields.Datetime(
+        string="Last Precompute", readonly=True, copy=False,
+        help="Sheet timesheet values, KPI and auto KPI adjustments are current as of this time.")
+    stage_ids = fields.One2many("payroll.payslip.run.stage", "run_id", string="Pipeline Stages", copy=False)
+    pipeline_state = fields.Selection([
+        ("none", "Not started"),
+        ("running", "In progress"),
+        ("failed", "Failed"),
+        ("done", "Done"),
+    ], string="Pipeline", compute="_compute_pipeline_summary")
+    pipeline_duration = fields.Float(string="Pipeline Duration (s)", digits=(16, 2), compute="_compute_pipeline_summary")
+    gross_up_key = fields.Char(
+        string="Gross variable", default="base_wage",
+        help="Variable (V[...]) replaced by the candidate gross when solving net-salary contracts.")
+    gross_up_net_code = fields.Char(string="Net rule code", default="NET")
+    pdf_job_ids = fields.One2many("payroll.payslip.pdf.job", "run_id", string="Payslip PDF Jobs", copy=False)
+
+    @api.depends("stage_ids.state", "stage_ids.duration")
+    def _compute_pipeline_summary(self):
+        for run in self:
+            states = set(run.stage_ids.mapped("state"))
+            if not states:
+                run.pipeline_state = "none"
+            elif "failed" in states:
+                run.pipeline_state = "failed"
+            elif states == {"done"}:
+                run.pipeline_state = "done"
+            else:
+                run.pipeline_state = "running"
+            run.pipeline_duration = sum(run.stage_ids.mapped("duration"))
 
     def _compute_sheet_id(self):
         Sheet = self.env['payroll.sheet']
@@ -617,14 +877,15 @@ class PayrollPayslipRun(models.Model):
             sheet = Sheet.search([('run_id', '=', rec.id)], limit=1)
             rec.sheet_id = sheet.id if sheet else False
 
-    @api.model
-    def create(self, vals):
-        if not vals.get("name") or vals.get("name") == "/":
-            vals["name"] = self.env["ir.sequence"].next_by_code("payroll.payslip.run") or "/"
-        rec = super().create(vals)
-        # Auto create or update the linked payroll sheet
-        rec._create_or_update_sheet()
-        return rec
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if not vals.get("name") or vals.get("name") == "/":
+                vals["name"] = self.env["ir.sequence"].next_by_code("payroll.payslip.run") or "/"
+        recs = super().create(vals_list)
+        # Auto create the linked payroll sheets in one batch
+        recs._create_or_update_sheet()
+        return recs
 
     @api.onchange("month", "year", "select_days")
     def _onchange_month_year(self):
@@ -676,35 +937,59 @@ class PayrollPayslipRun(models.Model):
             'name': 'Default Payroll Template',
         })
 
+    def _sheet_vals(self, template):
+        self.ensure_one()
+        year, month = self._get_month_year()
+        return {
+            'name': f"{self.name} - Payroll Sheet",
+            'run_id': self.id,
+            'template_id': template.id,
+            'month': month or 0,
+            'year': year or 0,
+            'date_start': self.date_start,
+            'date_end': self.date_end,
+        }
+
     def _create_or_update_sheet(self):
+        """Create missing sheets and align existing ones with their batch, for many batches at once.
+
+        One sheet search and one template lookup cover the whole recordset; missing sheets are created in
+        one batch and existing ones are written only when a value differs. Name and template are set on
+        creation only, so renaming a batch never rewrites its sheet and a template picked on the sheet is kept.
+        """
+        if not self:
+            return
+        Sheet = self.env['payroll.sheet']
+        sheets_by_run = {}
+        for sheet in Sheet.search([('run_id', 'in', self.ids)], order='id'):
+            sheets_by_run.setdefault(sheet.run_id.id, sheet)
+        # Ensure we have a template
+        tmpl = self._get_or_create_default_template()
+        to_create = []
         for run in self:
-            # Find existing sheet
-            Sheet = run.env['payroll.sheet']
-            sheet = Sheet.search([('run_id', '=', run.id)], limit=1)
-            # Determine month/year
-            year, month = run._get_month_year()
-            # Ensure we have a template
-            tmpl = run._get_or_create_default_template()
-            vals = {
-                'name': f"{run.name} - Payroll Sheet",
-                'run_id': run.id,
-                'template_id': tmpl.id,
-                'month': month or 0,
-                'year': year or 0,
-                'date_start': run.date_start,
-                'date_end': run.date_end,
-            }
-            if sheet:
-                # Update existing
-                sheet.write(vals)
-            else:
-                # Create new
-                Sheet.create(vals)
+            vals = run._sheet_vals(tmpl)
+            sheet = sheets_by_run.get(run.id)
+            if not sheet:
+                to_create.append(vals)
+                continue
+            vals.pop('name')
+            vals.pop('run_id')
+            if sheet.template_id:
+                vals.pop('template_id')
+            changed = {k: v for k, v in vals.items() if sheet[k] != v}
+            if changed:
+                sheet.write(changed)
+        if to_create:
+            Sheet.create(to_create)
+        self.invalidate_recordset(['sheet_id'])
 
     def write(self, vals):
         res = super().write(vals)
-        # After updates (name/dates/month/year), sync the sheet
-        self._create_or_update_sheet()
+        if 'date_start' in vals:
+            self.env['payroll.summary']._mark_runs_dirty(self.ids)
+        # Only fields that shape the sheet (period) trigger a sync; renames and other edits do not
+        if SHEET_SYNC_FIELDS.intersection(vals):
+            self._create_or_update_sheet()
         return res
 
     def unlink(self):
@@ -742,6 +1027,23 @@ class PayrollPayslipRun(models.Model):
             }
         )
 
+    def action_open_export_register(self):
+        return self._open_action(
+            'payroll_3c.action_payroll_export_wizard',
+            {
+                'default_export_type': 'register',
+                'default_run_id': self.id,
+            }
+        )
+
+    def action_open_retro_wizard(self):
+        return self._open_action(
+            'payroll_3c.action_retro_wizard',
+            {
+                'default_run_id': self.id,
+            }
+        )
+
     def action_open_confirm_delete_batch(self):
         # Reuse confirm delete wizard action but ensure correct model context
         return self._open_action(
@@ -770,20 +1072,405 @@ class PayrollPayslipRun(models.Model):
         action['domain'] = [('run_id', '=', self.id)]
         return action
 
-    def action_sync_sheet_and_compute(self):
-        """Ensure sheet exists, sync timesheet points, then compute all payslips."""
+    def action_sync_kpi_adjustments(self):
+        """Batch step: upsert auto KPI adjustment lines for every payslip of the batch at once."""
+        self.env['payroll.kpi_adjust_record'].sudo().sync_auto_for_payslips(self.slip_ids)
+        return True
+
+    def _refresh_batch_kpi(self, qprof):
+        """Incremental KPI compute of the batch's open KPI periods, limited to the batch's employees.
+
+        Only employees whose tasks changed since the later of the period watermark and precompute_date are
+        recomputed; the rest of the company is left to the KPI period's own compute. Returns them.
+        """
+        self.ensure_one()
+        changed = self.env['employee3c.employee.base']
+        for period in self.slip_ids.kpi_period_id.filtered(lambda p: p.state != 'closed'):
+            employees = self.slip_ids.filtered(lambda s: s.kpi_period_id == period).employee_id
+            changed |= period._compute_kpi_incremental(qprof, employees=employees, since=self.precompute_date)
+        return changed
+
+    def _sync_auto_adjustments(self, slips):
+        """Re-sync auto KPI adjustments of `slips` in one batch. If that fails, retry slip by slip so a
+        broken payslip is logged and skipped instead of leaving every adjustment of the batch stale."""
+        Adjust = self.env['payroll.kpi_adjust_record'].sudo()
+        try:
+            with self.env.cr.savepoint():
+                return Adjust.sync_auto_for_payslips(slips)
+        except Exception:
+            _logger.warning("[payroll.payslip.run] batch KPI adjustment sync failed, retrying per payslip")
+        recs = Adjust
+        for slip in slips:
+            try:
+                with self.env.cr.savepoint():
+                    recs |= Adjust.sync_auto_for_payslips(slip)
+            except Exception:
+                _logger.exception("[payroll.payslip.run] KPI adjustment sync failed for payslip %s", slip.id)
+        return recs
+
+    def _precompute_inputs(self):
+        """Bring payroll inputs of the batch up to date with the sources changed since precompute_date.
+
+        - sheet lines: created for new payslips; points/work_day rewritten where the timesheet totals moved
+          (one grouped query over the whole batch, so deleted timesheet rows are caught too)
+        - KPI: incremental compute of the open KPI periods for the batch's employees only
+        - auto KPI adjustments: re-synced for every open payslip, since their variables also read monthly
+          timesheets and employee data that carry no change marker; unchanged lines are not rewritten
+        A failing step is logged and does not block the others, so computing stays possible. precompute_date
+        only moves when the KPI step succeeded, so failed KPI changes are retried next time.
+        """
+        qprof = self.env['payroll.kpi_quality_profile'].search([('active', '=', True)], limit=1)
         for run in self:
-            # Ensure sheet exists or updated
-            run._create_or_update_sheet()
-            sheet = run.sheet_id
-            if sheet:
-                # Sync points/work_day from timesheet
+            started_at = self.env.cr.now() - KPI_WATERMARK_LAG
+            kpi_ok = True
+            try:
+                with self.env.cr.savepoint():
+                    if not run.sheet_id:
+                        run._create_or_update_sheet()
+                    sheet = run.sheet_id
+                    if sheet and sheet.state == 'draft' and sheet.date_start and sheet.date_end:
+                        slip_emp_ids = set(run.slip_ids.mapped('employee_id').ids)
+                        if slip_emp_ids != set(sheet.line_ids.mapped('employee_id').ids):
+                            sheet.action_generate_lines()
+                        sheet._sync_timesheet_points_lines(sheet.line_ids)
+            except Exception:
+                _logger.exception("[payroll.payslip.run] timesheet sync failed for batch %s", run.id)
+
+            if qprof:
                 try:
-                    sheet.action_sync_timesheet_points()
+                    with self.env.cr.savepoint():
+                        run._refresh_batch_kpi(qprof)
                 except Exception:
-                    # Don't block compute if sync fails; you can still compute
-                    pass
-            # Compute all payslips
-            if run.slip_ids:
-                run.slip_ids.action_compute_lines()
+                    kpi_ok = False
+                    _logger.exception("[payroll.payslip.run] KPI compute failed for batch %s", run.id)
+
+            run._sync_auto_adjustments(run.slip_ids.filtered(lambda s: s.state not in ('done', 'cancel')))
+            if kpi_ok:
+                run.precompute_date = started_at
         return True
+
+    def action_precompute_inputs(self):
+        self._precompute_inputs()
+        return True
+
+    @api.model
+    def _cron_precompute_open_runs(self):
+        """Nightly: keep batches of the current month warm so closing only evaluates rules."""
+        today = fields.Date.context_today(self)
+        runs = self.search([
+            ('date_start', '<=', today),
+            ('date_end', '>=', today - timedelta(days=7)),
+        ])
+        for run in runs:
+            if run.slip_ids and all(s.state in ('done', 'cancel') for s in run.slip_ids):
+                continue
+            try:
+                run._precompute_inputs()
+                self.env.cr.commit()
+            except Exception:
+                self.env.cr.rollback()
+                _logger.exception("[payroll.payslip.run] precompute failed for batch %s", run.id)
+
+    # ---------- Month-end pipeline: checkpointed stages (see run_pipeline.PIPELINE_STAGES) ----------
+    def _stage_sheet(self):
+        self._create_or_update_sheet()
+        return len(self.sheet_id)
+
+    def _stage_sheet_lines(self):
+        if self.sheet_id.state != 'draft':
+            return 0
+        self.sheet_id.action_generate_lines()
+        return len(self.sheet_id.line_ids)
+
+    def _stage_timesheet(self):
+        sheet = self.sheet_id
+        if sheet.state != 'draft':
+            return 0
+        if not (sheet.date_start and sheet.date_end):
+            raise UserError(_("Thiếu khoảng thời gian của Payroll Sheet."))
+        return len(sheet._sync_timesheet_points_lines(sheet.line_ids))
+
+    def _stage_kpi(self):
+        if not self.slip_ids.kpi_period_id.filtered(lambda p: p.state != 'closed'):
+            return 0
+        qprof = self.env['payroll.kpi_quality_profile'].search([('active', '=', True)], limit=1)
+        if not qprof:
+            raise UserError(_("No KPI Quality Profile configured."))
+        return len(self._refresh_batch_kpi(qprof))
+
+    def _stage_adjustments(self):
+        slips = self.slip_ids.filtered(lambda s: s.state not in ('done', 'cancel'))
+        return len(self.env['payroll.kpi_adjust_record'].sudo().sync_auto_for_payslips(slips))
+
+    def _stage_compute(self):
+        slips = self.slip_ids.filtered(lambda s: s.state not in ('done', 'cancel'))
+        slips.action_compute_lines()
+        return len(slips)
+
+    def _ensure_stages(self):
+        """Create the stage rows missing on each batch; existing checkpoints are kept."""
+        Stage = self.env['payroll.payslip.run.stage']
+        to_create = []
+        for run in self:
+            have = set(run.stage_ids.mapped('code'))
+            to_create += [{
+                'run_id': run.id,
+                'sequence': (idx + 1) * 10,
+                'code': code,
+                'name': label,
+            } for idx, (code, label) in enumerate(PIPELINE_STAGES) if code not in have]
+        if to_create:
+            Stage.create(to_create)
+
+    def _commit(self):
+        # Never commit inside tests; the test transaction is rolled back as a whole
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _run_pipeline(self, resume=False):
+        """Run the stages of one batch in order and checkpoint each of them.
+
+        A stage's work runs in a savepoint: on error it is rolled back, the stage is marked failed with
+        the message and later stages are not started. Every change of a stage's state is committed with
+        the work done so far, so a killed worker leaves the finished stages done and the interrupted one
+        running. With `resume`, stages already done are skipped so the run restarts at the first failed
+        (or never finished) stage. Returns the failed stage, if any.
+        """
+        self.ensure_one()
+        self._ensure_stages()
+        stages = self.stage_ids.sorted(lambda st: (st.sequence, st.id))
+        if not resume:
+            stages.write({'state': 'pending', 'duration': 0.0, 'row_count': 0, 'message': False,
+                          'date_start': False, 'date_done': False})
+            self._commit()
+        for stage in stages:
+            if stage.state == 'done':
+                continue
+            stage.write({'state': 'running', 'date_start': fields.Datetime.now(), 'message': False})
+            self._commit()
+            started = time.perf_counter()
+            try:
+                with self.env.cr.savepoint():
+                    rows = getattr(self, '_stage_%s' % stage.code)()
+                    self.env.flush_all()
+            except Exception as e:
+                _logger.warning("[payroll.payslip.run] batch %s stage %s failed: %s", self.id, stage.code, e)
+                stage.write({
+                    'state': 'failed',
+                    'date_done': fields.Datetime.now(),
+                    'duration': time.perf_counter() - started,
+                    'message': str(e),
+                })
+                self._commit()
+                return stage
+            stage.write({
+                'state': 'done',
+                'date_done': fields.Datetime.now(),
+                'duration': time.perf_counter() - started,
+                'row_count': int(rows or 0),
+            })
+            self._commit()
+        return self.env['payroll.payslip.run.stage']
+
+    def _pipeline_result(self, failed):
+        if failed:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Payroll pipeline'),
+                    'message': _('Stage "%s" failed on %s: %s') % (
+                        failed[0].name, failed[0].run_id.display_name, failed[0].message),
+                    'sticky': True,
+                    'type': 'danger',
+                    'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+                }
+            }
+        return {'type': 'ir.actions.client', 'tag': 'soft_reload'}
+
+    def action_run_pipeline(self):
+        """Run every stage from the start for each batch."""
+        failed = self.env['payroll.payslip.run.stage']
+        for run in self:
+            failed |= run._run_pipeline()
+        return self._pipeline_result(failed)
+
+    def action_resume_pipeline(self):
+        """Continue each batch from its first stage that is not done."""
+        failed = self.env['payroll.payslip.run.stage']
+        for run in self:
+            failed |= run._run_pipeline(resume=True)
+        return self._pipeline_result(failed)
+
+    def action_sync_sheet_and_compute(self):
+        """Ensure sheet exists, sync timesheet points, KPI and adjustments, then compute all payslips.
+        Runs the checkpointed pipeline; a failing stage is reported instead of being skipped silently."""
+        return self.action_run_pipeline()
+
+    # ---------- Net-to-gross solver for guaranteed-net employees ----------
+    def _gross_up_initial_guess(self, params, pit_table, target, profile):
+        """Closed-form gross from the PIT inverse, assuming insurance on the full gross at the VN params rates."""
+        ins_rate = sum(float(getattr(params, f, 0.0) or 0.0) for f in ('bhxh_rate_emp', 'bhyt_rate_emp', 'bhtn_rate_emp'))
+        deduction = float(params.personal_deduction or 0.0) + \
+            float(params.dependent_deduction or 0.0) * int(getattr(profile, 'dependent_count', 0) or 0)
+        return pit_table.gross_from_net(target, deduction=deduction, insurance_rate=ins_rate / 100.0)
+
+    def _solve_gross_up(self):
+        """Solve gross for every guaranteed-net payslip of the batch in lock-step.
+
+        The residual f(g) = NET(g) - target runs the slip's full rule set with V[gross_up_key] = g. All
+        slips start from the closed-form PIT inverse, bracket the root between gross 0 and that guess
+        (doubling when needed), then take Illinois false-position steps together until |f| <= GROSS_UP_TOLERANCE
+        or GROSS_UP_MAX_ITER evaluations, bracketing included (state max_iter). Lines at the final gross and
+        the convergence info are written per slip; later recomputes keep evaluating at a converged gross.
+        Open slips whose profile no longer has a net target lose their previous gross-up results.
+
+        Each residual runs the rule engine of one slip, so evaluations stay a Python loop; "lock-step" means
+        every slip takes its bracketing or false-position step in the same round, not a vectorized update.
+        Returns {state: count}.
+        """
+        self.ensure_one()
+        Params = self.env['payroll.vn.params'].sudo()._get_default_params()
+        open_slips = self.slip_ids.filtered(lambda s: s.state not in ('done', 'cancel'))
+        profiles = self.env['payroll.salary.profile'].get_profiles_as_of(open_slips.mapped('employee_id').ids, self.date_end)
+        slips = open_slips.filtered(lambda s: float(getattr(profiles.get(s.employee_id.id), 'net_target', 0.0) or 0.0) > 0)
+        stale = (open_slips - slips).filtered(lambda s: s.net_target or s.gross_up_state)
+        if stale:
+            stale.write({
+                'net_target': 0.0,
+                'gross_up_gross': 0.0,
+                'gross_up_state': False,
+                'gross_up_iterations': 0,
+                'gross_up_residual': 0.0,
+            })
+        if not slips:
+            if stale:
+                return {}
+            raise UserError(_("Không có phiếu lương nào có lương Net mục tiêu (Salary Profile > Net mục tiêu)."))
+        key = self.gross_up_key or 'base_wage'
+        net_code = self.gross_up_net_code or 'NET'
+        pit_tables = {}
+        prepared = [slip._prepare_rule_eval(Params, pit_tables) for slip in slips]
+        ytd = slips._ytd_context()
+        extras = [s._rule_extra_context(ytd) for s in slips]
+        targets = [float(profiles[s.employee_id.id].net_target) for s in slips]
+
+        def residual(i, gross):
+            rules, var_map, pit_table = prepared[i]
+            vm = dict(var_map, **{key: gross})
+            codes, lines = slips[i]._evaluate_rules(
+                rules, vm, pit_table, extra=dict(extras[i], gross_up=gross))
+            return float(codes.get(net_code, 0.0)) - targets[i], lines
+
+        n = len(slips)
+        # Bracket [a, b] with f(a) < 0 <= f(b); best = (|f|, gross, f, lines) seen so far
+        a, fa = [0.0] * n, [0.0] * n
+        b = [max(self._gross_up_initial_guess(Params, prepared[i][2], targets[i], profiles[slips[i].employee_id.id]), 1.0)
+             for i in range(n)]
+        fb, best = [None] * n, [None] * n
+        iters, state = [0] * n, [None] * n
+        side = [0] * n  # Illinois: which end was kept last time
+
+        def record(i, x, fx, lines):
+            iters[i] += 1
+            if best[i] is None or abs(fx) < best[i][0]:
+                best[i] = (abs(fx), x, fx, lines)
+            if abs(fx) <= GROSS_UP_TOLERANCE:
+                state[i] = 'converged'
+
+        # Gross 0 must stay below the target, otherwise no positive gross solves it
+        for i in range(n):
+            fx, lines = residual(i, 0.0)
+            fa[i] = fx
+            record(i, 0.0, fx, lines)
+            if not state[i] and fx > 0:
+                state[i] = 'no_root'
+
+        # Initial guess, then double until it overshoots the target
+        active = [i for i in range(n) if not state[i]]
+        while active:
+            for i in active:
+                fx, lines = residual(i, b[i])
+                fb[i] = fx
+                record(i, b[i], fx, lines)
+            nxt = []
+            for i in active:
+                if state[i] or fb[i] >= 0:
+                    continue
+                if iters[i] >= GROSS_UP_MAX_ITER:
+                    # Still below the target: the root may lie further out, it is just not bracketed yet
+                    state[i] = 'max_iter'
+                    continue
+                a[i], fa[i], b[i] = b[i], fb[i], b[i] * 2.0
+                nxt.append(i)
+            active = nxt
+
+        # Lock-step false position on the bracketed slips
+        active = [i for i in range(n) if not state[i]]
+        while active:
+            for i in active:
+                x = b[i] - fb[i] * (b[i] - a[i]) / (fb[i] - fa[i]) if fb[i] != fa[i] else (a[i] + b[i]) / 2.0
+                fx, lines = residual(i, x)
+                record(i, x, fx, lines)
+                if fx < 0:
+                    a[i], fa[i] = x, fx
+                    if side[i] == -1:
+                        fb[i] /= 2.0
+                    side[i] = -1
+                else:
+                    b[i], fb[i] = x, fx
+                    if side[i] == 1:
+                        fa[i] /= 2.0
+                    side[i] = 1
+            for i in active:
+                if not state[i] and iters[i] >= GROSS_UP_MAX_ITER:
+                    state[i] = 'max_iter'
+            active = [i for i in active if not state[i]]
+
+        summary = {}
+        for i, slip in enumerate(slips):
+            _err, gross, fx, lines = best[i]
+            slip.write({
+                'line_ids': slip._rule_line_commands(lines),
+                'net_target': targets[i],
+                'gross_up_gross': gross,
+                'gross_up_state': state[i],
+                'gross_up_iterations': iters[i],
+                'gross_up_residual': fx,
+            })
+            summary[state[i]] = summary.get(state[i], 0) + 1
+        return summary
+
+    def action_print_payslips_pdf(self):
+        """Queue background rendering of all payslips of the batch; progress shows on the PDF tab."""
+        for run in self:
+            self.env['payroll.payslip.pdf.job'].enqueue(run)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Payslip PDF'),
+                'message': _('Rendering started in the background. Download the file from the PDF tab when done.'),
+                'type': 'info',
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+            }
+        }
+
+    def action_compute_gross_up(self):
+        """Net-to-gross mode: compute guaranteed-net payslips of the batch from their target net."""
+        summary = {}
+        for run in self:
+            for k, v in run._solve_gross_up().items():
+                summary[k] = summary.get(k, 0) + v
+        failed = summary.get('max_iter', 0) + summary.get('no_root', 0)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Gross-up'),
+                'message': _('%s payslips converged, %s not converged.') % (summary.get('converged', 0), failed),
+                'sticky': bool(failed),
+                'type': 'warning' if failed else 'success',
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+            }
+        }
@@ -0,0 +1,256 @@
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools.pdf import merge_pdf
+from odoo.addons.base.models.ir_actions_report import _get_wkhtmltopdf_bin
+
+from .kpi_job import job_time_budget
+
+_logger = logging.getLogger(__name__)
+
+PAYSLIP_REPORT = "payroll_3c.action_report_payslip"
+# Seconds a single cron run may spend starting waves before re-triggering itself. A wave started just
+# before the deadline still runs to the end, so this stays well below the default limit_time_real (120 s);
+# override with the system parameter below
+PDF_JOB_TIME_BUDGET = 60
+PDF_JOB_TIME_BUDGET_PARAM = "payroll_3c.pdf_job_time_budget"
+
+
+def _run_wkhtmltopdf(command, pdf_path):
+    """Worker: one wkhtmltopdf process for one chunk. Uses no ORM state, so it can run in a pool thread."""
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # 1 is returned on non-fatal warnings (e.g. a missing image), like ir.actions.report accepts
+    if process.returncode not in (0, 1):
+        raise UserError(_("wkhtmltopdf failed (error code: %s): %s") % (
+            process.returncode, process.stderr.decode(errors="replace")[-1000:]))
+    with open(pdf_path, "rb") as f:
+        return f.read()
+
+
+class PayrollPayslipPdfJob(models.Model):
+    _name = "payroll.payslip.pdf.job"
+    _description = "Payslip PDF Batch Job"
+    _order = "id desc"
+
+    name = fields.Char(required=True)
+    run_id = fields.Many2one("payroll.payslip.run", string="Batch", required=True, ondelete="cascade", index=True)
+    # Ordered payslip ids; next_index points at the first one not yet rendered and committed
+    slip_ids = fields.Json(string="Payslips")
+    chunk_size = fields.Integer(default=100, help="Payslips per PDF file (one wkhtmltopdf process each).")
+    max_workers = fields.Integer(string="Parallel workers", default=lambda self: min(4, os.cpu_count() or 1))
+    output = fields.Selection([
+        ("zip", "ZIP of chunk PDFs"),
+        ("merged", "Single merged PDF"),
+    ], default="zip", required=True)
+    next_index = fields.Integer(string="Rendered", default=0, readonly=True)
+    total_count = fields.Integer(string="Payslips to render", readonly=True)
+    chunk_attachment_ids = fields.Many2many(
+        "ir.attachment", "payroll_payslip_pdf_job_chunk_rel", "job_id", "attachment_id", string="Chunks", readonly=True)
+    attachment_id = fields.Many2one("ir.attachment", string="Result", readonly=True, ondelete="set null")
+    state = fields.Selection([
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+        ("cancel", "Cancelled"),
+    ], default="pending", required=True, readonly=True)
+    date_start = fields.Datetime(string="Started", readonly=True)
+    date_done = fields.Datetime(string="Finished", readonly=True)
+    last_error = fields.Text(readonly=True)
+    progress = fields.Float(string="Progress (%)", compute="_compute_progress")
+    eta = fields.Datetime(string="Estimated End", compute="_compute_progress")
+
+    _sql_constraints = [
+        ("pdf_job_chunk_size_pos", "CHECK(chunk_size > 0)", "Chunk size must be > 0"),
+        ("pdf_job_workers_pos", "CHECK(max_workers > 0)", "At least one worker is required"),
+    ]
+
+    @api.depends("next_index", "total_count", "date_start", "state")
+    def _compute_progress(self):
+        now = fields.Datetime.now()
+        for job in self:
+            total = job.total_count or 0
+            done = min(job.next_index or 0, total)
+            job.progress = (done * 100.0 / total) if total else (100.0 if job.state == "done" else 0.0)
+            job.eta = False
+            if job.state == "running" and job.date_start and 0 < done < total:
+                elapsed = (now - job.date_start).total_seconds()
+                job.eta = now + timedelta(seconds=elapsed / done * (total - done))
+
+    @api.model
+    def enqueue(self, run, output="zip"):
+        """Create a pending job for the non-cancelled payslips of `run` and wake up the PDF cron."""
+        slips = self.env["payroll.payslip"].search(
+            [("run_id", "=", run.id), ("state", "!=", "cancel")], order="employee_department_id, employee_id, id")
+        if not slips:
+            raise UserError(_("Chu kì lương chưa có phiếu lương để in."))
+        job = self.create({
+            "name": _("Payslips %s") % run.name,
+            "run_id": run.id,
+            "slip_ids": slips.ids,
+            "total_count": len(slips),
+            "output": output,
+        })
+        cron = self.env.ref("payroll_3c.ir_cron_payslip_pdf_jobs", raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return job
+
+    def _commit(self):
+        # Never commit inside tests; the test transaction is rolled back as a whole
+        if not getattr(threading.current_thread(), "testing", False):
+            self.env.cr.commit()
+
+    def _prepare_chunk(self, report, slip_ids, tmpdir, index):
+        """Render the HTML of one chunk (ORM, main thread); returns (wkhtmltopdf command, PDF path, slip count).
+
+        Lines and employees of the chunk are prefetched in two queries before QWeb iterates the documents;
+        the compiled template is cached by QWeb, so only the first chunk compiles it.
+        """
+        slips = self.env["payroll.payslip"].browse(slip_ids).exists()
+        slips.mapped("line_ids.category_id")
+        slips.mapped("employee_id.department_id")
+        html = report._render_qweb_html(report.report_name, slips.ids)[0]
+        bodies, _res_ids, header, footer, specific_args = report._prepare_html(html, report_model=report.model)
+        command = [_get_wkhtmltopdf_bin()] + report._build_wkhtmltopdf_args(
+            report.get_paperformat(), False, specific_args, False)
+        for option, content in (("--header-html", header), ("--footer-html", footer)):
+            if content:
+                path = os.path.join(tmpdir, "%s.%s.html" % (index, option.strip("-")))
+                with open(path, "wb") as f:
+                    f.write(content.encode() if isinstance(content, str) else content)
+                command += [option, path]
+        for i, body in enumerate(bodies):
+            path = os.path.join(tmpdir, "%s.body.%s.html" % (index, i))
+            with open(path, "wb") as f:
+                f.write(body.encode() if isinstance(body, str) else body)
+            command.append(path)
+        pdf_path = os.path.join(tmpdir, "%s.pdf" % index)
+        command.append(pdf_path)
+        return command, pdf_path, len(slip_ids)
+
+    def _process(self, deadline):
+        """Render waves of up to max_workers chunks until done or `deadline` (time.time()) is reached.
+
+        HTML is rendered in this thread; the wkhtmltopdf processes of a wave run side by side in a pool
+        bounded by max_workers. Each finished wave is committed (chunk attachments and next_index), so a
+        crash or timeout resumes at the first chunk not yet stored. Returns True when the job is finished.
+        """
+        self.ensure_one()
+        if self.state == "pending":
+            self.write({"state": "running", "date_start": fields.Datetime.now()})
+            self._commit()
+        report = self.env["ir.actions.report"]._get_report(PAYSLIP_REPORT)
+        slip_ids = self.slip_ids or []
+        size = self.chunk_size or 100
+        workers = self.max_workers or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while self.next_index < len(slip_ids):
+                if time.time() > deadline:
+                    return False
+                # Pick up a cancel issued from the UI since the last commit
+                self.invalidate_recordset(["state"])
+                if self.state == "cancel":
+                    return True
+                start = self.next_index
+                try:
+                    with tempfile.TemporaryDirectory(prefix="payslip.pdf.") as tmpdir:
+                        jobs = []
+                        for offset in range(start, min(start + size * workers, len(slip_ids)), size):
+                            jobs.append(self._prepare_chunk(report, slip_ids[offset:offset + size], tmpdir, offset))
+                        futures = [pool.submit(_run_wkhtmltopdf, command, pdf_path)
+                                   for command, pdf_path, _count in jobs]
+                        attachments = self.env["ir.attachment"]
+                        position = start
+                        for future, (_command, _path, count) in zip(futures, jobs):
+                            attachments |= self.env["ir.attachment"].create({
+                                "name": "payslips_%05d-%05d.pdf" % (position + 1, position + count),
+                                "raw": future.result(),
+                                "mimetype": "application/pdf",
+                                "res_model": self._name,
+                                "res_id": self.id,
+                            })
+                            position += count
+                    self.write({
+                        "chunk_attachment_ids": [(4, att.id) for att in attachments],
+                        "next_index": position,
+                    })
+                    self._commit()
+                    # Keep the cache (payslips, lines, employees) bounded to one wave
+                    self.env.invalidate_all()
+                except Exception as e:
+                    self.env.cr.rollback()
+                    _logger.exception("[payroll.payslip.pdf.job] job %s failed at payslip #%s", self.id, start)
+                    self.write({"state": "failed", "last_error": str(e)})
+                    self._commit()
+                    return True
+
+        self._finalize()
+        self.write({"state": "done", "date_done": fields.Datetime.now()})
+        self._commit()
+        return True
+
+    def _finalize(self):
+        """Assemble the chunk PDFs into the result attachment (zip or merged PDF) and drop the chunks."""
+        chunks = self.chunk_attachment_ids.sorted("name")
+        base = (self.run_id.name or "payslips").replace("/", "-")
+        if self.output == "merged":
+            data, name, mimetype = merge_pdf([att.raw for att in chunks]), "%s.pdf" % base, "application/pdf"
+        else:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+                for att in chunks:
+                    archive.writestr(att.name, att.raw)
+            data, name, mimetype = buffer.getvalue(), "%s.zip" % base, "application/zip"
+        self.attachment_id = self.env["ir.attachment"].create({
+            "name": name,
+            "raw": data,
+            "mimetype": mimetype,
+            "res_model": self.run_id._name,
+            "res_id": self.run_id.id,
+        })
+        chunks.unlink()
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Run pending jobs and resume running ones (e.g. after a worker crash or timeout)."""
+        deadline = time.time() + job_time_budget(self.env, PDF_JOB_TIME_BUDGET_PARAM, PDF_JOB_TIME_BUDGET)
+        for job in self.search([("state", "in", ("pending", "running"))], order="id"):
+            if not job._process(deadline):
+                # Out of time: continue from the last committed wave in a fresh cron run
+                self.env.ref("payroll_3c.ir_cron_payslip_pdf_jobs")._trigger()
+                return
+
+    def action_resume(self):
+        """Re-queue failed or cancelled jobs; rendering restarts at the first chunk not yet stored."""
+        for job in self:
+            if job.state not in ("failed", "cancel"):
+                raise UserError(_("Only failed or cancelled jobs can be resumed."))
+        for job in self:
+            job.write({"state": "running" if job.date_start else "pending", "last_error": False})
+        self.env.ref("payroll_3c.ir_cron_payslip_pdf_jobs")._trigger()
+        return True
+
+    def action_cancel(self):
+        self.filtered(lambda j: j.state in ("pending", "running")).write({"state": "cancel"})
+        return True
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_("The file is not ready yet."))
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/web/content/%s?download=true" % self.attachment_id.id,
+            "target": "self",
+        }
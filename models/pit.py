@@ -0,0 +1,78 @@
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:  # optional: batch PIT falls back to a per-value loop
+    np = None
+
+# Monthly VN PIT table in force since 2009: (upper bound of taxable income in VND, rate); None = no upper bound
+DEFAULT_PIT_BRACKETS = [
+    (5_000_000.0, 0.05),
+    (10_000_000.0, 0.10),
+    (18_000_000.0, 0.15),
+    (32_000_000.0, 0.20),
+    (52_000_000.0, 0.25),
+    (80_000_000.0, 0.30),
+    (None, 0.35),
+]
+
+
+class PitTable:
+    """Progressive tax table with cumulative tax precomputed at every bracket edge.
+
+    `brackets` is a list of (upper_bound, rate) sorted by bound, rates as fractions, the last bound None.
+    For taxable income t in bracket i: tax = cum[i] + (t - edges[i]) * rates[i], found by bisection.
+    """
+
+    def __init__(self, brackets):
+        self.edges = [0.0]
+        self.rates = []
+        self.cum = [0.0]
+        for upper, rate in brackets:
+            self.rates.append(float(rate))
+            if upper is None:
+                break
+            self.cum.append(self.cum[-1] + (float(upper) - self.edges[-1]) * float(rate))
+            self.edges.append(float(upper))
+        if len(self.rates) < len(self.edges):
+            # No open-ended bracket configured: keep the last rate above the last bound
+            self.rates.append(self.rates[-1] if self.rates else 0.0)
+        # Taxable income after tax at each edge; strictly increasing while every rate < 100%
+        self.net_edges = [e - c for e, c in zip(self.edges, self.cum)]
+
+    def tax(self, taxable):
+        t = float(taxable or 0.0)
+        if t <= 0:
+            return 0.0
+        i = bisect_right(self.edges, t) - 1
+        return self.cum[i] + (t - self.edges[i]) * self.rates[i]
+
+    def tax_many(self, taxables):
+        """Tax of every value of `taxables`; returns a list of floats."""
+        if np is None:
+            return [self.tax(t) for t in taxables]
+        t = np.clip(np.asarray(taxables, dtype=float), 0.0, None)
+        i = np.searchsorted(np.asarray(self.edges), t, side="right") - 1
+        res = np.asarray(self.cum)[i] + (t - np.asarray(self.edges)[i]) * np.asarray(self.rates)[i]
+        return res.tolist()
+
+    def taxable_from_net(self, net):
+        """Exact inverse of t - tax(t): the taxable income leaving `net` after tax."""
+        n = float(net or 0.0)
+        if n <= 0:
+            return 0.0
+        i = bisect_right(self.net_edges, n) - 1
+        r = self.rates[i]
+        return (n + self.cum[i] - self.edges[i] * r) / (1.0 - r)
+
+    def gross_from_net(self, net, deduction=0.0, insurance_rate=0.0, insurance_fixed=0.0):
+        """Closed-form gross-up of a net salary.
+
+        net = gross - insurance - tax(gross - insurance - deduction), with
+        insurance = gross * insurance_rate + insurance_fixed (rate as fraction).
+        """
+        n = float(net or 0.0)
+        d = float(deduction or 0.0)
+        # Income after insurance: untaxed up to the deductions, inverse table above them
+        after_ins = n if n <= d else d + self.taxable_from_net(n - d)
+        return (after_ins + float(insurance_fixed or 0.0)) / (1.0 - float(insurance_rate or 0.0))
@@ -0,0 +1,162 @@
+import time
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .pit import DEFAULT_PIT_BRACKETS, PitTable
+
+
+class PayrollPitFinalization(models.Model):
+    """Annual PIT settlement of one year, computed from the stored lines of the year's done payslips.
+
+    Kept as its own model rather than a type of payroll.payslip.run: a batch is one month of payslips
+    evaluated by salary rules, while the settlement has no payslips and only reads the year's totals.
+    """
+    _name = "payroll.pit.finalization"
+    _description = "Annual PIT Finalization"
+    _order = "year desc, id desc"
+
+    name = fields.Char(required=True, default="/", copy=False)
+    year = fields.Integer(required=True, default=lambda self: fields.Date.context_today(self).year - 1)
+    state = fields.Selection([
+        ("draft", "Draft"),
+        ("computed", "Computed"),
+        ("done", "Done"),
+    ], default="draft", required=True, readonly=True)
+    insurance_code = fields.Char(string="Insurance rule code", default="INS_EMP", required=True,
+                                 help="Employee insurance lines deducted from taxable income.")
+    pit_code = fields.Char(string="PIT rule code", default="PIT", required=True,
+                           help="Monthly PIT lines counted as tax already withheld.")
+    line_ids = fields.One2many("payroll.pit.finalization.line", "finalization_id", string="Employees")
+    employee_count = fields.Integer(string="Employees", readonly=True)
+    total_refund = fields.Float(string="Total refund", readonly=True)
+    total_extra = fields.Float(string="Total extra payment", readonly=True)
+    compute_duration = fields.Float(string="Compute time (s)", digits=(16, 2), readonly=True)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if not vals.get("name") or vals.get("name") == "/":
+                vals["name"] = _("PIT Finalization %s") % (vals.get("year") or fields.Date.context_today(self).year - 1)
+        return super().create(vals_list)
+
+    def _aggregate_year(self):
+        """One grouped query over done payslips of the year, per employee:
+        months, income (lines of taxable earning categories, without the gross/net total lines of the
+        VN params), insurance, PIT withheld and dependent-months (dependent_count of the salary profile
+        version valid at each slip's date_to)."""
+        self.ensure_one()
+        params = self.env["payroll.vn.params"].sudo()._get_default_params()
+        self.env["payroll.category"].flush_model(["type", "taxable"])
+        self.env["payroll.payslip.line"].flush_model()
+        self.env["payroll.payslip"].flush_model()
+        self.env["payroll.salary.profile"].flush_model()
+        self.env.cr.execute("""
+            WITH slips AS (
+                SELECT p.id, p.employee_id, p.date_to
+                  FROM payroll_payslip p
+                 WHERE p.state = 'done'
+                   AND p.date_to >= make_date(%(year)s, 1, 1)
+                   AND p.date_to <= make_date(%(year)s, 12, 31)
+            ), amounts AS (
+                SELECT s.employee_id,
+                       SUM(CASE WHEN c.type = 'earn' AND c.taxable
+                                     AND l.code IS DISTINCT FROM %(gross)s AND l.code IS DISTINCT FROM %(net)s
+                                THEN l.amount * l.quantity ELSE 0 END) AS income,
+                       SUM(CASE WHEN l.code = %(ins)s THEN l.amount * l.quantity ELSE 0 END) AS insurance,
+                       SUM(CASE WHEN l.code = %(pit)s THEN l.amount * l.quantity ELSE 0 END) AS withheld
+                  FROM slips s
+                  JOIN payroll_payslip_line l ON l.payslip_id = s.id
+             LEFT JOIN payroll_category c ON c.id = l.category_id
+              GROUP BY s.employee_id
+            ), dependents AS (
+                SELECT s.employee_id, COUNT(*) AS months, SUM(COALESCE(prof.dependent_count, 0)) AS dependent_months
+                  FROM slips s
+             LEFT JOIN LATERAL (
+                    SELECT sp.dependent_count
+                      FROM payroll_salary_profile sp
+                     WHERE sp.employee_id = s.employee_id
+                       AND (sp.date_from IS NULL OR sp.date_from <= s.date_to)
+                  ORDER BY sp.date_from DESC NULLS LAST, sp.id DESC
+                     LIMIT 1
+                ) prof ON TRUE
+              GROUP BY s.employee_id
+            )
+            SELECT d.employee_id, d.months, d.dependent_months,
+                   COALESCE(a.income, 0), COALESCE(a.insurance, 0), COALESCE(a.withheld, 0)
+              FROM dependents d
+         LEFT JOIN amounts a ON a.employee_id = d.employee_id
+          ORDER BY d.employee_id
+        """, {"year": self.year, "ins": self.insurance_code, "pit": self.pit_code,
+              "gross": params.gross_code or None, "net": params.net_code or None})
+        return self.env.cr.fetchall()
+
+    def action_compute(self):
+        """Recompute every employee of the year in one pass: SQL aggregates, annual table, batch tax."""
+        for rec in self:
+            if rec.state == "done":
+                raise UserError(_("A finalized PIT settlement cannot be recomputed."))
+            started = time.perf_counter()
+            rows = rec._aggregate_year()
+            params = self.env["payroll.vn.params"].sudo()._get_default_params()
+            personal = float(params.personal_deduction or 0.0) if params else 0.0
+            per_dependent = float(params.dependent_deduction or 0.0) if params else 0.0
+            # Annual settlement: monthly brackets in force at year end, bounds scaled to 12 months
+            year_end = fields.Date.to_date("%04d-12-31" % rec.year)
+            monthly = params._pit_brackets_as_of(year_end) if params else DEFAULT_PIT_BRACKETS
+            table = PitTable([(upper * 12 if upper else None, rate) for upper, rate in monthly])
+            vals_list = []
+            for emp_id, months, dep_months, income, insurance, withheld in rows:
+                deduction = personal * months + per_dependent * float(dep_months or 0)
+                taxable = max(0.0, float(income) - float(insurance) - deduction)
+                vals_list.append({
+                    "finalization_id": rec.id,
+                    "employee_id": emp_id,
+                    "months": months,
+                    "dependent_months": int(dep_months or 0),
+                    "income": float(income),
+                    "insurance": float(insurance),
+                    "deduction": deduction,
+                    "taxable": taxable,
+                    "withheld": float(withheld),
+                })
+            taxes = table.tax_many([v["taxable"] for v in vals_list])
+            for vals, tax in zip(vals_list, taxes):
+                vals["annual_tax"] = tax
+                vals["difference"] = tax - vals["withheld"]
+            rec.line_ids.unlink()
+            self.env["payroll.pit.finalization.line"].create(vals_list)
+            rec.write({
+                "state": "computed",
+                "employee_count": len(vals_list),
+                "total_refund": -sum(v["difference"] for v in vals_list if v["difference"] < 0),
+                "total_extra": sum(v["difference"] for v in vals_list if v["difference"] > 0),
+                "compute_duration": time.perf_counter() - started,
+            })
+        return True
+
+    def action_done(self):
+        self.filtered(lambda r: r.state == "computed").write({"state": "done"})
+        return True
+
+    def action_reset_to_draft(self):
+        self.write({"state": "draft"})
+        return True
+
+
+class PayrollPitFinalizationLine(models.Model):
+    _name = "payroll.pit.finalization.line"
+    _description = "Annual PIT Finalization Line"
+    _order = "finalization_id, employee_id"
+
+    finalization_id = fields.Many2one("payroll.pit.finalization", required=True, ondelete="cascade", index=True)
+    employee_id = fields.Many2one("employee3c.employee.base", string="Employee", required=True, readonly=True)
+    months = fields.Integer(string="Months paid", readonly=True)
+    dependent_months = fields.Integer(string="Dependent-months", readonly=True)
+    income = fields.Float(string="Taxable earnings", readonly=True)
+    insurance = fields.Float(string="Insurance", readonly=True)
+    deduction = fields.Float(string="Family deductions", readonly=True)
+    taxable = fields.Float(string="Taxable income", readonly=True)
+    annual_tax = fields.Float(string="Annual PIT", readonly=True)
+    withheld = fields.Float(string="PIT withheld", readonly=True)
+    difference = fields.Float(string="Extra (+) / Refund (-)", readonly=True)
@@ -14,6 +14,10 @@ class PayrollCategory(models.Model):
         default="earn",
         required=True,
     )
+    taxable = fields.Boolean(
+        string="Taxable (PIT)", default=True,
+        help="Earnings of this category count as taxable income in the annual PIT finalization. "
+             "Uncheck for exempt allowances (e.g. meals, uniforms, overtime premium).")
 
 
 class PayrollRule(models.Model):
@@ -0,0 +1,38 @@
+from odoo import fields, models
+
+# (code, label) of the month-end pipeline stages of payroll.payslip.run, in execution order.
+# Each code maps to payroll.payslip.run._stage_<code>(), which is idempotent and returns a row count.
+PIPELINE_STAGES = [
+    ("sheet", "Payroll sheet"),
+    ("sheet_lines", "Sheet lines"),
+    ("timesheet", "Timesheet points"),
+    ("kpi", "KPI compute"),
+    ("adjustments", "Auto KPI adjustments"),
+    ("compute", "Compute payslips"),
+]
+
+
+class PayrollPayslipRunStage(models.Model):
+    _name = "payroll.payslip.run.stage"
+    _description = "Payroll Batch Pipeline Stage"
+    _order = "run_id, sequence, id"
+
+    run_id = fields.Many2one("payroll.payslip.run", string="Batch", required=True, ondelete="cascade", index=True)
+    sequence = fields.Integer(default=10)
+    code = fields.Char(required=True)
+    name = fields.Char(required=True)
+    state = fields.Selection([
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ], default="pending", required=True, readonly=True)
+    date_start = fields.Datetime(string="Started", readonly=True)
+    date_done = fields.Datetime(string="Finished", readonly=True)
+    duration = fields.Float(string="Duration (s)", digits=(16, 2), readonly=True)
+    row_count = fields.Integer(string="Rows", readonly=True)
+    message = fields.Text(readonly=True)
+
+    _sql_constraints = [
+        ("run_stage_unique", "unique(run_id, code)", "A stage can appear only once per batch."),
+    ]
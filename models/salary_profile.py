@@ -1,25 +1,65 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models
+from odoo import api, fields, models, _
+from odoo.exceptions import ValidationError
 
 
 class PayrollSalaryProfile(models.Model):
     _name = 'payroll.salary.profile'
     _description = 'Payroll Salary Profile'
-    _order = 'employee_id'
+    _order = 'employee_id, date_from desc'
 
     employee_id = fields.Many2one('employee3c.employee.base', string='Employee', required=True, ondelete='cascade', index=True)
     department_id = fields.Many2one('employee3c.department', string='Department', related='employee_id.department_id', store=True, index=True)
     employee_code = fields.Char(string='Employee Code', related='employee_id.employee_index', store=True, index=True)
     employee_avatar_html = fields.Html(string='Employee', related='employee_id.avatar_name_job', sanitize=False)
+    # Empty date_from = valid since always (profiles created before versioning)
+    date_from = fields.Date(string='Effective From', help='First day this version applies. Leave empty for the initial version.')
     base_wage = fields.Float(string='Base Wage')
     si_wage = fields.Float(string='Social Insurance Wage')
     dependent_count = fields.Integer(string='Dependents')
+    net_target = fields.Float(string='Guaranteed Net', help='Net-salary contract: target net pay solved by the batch gross-up. 0 = gross contract.')
     note = fields.Char()
 
+    # The unique index on (employee_id, date_from) also serves the as-of lookups below
     _sql_constraints = [
-        ('unique_employee', 'unique(employee_id)', 'Each employee can have only one salary profile.'),
+        ('unique_employee_date', 'unique(employee_id, date_from)',
+         'An employee can have only one salary profile version per effective date.'),
     ]
 
+    def init(self):
+        # Versions replaced the former one-profile-per-employee constraint
+        self.env.cr.execute(
+            "ALTER TABLE payroll_salary_profile DROP CONSTRAINT IF EXISTS payroll_salary_profile_unique_employee")
+
+    @api.constrains('employee_id', 'date_from')
+    def _check_single_undated_version(self):
+        # unique() treats NULLs as distinct, so guard the undated initial version here
+        for rec in self.filtered(lambda r: not r.date_from):
+            if self.search_count([('employee_id', '=', rec.employee_id.id), ('date_from', '=', False), ('id', '!=', rec.id)]):
+                raise ValidationError(_("Employee %s already has an initial salary profile without an effective date.")
+                                      % rec.employee_id.display_name)
+
+    @api.model
+    def get_profiles_as_of(self, employee_ids, as_of=None):
+        """Return {employee_id: profile} with the version valid on `as_of` (default today) for all employees
+        in one query: the latest date_from <= as_of, an undated version counting as the oldest."""
+        employee_ids = list(employee_ids or [])
+        if not employee_ids:
+            return {}
+        as_of = fields.Date.to_date(as_of) or fields.Date.context_today(self)
+        self.flush_model(['employee_id', 'date_from'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (employee_id) employee_id, id
+              FROM payroll_salary_profile
+             WHERE employee_id = ANY(%s)
+               AND (date_from IS NULL OR date_from <= %s)
+          ORDER BY employee_id, date_from DESC NULLS LAST, id DESC
+        """, (employee_ids, as_of))
+        rows = self.env.cr.fetchall()
+        profiles = self.browse([pid for _emp, pid in rows])
+        by_id = {p.id: p for p in profiles}
+        return {emp_id: by_id[pid] for emp_id, pid in rows}
+
 
 class PayrollParams(models.Model):
     _inherit = 'payroll.vn.params'
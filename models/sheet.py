@@ -162,8 +162,10 @@ class PayrollSheet(models.Model):
             if lines_to_remove:
                 lines_to_remove.unlink()
             lines_to_create = []
+            # Salary profile versions valid at the sheet's end, for all employees in one lookup
+            profiles = self.env['payroll.salary.profile'].get_profiles_as_of(employees.ids, sheet.date_end)
             for emp in employees:
-                new_values_json = sheet._resolve_values_for_employee(emp, vars_by_key)
+                new_values_json = sheet._resolve_values_for_employee(emp, vars_by_key, profiles)
                 # Compute fixed keys safely
                 emp_code = ''
                 for a in ('employee_index', 'emp_code', 'code', 'employee_code', 'employee_ref', 'ref', 'identification_id'):
@@ -239,35 +241,40 @@ class PayrollSheet(models.Model):
             if not (sheet.date_start and sheet.date_end):
                 raise UserError(_("Thiếu khoảng thời gian của Payroll Sheet."))
 
-            d_from, d_to = sheet.date_start, sheet.date_end
-            for line in sheet.line_ids:
-                # Aggregate per employee over date range
-                recs = TS.search([
-                    ('employee_id', '=', line.employee_id.id),
-                    ('date', '>=', d_from),
-                    ('date', '<=', d_to),
-                ])
-                points_sum = 0.0
-                workday_sum = 0.0
-                for r in recs:
-                    try:
-                        points_sum += float(getattr(r, 'shift_point', 0.0) or 0.0)
-                    except Exception:
-                        pass
-                    try:
-                        workday_sum += float(getattr(r, 'standard_shift_point', 0.0) or 0.0)
-                    except Exception:
-                        pass
-                # Merge into JSON
-                try:
-                    data = json.loads(line.values or '{}')
-                except Exception:
-                    data = {}
-                data['points'] = points_sum
-                data['work_day'] = workday_sum
-                line.values = json.dumps(data, ensure_ascii=False)
+            sheet._sync_timesheet_points_lines(sheet.line_ids)
         return True
 
+    def _sync_timesheet_points_lines(self, lines):
+        """Write points/work_day of `lines` (lines of this sheet) from one grouped timesheet query.
+        Lines whose values are already current are not written; returns the lines that changed."""
+        self.ensure_one()
+        changed = self.env['payroll.sheet.line']
+        if not lines:
+            return changed
+        TS = self.env['timesheet3c.sheet']
+        src = {'points': 'shift_point', 'work_day': 'standard_shift_point'}
+        present = [f for f in src.values() if f in TS._fields]
+        sums = {}
+        if present:
+            rows = TS.read_group([
+                ('employee_id', 'in', lines.mapped('employee_id').ids),
+                ('date', '>=', self.date_start),
+                ('date', '<=', self.date_end),
+            ], [f'{f}:sum' for f in present], ['employee_id'])
+            sums = {row['employee_id'][0]: row for row in rows if row.get('employee_id')}
+        for line in lines:
+            row = sums.get(line.employee_id.id) or {}
+            try:
+                data = json.loads(line.values or '{}')
+            except Exception:
+                data = {}
+            new_vals = {key: float(row.get(fname) or 0.0) for key, fname in src.items()}
+            if any(data.get(k) != v for k, v in new_vals.items()):
+                data.update(new_vals)
+                line.values = json.dumps(data, ensure_ascii=False)
+                changed |= line
+        return changed
+
     def action_open_timesheet_cycle(self):
         """Open the timesheet monthly cycle view filtered by this sheet's month/year."""
         self.ensure_one()
@@ -280,16 +287,25 @@ class PayrollSheet(models.Model):
             'target': 'current',
         }
 
+    def action_open_export_wizard(self):
+        """Streamed XLSX/CSV export of this sheet (template columns from the line JSON)."""
+        self.ensure_one()
+        action = self.env.ref('payroll_3c.action_payroll_export_wizard').sudo().read()[0]
+        action['context'] = {'default_export_type': 'sheet', 'default_sheet_id': self.id}
+        return action
+
     def unlink(self):
         for rec in self:
             if rec.state == 'done':
                 raise UserError("Không thể xóa Payroll Sheet ở trạng thái Done.")
         return super().unlink()
 
-    def _resolve_values_for_employee(self, employee, vars_by_key):
+    def _resolve_values_for_employee(self, employee, vars_by_key, profiles=None):
         """Resolve values for all variables for a given employee.
         Only 'auto' variables are fetched; 'formula' left blank for later computation.
         'input' left blank.
+        `profiles` is {employee_id: salary profile} as of date_end, resolved once for the whole sheet;
+        without it the employee's profile is looked up once here.
         """
         res = {}
         # Precompute timesheet aggregates when relevant
@@ -334,9 +350,9 @@ class PayrollSheet(models.Model):
                 if model_name == "employee3c.employee.base":
                     value = getattr(employee, field_name, None)
                 elif model_name == "payroll.salary.profile":
-                    prof = self.env['payroll.salary.profile'].search([
-                        ("employee_id", "=", employee.id)
-                    ], limit=1)
+                    if profiles is None:
+                        profiles = self.env['payroll.salary.profile'].get_profiles_as_of(employee.ids, self.date_end)
+                    prof = profiles.get(employee.id)
                     if prof:
                         value = getattr(prof, field_name, None)
                 elif model_name in ("timesheet3c.monthly.sheet", "timesheet3c.sheet"):
@@ -206,112 +206,150 @@ class PayrollVariable(models.Model):
         - Hỗ trợ lấy trực tiếp từ Payroll Sheet sau khi đồng bộ công: payroll.sheet.line:<field>
         - Với many2one, nếu data_type=integer sẽ trả về id; nếu char sẽ trả về tên.
         """
-        res = {}
+        if not employee:
+            return {}
+        res = self.compute_values_for_employees(employee, date_from, date_to, keys=keys)
+        return res.get(employee.id, {})
+
+    def compute_values_for_employees(self, employees, date_from=None, date_to=None, keys=None):
+        """Phiên bản batch của compute_values_for_employee: {employee_id: {payroll_key: value}}.
+        Mỗi model nguồn chỉ đọc một lần cho toàn bộ nhân sự (hồ sơ lương, dòng Payroll Sheet,
+        timesheet tháng, tổng hợp timesheet ngày bằng read_group) thay vì search theo từng người.
+        """
+        res = {emp.id: {} for emp in employees}
+        if not employees:
+            return res
         # Chuẩn bị nhanh: lấy biến theo keys (nếu có)
         domain = [('kind', '=', 'auto')]
         if keys:
             domain.append(('payroll_key', 'in', list(keys)))
         vars_q = self.search(domain)
+        models_needed = {v.system_key.split(':', 1)[0] for v in vars_q if v.system_key and ':' in v.system_key}
+        emp_ids = employees.ids
 
-        # Trợ giúp: tổng hợp timesheet theo ngày
-        def _aggregate_timesheet(emp, d_from, d_to):
+        # Hồ sơ lương: phiên bản hiệu lực tại cuối kỳ (date_to), một truy vấn cho tất cả nhân sự
+        profiles = {}
+        if 'payroll.salary.profile' in models_needed:
+            try:
+                profiles = self.env['payroll.salary.profile'].get_profiles_as_of(emp_ids, date_to or date_from)
+            except Exception:
+                profiles = {}
+
+        # Payroll Sheet Line (JSON values) để phản ánh số liệu sau sync
+        sheet_data = {}
+        if 'payroll.sheet.line' in models_needed:
+            try:
+                ctx = dict(self.env.context or {})
+                domain_sl = [('employee_id', 'in', emp_ids)]
+                sheet_id = ctx.get('sheet_id')
+                run_id = ctx.get('run_id')
+                if sheet_id:
+                    domain_sl.append(('sheet_id', '=', sheet_id))
+                elif run_id:
+                    domain_sl.append(('sheet_id.run_id', '=', run_id))
+                elif date_from:
+                    # Fallback: tìm sheet theo tháng/năm của date_from
+                    dt = fields.Date.from_string(date_from)
+                    sh = self.env['payroll.sheet'].search([('month', '=', dt.month), ('year', '=', dt.year)], limit=1)
+                    if sh:
+                        domain_sl.append(('sheet_id', '=', sh.id))
+                for line in self.env['payroll.sheet.line'].search(domain_sl):
+                    if line.employee_id.id in sheet_data:
+                        continue
+                    try:
+                        sheet_data[line.employee_id.id] = json.loads(line.values or '{}')
+                    except Exception:
+                        sheet_data[line.employee_id.id] = {}
+            except Exception:
+                sheet_data = {}
+
+        # Timesheet tháng (nếu có model)
+        monthly = {}
+        if 'timesheet3c.monthly.sheet' in models_needed and date_from:
+            try:
+                dt = fields.Date.from_string(date_from)
+                for ts_rec in self.env['timesheet3c.monthly.sheet'].search([
+                    ('employee_id', 'in', emp_ids),
+                    ('month', '=', dt.month),
+                    ('year', '=', dt.year),
+                ]):
+                    monthly.setdefault(ts_rec.employee_id.id, ts_rec)
+            except Exception:
+                monthly = {}
+
+        # Trợ giúp: tổng hợp timesheet theo ngày, một read_group cho tất cả nhân sự (tính khi cần)
+        daily_cache = {}
+
+        def _aggregate_timesheet():
+            if 'agg' in daily_cache:
+                return daily_cache['agg']
+            daily_cache['agg'] = None
             try:
                 ts = self.env['timesheet3c.sheet']
             except Exception:
                 return None
-            if not (d_from and d_to):
+            if not (date_from and date_to):
                 return None
-            recs = ts.search([
-                ('employee_id', '=', emp.id),
-                ('date', '>=', d_from),
-                ('date', '<=', d_to),
-            ])
-            points_sum = 0.0
-            workday_sum = 0.0
-            unpaid = 0.0
-            sum_late = 0
-            for r in recs:
-                points_sum += float(getattr(r, 'shift_point', 0.0) or 0.0)
-                workday_sum += float(getattr(r, 'standard_shift_point', 0.0) or 0.0)
-                unpaid += float(getattr(r, 'unpaid_leave_day', 0.0) or 0.0)
-                try:
-                    sum_late += int(getattr(r, 'sum_late', 0) or 0)
-                except Exception:
-                    pass
-            return {
-                'points': points_sum,
-                'work_day': workday_sum,
-                'unpaid_lf_point': unpaid,
-                'sum_late': sum_late,
+            src = {
+                'points': 'shift_point',
+                'work_day': 'standard_shift_point',
+                'unpaid_lf_point': 'unpaid_leave_day',
+                'sum_late': 'sum_late',
             }
+            present = [f for f in src.values() if f in ts._fields]
+            agg = {
+                emp_id: {'points': 0.0, 'work_day': 0.0, 'unpaid_lf_point': 0.0, 'sum_late': 0}
+                for emp_id in emp_ids
+            }
+            if present:
+                rows = ts.read_group(
+                    [('employee_id', 'in', emp_ids), ('date', '>=', date_from), ('date', '<=', date_to)],
+                    [f'{f}:sum' for f in present],
+                    ['employee_id'],
+                )
+                for row in rows:
+                    emp_id = row['employee_id'][0]
+                    for key, fname in src.items():
+                        if fname in present:
+                            val = row.get(fname) or 0
+                            agg[emp_id][key] = int(val) if key == 'sum_late' else float(val)
+            daily_cache['agg'] = agg
+            return agg
 
-        for v in vars_q:
-            value = None
-            if not (v.system_key and ':' in v.system_key):
-                continue
-            model_name, field_name = v.system_key.split(':', 1)
-            try:
-                if model_name == 'employee3c.employee.base':
-                    value = getattr(employee, field_name, None)
-                elif model_name == 'payroll.salary.profile':
-                    prof = self.env['payroll.salary.profile'].search([
-                        ('employee_id', '=', employee.id)
-                    ], limit=1)
-                    if prof:
-                        value = getattr(prof, field_name, None)
-                elif model_name == 'payroll.sheet.line':
-                    # Lấy giá trị trực tiếp từ Payroll Sheet Line (JSON values) để phản ánh số liệu sau sync
-                    ctx = dict(self.env.context or {})
-                    SheetLine = self.env['payroll.sheet.line']
-                    domain_sl = [('employee_id', '=', employee.id)]
-                    sheet_id = ctx.get('sheet_id')
-                    run_id = ctx.get('run_id')
-                    if sheet_id:
-                        domain_sl.append(('sheet_id', '=', sheet_id))
-                    elif run_id:
-                        domain_sl.append(('sheet_id.run_id', '=', run_id))
-                    else:
-                        # Fallback: tìm sheet theo tháng/năm của date_from
-                        try:
-                            if date_from:
-                                dt = fields.Date.from_string(date_from)
-                                Sheet = self.env['payroll.sheet']
-                                sh = Sheet.search([('month', '=', dt.month), ('year', '=', dt.year)], limit=1)
-                                if sh:
-                                    domain_sl.append(('sheet_id', '=', sh.id))
-                        except Exception:
-                            pass
-                    line = SheetLine.search(domain_sl, limit=1)
-                    if line:
-                        try:
-                            data_json = line.values or '{}'
-                            data = json.loads(data_json)
+        for employee in employees:
+            emp_res = res[employee.id]
+            for v in vars_q:
+                value = None
+                if not (v.system_key and ':' in v.system_key):
+                    continue
+                model_name, field_name = v.system_key.split(':', 1)
+                try:
+                    if model_name == 'employee3c.employee.base':
+                        value = getattr(employee, field_name, None)
+                    elif model_name == 'payroll.salary.profile':
+                        prof = profiles.get(employee.id)
+                        if prof:
+                            value = getattr(prof, field_name, None)
+                    elif model_name == 'payroll.sheet.line':
+                        data = sheet_data.get(employee.id)
+                        if data is not None:
                             value = data.get(field_name)
-                        except Exception:
-                            value = None
-                elif model_name in ('timesheet3c.monthly.sheet', 'timesheet3c.sheet'):
-                    # Ưu tiên monthly nếu có, nếu không tổng hợp từ bản ghi ngày
-                    if model_name == 'timesheet3c.monthly.sheet':
-                        try:
-                            ts_model = self.env[model_name]
-                            ts_rec = ts_model.search([
-                                ('employee_id', '=', employee.id),
-                                ('month', '=', date_from and fields.Date.from_string(date_from).month or 0),
-                                ('year', '=', date_from and fields.Date.from_string(date_from).year or 0),
-                            ], limit=1)
+                    elif model_name in ('timesheet3c.monthly.sheet', 'timesheet3c.sheet'):
+                        # Ưu tiên monthly nếu có, nếu không tổng hợp từ bản ghi ngày
+                        if model_name == 'timesheet3c.monthly.sheet':
+                            ts_rec = monthly.get(employee.id)
                             if ts_rec:
                                 value = getattr(ts_rec, field_name, None)
-                        except Exception:
-                            value = None
-                    if value is None:
-                        agg = _aggregate_timesheet(employee, date_from, date_to)
-                        if agg and field_name in agg:
-                            value = agg[field_name]
-                else:
+                        if value is None:
+                            agg = _aggregate_timesheet()
+                            emp_agg = agg and agg.get(employee.id)
+                            if emp_agg and field_name in emp_agg:
+                                value = emp_agg[field_name]
+                    else:
+                        value = None
+                except Exception:
                     value = None
-            except Exception:
-                value = None
-            res[v.payroll_key] = self._to_primitive(value, v.data_type)
+                emp_res[v.payroll_key] = self._to_primitive(value, v.data_type)
         return res
 
     def action_add_to_template(self):
@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+from odoo import api, fields, models
+
+
+class PayrollYtd(models.Model):
+    _name = "payroll.ytd"
+    _description = "Payroll Year-to-date Totals"
+    _order = "year desc, employee_id, code"
+
+    employee_id = fields.Many2one("employee3c.employee.base", string="Employee", required=True, ondelete="cascade")
+    year = fields.Integer(required=True)
+    code = fields.Char(string="Rule Code", required=True)
+    amount = fields.Float(string="YTD Total", readonly=True)
+    slip_count = fields.Integer(string="Payslips", readonly=True)
+
+    # The unique index is also the lookup path of get_ytd_maps and of the upsert below
+    _sql_constraints = [
+        ("ytd_unique", "unique(employee_id, year, code)", "One YTD row per employee, year and code."),
+    ]
+
+    def init(self):
+        # Backfill from done payslips not yet posted (e.g. done before this table existed)
+        self.env.cr.execute("""
+            WITH posted AS (
+                UPDATE payroll_payslip SET ytd_posted = TRUE
+                 WHERE state = 'done' AND ytd_posted IS NOT TRUE AND date_to IS NOT NULL
+             RETURNING id, employee_id, date_to
+            )
+            INSERT INTO payroll_ytd (employee_id, year, code, amount, slip_count, create_date, write_date)
+            SELECT p.employee_id, EXTRACT(YEAR FROM p.date_to)::int, l.code,
+                   SUM(COALESCE(l.amount, 0) * COALESCE(l.quantity, 0)), COUNT(DISTINCT p.id),
+                   now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM posted p
+              JOIN payroll_payslip_line l ON l.payslip_id = p.id
+             WHERE l.code IS NOT NULL
+          GROUP BY p.employee_id, EXTRACT(YEAR FROM p.date_to), l.code
+            ON CONFLICT (employee_id, year, code) DO UPDATE
+               SET amount = payroll_ytd.amount + EXCLUDED.amount,
+                   slip_count = payroll_ytd.slip_count + EXCLUDED.slip_count
+        """)
+
+    @api.model
+    def _apply_payslips(self, payslips, sign):
+        """Add (sign=1) or remove (sign=-1) the line totals of `payslips` to the accumulators.
+
+        Line totals are grouped in Python per (employee, year of date_to, code) and written with a single
+        INSERT ... ON CONFLICT upsert, so posting a whole batch is one statement.
+        """
+        deltas = defaultdict(float)
+        counts = defaultdict(int)
+        for slip in payslips:
+            year = slip.date_to.year
+            slip_codes = set()
+            for line in slip.line_ids:
+                if not line.code:
+                    continue
+                key = (slip.employee_id.id, year, line.code)
+                deltas[key] += sign * float(line.amount or 0.0) * float(line.quantity or 0.0)
+                slip_codes.add(key)
+            for key in slip_codes:
+                counts[key] += sign
+        if not deltas:
+            return
+        self.flush_model()
+        rows = [(emp_id, year, code, amount, counts[(emp_id, year, code)])
+                for (emp_id, year, code), amount in deltas.items()]
+        values = ", ".join(["(%s, %s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC', %s, %s)"] * len(rows))
+        params = []
+        for row in rows:
+            params += list(row) + [self.env.uid, self.env.uid]
+        self.env.cr.execute(f"""
+            INSERT INTO payroll_ytd (employee_id, year, code, amount, slip_count, create_date, write_date, create_uid, write_uid)
+            VALUES {values}
+            ON CONFLICT (employee_id, year, code) DO UPDATE
+               SET amount = payroll_ytd.amount + EXCLUDED.amount,
+                   slip_count = payroll_ytd.slip_count + EXCLUDED.slip_count,
+                   write_date = EXCLUDED.write_date,
+                   write_uid = EXCLUDED.write_uid
+        """, params)
+        self.invalidate_model(["amount", "slip_count"])
+
+    @api.model
+    def get_ytd_maps(self, employee_ids, years):
+        """{(employee_id, year): {code: amount}} for all pairs in one query; missing codes read as 0.0."""
+        res = defaultdict(lambda: defaultdict(float))
+        if not employee_ids or not years:
+            return res
+        for row in self.search_read(
+                [("employee_id", "in", list(employee_ids)), ("year", "in", list(years))],
+                ["employee_id", "year", "code", "amount"]):
+            res[(row["employee_id"][0], row["year"])][row["code"]] = row["amount"]
+        return res
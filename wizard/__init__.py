@@ -3,3 +3,8 @@ from . import create_sheet_wizard
 from . import bulk_create_profiles_wizard
 from . import confirm_delete_wizard
 from . import kpi_compute_wizard
+from . import kpi_rescore_wizard
+from . import kpi_diagnostics_wizard
+from . import import_profiles_wizard
+from . import retro_wizard
+from . import export_wizard
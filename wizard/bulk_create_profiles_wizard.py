@@ -34,28 +34,37 @@ class PayrollBulkCreateProfilesWizard(models.TransientModel):
             domain.append(('id', 'in', self.employee_ids.ids))
         employees = self.env['employee3c.employee.base'].search(domain)
         if self.include_has_profile == 'only_missing':
-            prof_emp_ids = self.env['payroll.salary.profile'].search([]).mapped('employee_id').ids
-            employees = employees.filtered(lambda e: e.id not in prof_emp_ids)
+            employees = employees.browse(self._filter_by_profile(employees.ids, has_profile=False))
         elif self.include_has_profile == 'only_existing':
-            prof_emp_ids = self.env['payroll.salary.profile'].search([]).mapped('employee_id').ids
-            employees = employees.filtered(lambda e: e.id in prof_emp_ids)
+            employees = employees.browse(self._filter_by_profile(employees.ids, has_profile=True))
         return employees
 
+    def _filter_by_profile(self, employee_ids, has_profile):
+        """Keep the ids of employees with (or without) any salary profile version, via an SQL (anti-)join."""
+        if not employee_ids:
+            return []
+        self.env['payroll.salary.profile'].flush_model(['employee_id'])
+        self.env.cr.execute("""
+            SELECT e.id
+              FROM unnest(%s::int[]) AS e(id)
+             WHERE {} EXISTS (SELECT 1 FROM payroll_salary_profile p WHERE p.employee_id = e.id)
+        """.format('' if has_profile else 'NOT'), (list(employee_ids),))
+        return [row[0] for row in self.env.cr.fetchall()]
+
     def action_create_profiles(self):
         Profile = self.env['payroll.salary.profile']
-        created = 0
         employees = self._get_employees()
-        for emp in employees:
-            existing = Profile.search([('employee_id', '=', emp.id)], limit=1)
-            if existing:
-                continue
-            Profile.create({
-                'employee_id': emp.id,
-                'base_wage': getattr(emp, 'standard_salary', 0.0) or 0.0,
-                'si_wage': getattr(emp, 'standard_salary', 0.0) or 0.0,
-                'dependent_count': 0,
-            })
-            created += 1
+        if self.include_has_profile != 'only_missing':
+            employees = employees.browse(self._filter_by_profile(employees.ids, has_profile=False))
+        vals_list = [{
+            'employee_id': emp.id,
+            'base_wage': getattr(emp, 'standard_salary', 0.0) or 0.0,
+            'si_wage': getattr(emp, 'standard_salary', 0.0) or 0.0,
+            'dependent_count': 0,
+        } for emp in employees]
+        if vals_list:
+            Profile.create(vals_list)
+        created = len(vals_list)
         message = _('%s profiles created.') % created
         return {
             'type': 'ir.actions.client',
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+import re
+import tempfile
+import time
+
+import xlsxwriter
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+# Records read per round trip; the ORM cache is dropped after each chunk
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class PayrollExportWizard(models.TransientModel):
+    _name = 'payroll.export.wizard'
+    _description = 'Export Payroll Sheet / Payslip Register'
+
+    export_type = fields.Selection([
+        ('sheet', 'Payroll sheet'),
+        ('register', 'Payslip register'),
+    ], required=True, default='sheet')
+    sheet_id = fields.Many2one('payroll.sheet', string='Payroll Sheet')
+    run_id = fields.Many2one('payroll.payslip.run', string='Batch')
+    file_format = fields.Selection([('xlsx', 'Excel (.xlsx)'), ('csv', 'CSV')], required=True, default='xlsx')
+    attachment_id = fields.Many2one('ir.attachment', string='File', readonly=True, ondelete='set null')
+    filename = fields.Char(readonly=True)
+    row_count = fields.Integer(string='Rows', readonly=True)
+    duration = fields.Float(string='Duration (s)', digits=(16, 2), readonly=True)
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Export'),
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    # ---------- row generators: (header, iterator of rows) ----------
+    def _chunks(self, records):
+        for start in range(0, len(records), EXPORT_CHUNK_SIZE):
+            chunk = records[start:start + EXPORT_CHUNK_SIZE]
+            yield chunk
+            chunk.invalidate_recordset()
+
+    def _sheet_rows(self):
+        """Template columns (visible, in sequence) read from each sheet line's JSON values."""
+        sheet = self.sheet_id
+        columns = sheet.template_id.column_ids.filtered('visible').sorted(lambda c: (c.sequence, c.id))
+        keys = [c.payroll_key for c in columns]
+        header = [_('Employee Code'), _('Employee')] + [c.display_name or c.payroll_key for c in columns]
+        lines = self.env['payroll.sheet.line'].search([('sheet_id', '=', sheet.id)], order='employee_id, id')
+
+        def rows():
+            for chunk in self._chunks(lines):
+                values = chunk.read(['employee_id', 'values'], load=None)
+                employees = {e['id']: e for e in self.env['employee3c.employee.base'].browse(
+                    {v['employee_id'] for v in values}).read(['employee_index', 'name'])}
+                for line in values:
+                    employee = employees[line['employee_id']]
+                    try:
+                        data = json.loads(line['values'] or '{}')
+                    except ValueError:
+                        data = {}
+                    yield [employee['employee_index'] or '', employee['name'] or ''] + [data.get(k) for k in keys]
+        return header, rows()
+
+    def _register_codes(self, run):
+        """Rule codes present in the batch, ordered like the rules (lowest line sequence first)."""
+        self.env['payroll.payslip.line'].flush_model()
+        self.env.cr.execute("""
+            SELECT l.code
+              FROM payroll_payslip_line l
+              JOIN payroll_payslip p ON p.id = l.payslip_id
+             WHERE p.run_id = %s AND p.state != 'cancel'
+          GROUP BY l.code
+          ORDER BY MIN(l.sequence), l.code
+        """, [run.id])
+        return [r[0] for r in self.env.cr.fetchall()]
+
+    def _register_rows(self):
+        """One row per payslip: employee, department, state, one column per rule code, stored totals."""
+        run = self.run_id
+        codes = self._register_codes(run)
+        header = [_('Employee Code'), _('Employee'), _('Department'), _('Status')] + codes + \
+            [_('Gross'), _('Deductions'), _('Net'), _('Employer Cost')]
+        slips = self.env['payroll.payslip'].search(
+            [('run_id', '=', run.id), ('state', '!=', 'cancel')], order='employee_department_id, employee_id')
+        states = dict(slips._fields['state']._description_selection(self.env))
+
+        def rows():
+            for chunk in self._chunks(slips):
+                self.env.cr.execute("""
+                    SELECT payslip_id, code, SUM(COALESCE(amount, 0) * COALESCE(quantity, 0))
+                      FROM payroll_payslip_line
+                     WHERE payslip_id = ANY(%s)
+                  GROUP BY payslip_id, code
+                """, [chunk.ids])
+                amounts = {}
+                for slip_id, code, total in self.env.cr.fetchall():
+                    amounts.setdefault(slip_id, {})[code] = total
+                for slip in chunk:
+                    by_code = amounts.get(slip.id, {})
+                    yield [slip.employee_id.employee_index or '', slip.employee_id.name or '',
+                           slip.employee_department_id.display_name or '', states.get(slip.state, slip.state)] + \
+                        [by_code.get(code, 0.0) for code in codes] + \
+                        [slip.gross_amount, slip.deduction_amount, slip.net_amount, slip.employer_cost]
+        return header, rows()
+
+    # ---------- writers: rows go straight to a temporary file ----------
+    def _write_csv(self, path, header, rows):
+        count = 0
+        # utf-8-sig so Excel opens Vietnamese text correctly
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(['' if v is None else v for v in row])
+                count += 1
+        return count
+
+    def _write_xlsx(self, path, header, rows, sheet_name):
+        # constant_memory flushes every row to disk once the next one starts
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        # Excel sheet names: at most 31 characters, none of []:*?/\
+        worksheet = workbook.add_worksheet(re.sub(r'[\[\]:*?/\\]', '-', sheet_name)[:31])
+        bold = workbook.add_format({'bold': True})
+        worksheet.write_row(0, 0, header, bold)
+        count = 0
+        for count, row in enumerate(rows, start=1):
+            worksheet.write_row(count, 0, row)
+        workbook.close()
+        return count
+
+    def action_export(self):
+        self.ensure_one()
+        if self.export_type == 'sheet':
+            if not self.sheet_id:
+                raise UserError(_("Chọn bảng lương cần xuất."))
+            header, rows = self._sheet_rows()
+            base_name = self.sheet_id.name
+        else:
+            if not self.run_id:
+                raise UserError(_("Chọn chu kì lương cần xuất."))
+            header, rows = self._register_rows()
+            base_name = _('Register %s') % self.run_id.name
+        started = time.perf_counter()
+        fd, path = tempfile.mkstemp(suffix='.' + self.file_format)
+        os.close(fd)
+        try:
+            if self.file_format == 'csv':
+                count = self._write_csv(path, header, rows)
+            else:
+                count = self._write_xlsx(path, header, rows, base_name)
+            filename = '%s.%s' % (base_name.replace('/', '-'), self.file_format)
+            # Stored on the exported sheet/batch straight from the file bytes (no base64 copy); reading
+            # it goes through the access rights of that record
+            source = self.sheet_id if self.export_type == 'sheet' else self.run_id
+            with open(path, 'rb') as f:
+                attachment = self.env['ir.attachment'].create({
+                    'name': filename,
+                    'raw': f.read(),
+                    'mimetype': EXPORT_MIMETYPES[self.file_format],
+                    'res_model': source._name,
+                    'res_id': source.id,
+                })
+        finally:
+            os.unlink(path)
+        self.write({
+            'state': 'done',
+            'attachment_id': attachment.id,
+            'filename': filename,
+            'row_count': count,
+            'duration': time.perf_counter() - started,
+        })
+        return self._reopen()
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_("The file is not ready yet."))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % self.attachment_id.id,
+            'target': 'self',
+        }
@@ -46,20 +46,19 @@ class PayrollGeneratePayslipsWizard(models.TransientModel):
         employees = self.env["employee3c.employee.base"].search(domain)
         if not employees:
             raise UserError(_("No employees match the selection."))
-        created = self.env["payroll.payslip"]
-        for emp in employees:
-            # Avoid duplicate payslip for same employee in the same batch
-            exists = created.search([('employee_id', '=', emp.id), ('run_id', '=', self.run_id.id)], limit=1)
-            if exists:
-                continue
-            vals = {
-                "employee_id": emp.id,
-                "date_from": self.date_start,
-                "date_to": self.date_end,
-                "structure_id": self.structure_id.id if self.structure_id else False,
-                "run_id": self.run_id.id,
-            }
-            created |= created.create(vals)
+        Payslip = self.env["payroll.payslip"]
+        # Avoid duplicate payslip for same employee in the same batch: one query for existing pairs
+        existing = Payslip.search_read(
+            [('employee_id', 'in', employees.ids), ('run_id', '=', self.run_id.id)], ['employee_id'])
+        existing_emp_ids = {r['employee_id'][0] for r in existing if r.get('employee_id')}
+        vals_list = [{
+            "employee_id": emp.id,
+            "date_from": self.date_start,
+            "date_to": self.date_end,
+            "structure_id": self.structure_id.id if self.structure_id else False,
+            "run_id": self.run_id.id,
+        } for emp in employees if emp.id not in existing_emp_ids]
+        created = Payslip.create(vals_list) if vals_list else Payslip
         action = self.env.ref("payroll_3c.action_payroll_payslips").read()[0]
         action["domain"] = [("id", "in", created.ids)]
         return action
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import base64
+import codecs
+import csv
+import io
+import math
+from collections import defaultdict
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+# Rows resolved and written per round trip while streaming the file
+IMPORT_BATCH_SIZE = 1000
+# Errors listed in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 50
+
+EMPLOYEE_CODE_COLUMNS = ('employee_code', 'employee_index', 'code')
+VALUE_COLUMNS = {
+    'base_wage': float,
+    'si_wage': float,
+    'dependent_count': int,
+}
+
+
+class PayrollImportProfilesWizard(models.TransientModel):
+    _name = 'payroll.import.profiles.wizard'
+    _description = 'Import Salary Profiles from CSV'
+
+    file = fields.Binary(string='CSV File', required=True)
+    filename = fields.Char()
+    delimiter = fields.Selection([
+        (',', 'Comma (,)'),
+        (';', 'Semicolon (;)'),
+        ('\t', 'Tab'),
+    ], default=',', required=True)
+    date_from = fields.Date(
+        string='Effective From',
+        help='Upsert the profile version starting on this date. Leave empty to update the version valid today '
+             '(or create an initial version for employees without profile).')
+    created_count = fields.Integer(string='Created', readonly=True)
+    updated_count = fields.Integer(string='Updated', readonly=True)
+    error_count = fields.Integer(string='Errors', readonly=True)
+    report = fields.Text(readonly=True)
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Import Salary Profiles'),
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _decoded_lines(self, raw, bad_lines):
+        """Text lines of the byte stream `raw`; numbers of lines that are not valid UTF-8 go to `bad_lines`
+        (they are decoded with replacement characters so the CSV reader can move past them)."""
+        for line_no, line in enumerate(raw, start=1):
+            if line_no == 1 and line.startswith(codecs.BOM_UTF8):
+                # Excel writes a BOM in front of the header
+                line = line[len(codecs.BOM_UTF8):]
+            try:
+                yield line.decode('utf-8')
+            except UnicodeDecodeError:
+                bad_lines.add(line_no)
+                yield line.decode('utf-8', errors='replace')
+
+    def _iter_rows(self):
+        """Yield (line_no, row dict, error) from the uploaded file without materializing all rows.
+
+        Rows that are not UTF-8 or not valid CSV come with an error message instead of a row, so they are
+        reported with their line number and the import goes on.
+        """
+        bad_lines = set()
+        raw = io.BytesIO(base64.b64decode(self.file))
+        reader = csv.DictReader(self._decoded_lines(raw, bad_lines), delimiter=self.delimiter)
+        try:
+            fieldnames = reader.fieldnames
+        except csv.Error as e:
+            raise UserError(_("The header line is not valid CSV: %s") % e)
+        if not fieldnames:
+            raise UserError(_("The file is empty."))
+        if bad_lines:
+            raise UserError(_("The file is not UTF-8 encoded. Save it as CSV UTF-8 and import it again."))
+        reader.fieldnames = [(f or '').strip().lower() for f in fieldnames]
+        if not any(c in reader.fieldnames for c in EMPLOYEE_CODE_COLUMNS):
+            raise UserError(_("Missing employee code column (one of: %s).") % ', '.join(EMPLOYEE_CODE_COLUMNS))
+        if not any(c in reader.fieldnames for c in VALUE_COLUMNS):
+            raise UserError(_("Missing value columns (any of: %s).") % ', '.join(VALUE_COLUMNS))
+        while True:
+            first_line = reader.line_num + 1
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num, None, _("malformed CSV: %s") % e
+                continue
+            if bad_lines.intersection(range(first_line, reader.line_num + 1)):
+                yield reader.line_num, None, _("not UTF-8 text")
+                continue
+            yield reader.line_num, row, None
+
+    def _parse_row(self, row):
+        code = ''
+        for col in EMPLOYEE_CODE_COLUMNS:
+            code = (row.get(col) or '').strip()
+            if code:
+                break
+        if not code:
+            raise ValueError(_("missing employee code"))
+        vals = {}
+        for fname, cast in VALUE_COLUMNS.items():
+            raw = (row.get(fname) or '').strip()
+            if not raw:
+                continue
+            try:
+                number = float(raw)
+            except ValueError:
+                raise ValueError(_("invalid %s '%s'") % (fname, raw))
+            if not math.isfinite(number):
+                raise ValueError(_("invalid %s '%s'") % (fname, raw))
+            if cast is int and not number.is_integer():
+                raise ValueError(_("%s must be a whole number, got '%s'") % (fname, raw))
+            vals[fname] = cast(number)
+        if not vals:
+            raise ValueError(_("no value to import"))
+        return code, vals
+
+    def _flush_batch(self, batch, errors):
+        """Upsert one batch of parsed rows: one employee search, one profile lookup, one multi-create."""
+        Profile = self.env['payroll.salary.profile']
+        codes = list({code for _line, code, _vals in batch})
+        employees = self.env['employee3c.employee.base'].search([('employee_index', 'in', codes)])
+        emp_by_code = {e.employee_index: e.id for e in employees}
+        emp_ids = list(emp_by_code.values())
+        if self.date_from:
+            current = {p.employee_id.id: p for p in Profile.search([
+                ('employee_id', 'in', emp_ids), ('date_from', '=', self.date_from)])}
+        else:
+            current = Profile.get_profiles_as_of(emp_ids)
+        created = updated = 0
+        to_create = {}
+        to_update = {}
+        for line, code, vals in batch:
+            emp_id = emp_by_code.get(code)
+            if not emp_id:
+                errors.append((line, _("unknown employee code '%s'") % code))
+                continue
+            prof = current.get(emp_id)
+            if prof:
+                # Same employee twice in one batch: last row wins
+                to_update.setdefault(prof, {}).update(vals)
+            elif emp_id in to_create:
+                # Same employee twice in one batch: last row wins
+                to_create[emp_id].update(vals)
+            else:
+                to_create[emp_id] = dict(vals, employee_id=emp_id, date_from=self.date_from or False)
+        # Profiles getting the same new values are written together (e.g. a new dependent_count or SI wage)
+        by_changes = defaultdict(lambda: Profile)
+        for prof, vals in to_update.items():
+            changed = {k: v for k, v in vals.items() if prof[k] != v}
+            if changed:
+                by_changes[tuple(sorted(changed.items()))] |= prof
+        for changes, profs in by_changes.items():
+            profs.write(dict(changes))
+            updated += len(profs)
+        if to_create:
+            Profile.create(list(to_create.values()))
+            created += len(to_create)
+        return created, updated
+
+    def action_import(self):
+        self.ensure_one()
+        created = updated = 0
+        errors = []
+        batch = []
+        for line, row, error in self._iter_rows():
+            if error:
+                errors.append((line, error))
+                continue
+            try:
+                code, vals = self._parse_row(row)
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            batch.append((line, code, vals))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                c, u = self._flush_batch(batch, errors)
+                created, updated, batch = created + c, updated + u, []
+        if batch:
+            c, u = self._flush_batch(batch, errors)
+            created, updated = created + c, updated + u
+
+        errors.sort()
+        report = [_("%s created, %s updated, %s errors.") % (created, updated, len(errors))]
+        report += [_("Line %s: %s") % (line, msg) for line, msg in errors[:MAX_REPORTED_ERRORS]]
+        if len(errors) > MAX_REPORTED_ERRORS:
+            report.append(_("... %s more errors not shown.") % (len(errors) - MAX_REPORTED_ERRORS))
+        self.write({
+            'state': 'done',
+            'created_count': created,
+            'updated_count': updated,
+            'error_count': len(errors),
+            'report': '\n'.join(report),
+        })
+        return self._reopen()
@@ -11,6 +11,9 @@ class PayrollKpiComputeWizard(models.TransientModel):
     employee_ids = fields.Many2many('employee3c.employee.base', string='Employees',
                                     domain="[('user_id', '!=', False)]")
     overdue_threshold_days = fields.Integer(string='Overdue threshold (days)', default=7)
+    incremental = fields.Boolean(
+        string='Only changed employees',
+        help='Recompute only employees whose tasks changed since the period\'s last KPI compute.')
 
     def _ensure_quality_profile(self):
         self.ensure_one()
@@ -29,12 +32,17 @@ class PayrollKpiComputeWizard(models.TransientModel):
             raise UserError(_("Please select a KPI Period."))
         qprof = self._ensure_quality_profile()
 
-        Engine = self.env['payroll.kpi_engine']
-        Group = self.env['payroll.kpi_group']
-        Label = self.env['payroll.kpi_label']
-
-        groups = Group.search([('active', '=', True)])
-        labels = Label.search([('active', '=', True)])
+        threshold = int(self.overdue_threshold_days or 7)
+        if self.incremental:
+            employees = period._compute_kpi_incremental(qprof, overdue_threshold_days=threshold)
+            return {
+                'type': 'ir.actions.act_window',
+                'name': _('KPI Records'),
+                'res_model': 'payroll.kpi_record',
+                'view_mode': 'tree,form',
+                'domain': [('period_id', '=', period.id), ('employee_id', 'in', employees.ids)],
+                'target': 'current',
+            }
 
         employees = self.employee_ids
         if not employees:
@@ -42,20 +50,18 @@ class PayrollKpiComputeWizard(models.TransientModel):
         if not employees:
             raise UserError(_("No employees selected or available to compute KPI."))
 
-        for emp in employees:
-            counts = Engine.aggregate_employee_label_counts(emp, period, labels, overdue_threshold_days=int(self.overdue_threshold_days or 7))
-            metrics = Engine.compute_group_metrics(counts, qprof, groups)
-            Engine.upsert_kpi_records(emp, period, metrics)
-
-        # Open KPI records for the selection
-        domain = [('period_id', '=', period.id)]
-        if employees:
-            domain.append(('employee_id', 'in', employees.ids))
+        # Full compute runs in a background job (chunked, resumable); follow its progress on the job
+        job = self.env['payroll.kpi_job'].enqueue(
+            period, qprof, employees,
+            overdue_threshold_days=threshold,
+            # Full scope computed: later incremental runs only need changes after this point
+            set_watermark=not self.employee_ids,
+        )
         return {
             'type': 'ir.actions.act_window',
-            'name': _('KPI Records'),
-            'res_model': 'payroll.kpi_record',
-            'view_mode': 'tree,form',
-            'domain': domain,
+            'name': _('KPI Job'),
+            'res_model': 'payroll.kpi_job',
+            'res_id': job.id,
+            'view_mode': 'form',
             'target': 'current',
         }
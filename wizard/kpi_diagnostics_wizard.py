@@ -0,0 +1,124 @@
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+from ..models.kpi_engine import KPI_BUCKETS, KPI_BUCKET_ONTIME, KPI_BUCKET_LATE, KPI_BUCKET_OVERDUE
+
+BUCKET_SELECTION = [
+    ('ontime', 'On time'),
+    ('late', 'Late'),
+    ('overdue', 'Overdue'),
+]
+
+REASON_SELECTION = [
+    ('near_due', 'On time, close to deadline'),
+    ('just_late', 'Late by a partial day'),
+    ('near_overdue', 'Late, at the overdue threshold'),
+    ('just_overdue', 'Overdue by one day'),
+]
+
+
+class PayrollKpiDiagnosticsLine(models.TransientModel):
+    _name = 'payroll.kpi.diagnostics.line'
+    _description = 'KPI Diagnostics Borderline Task'
+    _order = 'employee_id, due_date, id'
+
+    wizard_id = fields.Many2one('payroll.kpi.diagnostics.wizard', required=True, ondelete='cascade')
+    task_id = fields.Many2one('project3c.task', string='Task', readonly=True)
+    employee_id = fields.Many2one('employee3c.employee.base', string='Employee', readonly=True)
+    due_date = fields.Datetime(string='Deadline', readonly=True)
+    done_date = fields.Datetime(string='Done', readonly=True)
+    hours_from_due = fields.Float(string='Hours after deadline', digits=(16, 2), readonly=True,
+                                  help='Negative when the task was finished before its deadline.')
+    delay_days = fields.Integer(string='Delay (days)', readonly=True)
+    bucket = fields.Selection(BUCKET_SELECTION, string='Classified as', readonly=True)
+    reason = fields.Selection(REASON_SELECTION, string='Borderline because', readonly=True)
+
+
+class PayrollKpiDiagnosticsWizard(models.TransientModel):
+    _name = 'payroll.kpi.diagnostics.wizard'
+    _description = 'KPI Diagnostics: borderline tasks'
+
+    period_id = fields.Many2one('payroll.kpi_period', string='KPI Period', required=True)
+    employee_ids = fields.Many2many('employee3c.employee.base', string='Employees',
+                                    domain="[('user_id', '!=', False)]")
+    overdue_threshold_days = fields.Integer(string='Overdue threshold (days)', default=7)
+    margin_hours = fields.Float(string='Margin (hours)', default=24.0,
+                                help='On-time or late tasks finished within this many hours of the deadline are listed.')
+    line_ids = fields.One2many('payroll.kpi.diagnostics.line', 'wizard_id', string='Borderline tasks')
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('KPI Diagnostics'),
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _search_tasks(self):
+        """Tasks the KPI engine would count for the period: due in range and tagged with an active label."""
+        self.ensure_one()
+        period = self.period_id
+        tag_ids = self.env['payroll.kpi_label'].search([('active', '=', True)]).mapped('tag_id').ids
+        if not tag_ids:
+            return self.env['project3c.task']
+        domain = [
+            ('due_date', '>=', fields.Datetime.to_datetime(period.date_start)),
+            ('due_date', '<=', fields.Datetime.end_of(fields.Datetime.to_datetime(period.date_end), 'day')),
+            ('tag_ids', 'in', tag_ids),
+            ('state', '=', 'done'),
+        ]
+        if self.employee_ids:
+            domain.append(('assignee_id', 'in', self.employee_ids.mapped('user_id').ids))
+        else:
+            domain.append(('assignee_id', '!=', False))
+        return self.env['project3c.task'].search(domain)
+
+    def _borderline_reason(self, code, delay_days, hours, threshold):
+        margin = self.margin_hours or 0.0
+        if code == KPI_BUCKET_ONTIME and -hours <= margin:
+            return 'near_due'
+        if code == KPI_BUCKET_LATE:
+            if delay_days == threshold:
+                return 'near_overdue'
+            if hours <= margin:
+                return 'just_late'
+        if code == KPI_BUCKET_OVERDUE and delay_days == threshold + 1:
+            return 'just_overdue'
+        return False
+
+    def action_run(self):
+        """List completed tasks whose KPI bucket would flip with a small change of done date or threshold."""
+        self.ensure_one()
+        if self.margin_hours < 0:
+            raise UserError(_("Margin must be >= 0."))
+        threshold = int(self.overdue_threshold_days or 7)
+        tasks = self._search_tasks()
+        codes, delays = self.env['payroll.kpi_engine'].classify_task_records(
+            tasks, overdue_threshold_days=threshold)
+
+        user_ids = tasks.mapped('assignee_id').ids
+        employees = self.env['employee3c.employee.base'].search([('user_id', 'in', user_ids)]) if user_ids else []
+        emp_by_user = {emp.user_id.id: emp.id for emp in employees}
+
+        lines = [(5, 0, 0)]
+        for task, code, delay_days in zip(tasks, codes, delays):
+            if not code:
+                continue
+            hours = (task.done_date - task.due_date).total_seconds() / 3600.0
+            reason = self._borderline_reason(code, delay_days, hours, threshold)
+            if not reason:
+                continue
+            lines.append((0, 0, {
+                'task_id': task.id,
+                'employee_id': emp_by_user.get(task.assignee_id.id, False),
+                'due_date': task.due_date,
+                'done_date': task.done_date,
+                'hours_from_due': hours,
+                'delay_days': delay_days,
+                'bucket': KPI_BUCKETS[code],
+                'reason': reason,
+            }))
+        self.write({'line_ids': lines})
+        return self._reopen()
@@ -0,0 +1,93 @@
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+
+class PayrollKpiRescoreWizardLine(models.TransientModel):
+    _name = 'payroll.kpi.rescore.wizard.line'
+    _description = 'KPI Re-score Preview Line'
+    _order = 'delta, id'
+
+    wizard_id = fields.Many2one('payroll.kpi.rescore.wizard', required=True, ondelete='cascade')
+    employee_id = fields.Many2one('employee3c.employee.base', string='Employee', readonly=True)
+    old_total = fields.Float(string='Current KPI (%)', digits=(16, 4), readonly=True)
+    new_total = fields.Float(string='New KPI (%)', digits=(16, 4), readonly=True)
+    delta = fields.Float(string='Difference', digits=(16, 4), readonly=True)
+
+
+class PayrollKpiRescoreWizard(models.TransientModel):
+    _name = 'payroll.kpi.rescore.wizard'
+    _description = 'Re-score KPI from stored counts'
+
+    period_id = fields.Many2one('payroll.kpi_period', string='KPI Period', required=True)
+    sheet_id = fields.Many2one('payroll.kpi_sheet', string='KPI Sheet',
+                               help='Limit to employees of this KPI sheet and refresh its lines.')
+    quality_profile_id = fields.Many2one('payroll.kpi_quality_profile', string='Quality Profile')
+    line_ids = fields.One2many('payroll.kpi.rescore.wizard.line', 'wizard_id', string='Preview')
+
+    def _ensure_quality_profile(self):
+        self.ensure_one()
+        if self.quality_profile_id:
+            return self.quality_profile_id
+        prof = self.env['payroll.kpi_quality_profile'].search([('active', '=', True)], limit=1)
+        if not prof:
+            raise UserError(_("No KPI Quality Profile configured."))
+        self.quality_profile_id = prof.id
+        return prof
+
+    def _rescore(self):
+        self.ensure_one()
+        employee_ids = self.sheet_id.line_ids.mapped('employee_id').ids if self.sheet_id else None
+        return self.env['payroll.kpi_engine'].rescore_period(
+            self.period_id, self._ensure_quality_profile(), employee_ids=employee_ids)
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Re-score KPI'),
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_preview(self):
+        """Fill the preview table with current vs. re-scored totals without writing KPI records."""
+        self.ensure_one()
+        metrics_by_emp, old_totals = self._rescore()
+        lines = [(5, 0, 0)]
+        for emp_id, metrics in metrics_by_emp.items():
+            old = old_totals.get(emp_id, 0.0)
+            new = float(metrics.get('total_score', 0.0) or 0.0)
+            lines.append((0, 0, {
+                'employee_id': emp_id,
+                'old_total': old,
+                'new_total': new,
+                'delta': new - old,
+            }))
+        self.write({'line_ids': lines})
+        return self._reopen()
+
+    def action_apply(self):
+        """Persist re-scored KPI records and refresh KPI sheet lines of the period."""
+        self.ensure_one()
+        if self.period_id.state == 'closed':
+            raise UserError(_("Cannot re-score a closed KPI Period."))
+        Engine = self.env['payroll.kpi_engine']
+        metrics_by_emp, _old_totals = self._rescore()
+        _records, totals = Engine.upsert_kpi_records_batch(self.period_id, metrics_by_emp)
+        sheets = self.sheet_id or self.env['payroll.kpi_sheet'].search([('period_id', '=', self.period_id.id)])
+        for sheet in sheets:
+            sheet._update_lines_from_metrics(metrics_by_emp, totals, create_missing=False)
+        if self.quality_profile_id and self.sheet_id and self.sheet_id.quality_profile_id != self.quality_profile_id:
+            self.sheet_id.quality_profile_id = self.quality_profile_id.id
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Re-score KPI'),
+                'message': _('%s employees re-scored.') % len(metrics_by_emp),
+                'sticky': False,
+                'type': 'success',
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
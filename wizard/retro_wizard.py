@@ -0,0 +1,214 @@
+import time
+from collections import defaultdict
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+# Sequence of the delta lines on the target slips: after the regular rule lines
+RETRO_LINE_SEQUENCE = 900
+
+
+class PayrollRetroWizardLine(models.TransientModel):
+    _name = 'payroll.retro.wizard.line'
+    _description = 'Retroactive Payroll Difference'
+    _order = 'employee_id, period_run_id, sequence, id'
+
+    wizard_id = fields.Many2one('payroll.retro.wizard', required=True, ondelete='cascade')
+    period_run_id = fields.Many2one('payroll.payslip.run', string='Period', readonly=True)
+    source_slip_id = fields.Many2one('payroll.payslip', string='Past payslip', readonly=True)
+    employee_id = fields.Many2one('employee3c.employee.base', string='Employee', readonly=True)
+    sequence = fields.Integer(readonly=True)
+    code = fields.Char(readonly=True)
+    name = fields.Char(readonly=True)
+    category_id = fields.Many2one('payroll.category', string='Category', readonly=True)
+    stored_amount = fields.Float(string='Paid', readonly=True)
+    carried_amount = fields.Float(string='Already carried', readonly=True,
+                                  help='Retro lines for this payslip and code already added to other batches.')
+    new_amount = fields.Float(string='Recomputed', readonly=True)
+    delta = fields.Float(string='Difference', readonly=True)
+
+
+class PayrollRetroWizard(models.TransientModel):
+    _name = 'payroll.retro.wizard'
+    _description = 'Retroactive Recompute'
+
+    run_id = fields.Many2one('payroll.payslip.run', string='Current batch', required=True,
+                             help='Delta lines are added to the draft payslips of this batch.')
+    source_run_ids = fields.Many2many('payroll.payslip.run', string='Past periods', required=True,
+                                      domain="[('id', '!=', run_id)]")
+    employee_ids = fields.Many2many('employee3c.employee.base', string='Employees')
+    exclude_codes = fields.Char(string='Codes not carried', default='NET',
+                                help='Comma-separated totals (e.g. NET) that are compared but get no delta line, '
+                                     'since their components are already carried.')
+    tolerance = fields.Float(string='Tolerance', default=1.0, help='Differences below this amount are ignored.')
+    line_ids = fields.One2many('payroll.retro.wizard.line', 'wizard_id', string='Differences')
+    report = fields.Text(readonly=True)
+    state = fields.Selection([('draft', 'Draft'), ('computed', 'Computed'), ('applied', 'Applied')], default='draft')
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Retroactive Recompute'),
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _excluded_codes(self):
+        return {c.strip() for c in (self.exclude_codes or '').split(',') if c.strip()}
+
+    def _source_slips(self, runs):
+        """Past payslips of `runs` that are recomputed: not cancelled, restricted to the chosen employees."""
+        slips = runs.slip_ids.filtered(lambda s: s.state != 'cancel')
+        if self.employee_ids:
+            slips = slips.filtered(lambda s: s.employee_id in self.employee_ids)
+        return slips
+
+    def _stored_totals(self, slips):
+        """{slip_id: {code: (total, name, category_id, sequence)}} of the rule lines, in one read."""
+        res = defaultdict(dict)
+        for row in self.env['payroll.payslip.line'].search_read(
+                [('payslip_id', 'in', slips.ids), ('retro_slip_id', '=', False)],
+                ['payslip_id', 'code', 'name', 'amount', 'quantity', 'category_id', 'sequence']):
+            codes = res[row['payslip_id'][0]]
+            total = float(row['amount'] or 0.0) * float(row['quantity'] or 0.0)
+            prev = codes.get(row['code'])
+            codes[row['code']] = (total + (prev[0] if prev else 0.0), row['name'],
+                                  row['category_id'] and row['category_id'][0], row['sequence'])
+        return res
+
+    def _carried_totals(self, slips):
+        """{source slip_id: {code: (total, name, category_id, sequence)}} of retro lines already carried for
+        `slips` on other batches. Lines on cancelled slips are not paid; lines on the current batch are
+        replaced by action_apply, so neither counts."""
+        res = defaultdict(dict)
+        for row in self.env['payroll.payslip.line'].search_read(
+                [('retro_slip_id', 'in', slips.ids),
+                 ('payslip_id.state', '!=', 'cancel'),
+                 ('payslip_id.run_id', '!=', self.run_id.id)],
+                ['retro_slip_id', 'retro_code', 'amount', 'quantity', 'category_id', 'sequence']):
+            codes = res[row['retro_slip_id'][0]]
+            total = float(row['amount'] or 0.0) * float(row['quantity'] or 0.0)
+            prev = codes.get(row['retro_code'])
+            codes[row['retro_code']] = (total + (prev[0] if prev else 0.0), row['retro_code'],
+                                        row['category_id'] and row['category_id'][0],
+                                        (row['sequence'] or 0) - RETRO_LINE_SEQUENCE)
+        return res
+
+    def _recompute_period(self, run, params, pit_tables, excluded):
+        """Recompute the slips of one past batch in memory and return (line vals, slip count, skipped count).
+
+        Nothing is written on the past slips. For done slips, YTD excludes the slip's own totals, as it did
+        when the slip was first computed. The difference is net of what other batches already carry.
+        """
+        slips = self._source_slips(run)
+        stored = self._stored_totals(slips)
+        carried = self._carried_totals(slips)
+        ytd = slips._ytd_context()
+        vals_list = []
+        skipped = 0
+        for slip in slips:
+            try:
+                rules, var_map, pit_table = slip._prepare_rule_eval(params, pit_tables)
+            except UserError:
+                skipped += 1
+                continue
+            old = stored.get(slip.id, {})
+            # For done slips YTD already excludes the slip's own totals
+            extra = slip._rule_extra_context(ytd)
+            var_map, extra = slip._gross_up_inputs(var_map, extra)
+            _codes, new_lines = slip._evaluate_rules(rules, var_map, pit_table, extra=extra)
+            new = {}
+            for line in new_lines:
+                total = float(line['amount']) * float(line['quantity'])
+                prev = new.get(line['code'])
+                new[line['code']] = (total + (prev[0] if prev else 0.0), line['name'], line['category_id'], line['sequence'])
+            done = carried.get(slip.id, {})
+            for code in set(old) | set(new) | set(done):
+                old_total = old[code][0] if code in old else 0.0
+                new_total = new[code][0] if code in new else 0.0
+                carried_total = done[code][0] if code in done else 0.0
+                delta = new_total - old_total - carried_total
+                if code in excluded or abs(delta) < (self.tolerance or 0.0):
+                    continue
+                _total, name, category_id, sequence = new.get(code) or old.get(code) or done[code]
+                vals_list.append({
+                    'wizard_id': self.id,
+                    'period_run_id': run.id,
+                    'source_slip_id': slip.id,
+                    'employee_id': slip.employee_id.id,
+                    'sequence': sequence,
+                    'code': code,
+                    'name': name,
+                    'category_id': category_id,
+                    'stored_amount': old_total,
+                    'carried_amount': carried_total,
+                    'new_amount': new_total,
+                    'delta': delta,
+                })
+        return vals_list, len(slips), skipped
+
+    def action_compute(self):
+        """Recompute every past period with the current rules and inputs and list differing codes."""
+        self.ensure_one()
+        if self.run_id in self.source_run_ids:
+            raise UserError(_("The current batch cannot be one of the past periods."))
+        params = self.env['payroll.vn.params'].sudo()._get_default_params()
+        excluded = self._excluded_codes()
+        pit_tables = {}
+        self.line_ids.unlink()
+        vals_list = []
+        report = []
+        started = time.perf_counter()
+        for run in self.source_run_ids.sorted(lambda r: (r.date_start, r.id)):
+            t0 = time.perf_counter()
+            period_vals, slip_count, skipped = self._recompute_period(run, params, pit_tables, excluded)
+            vals_list += period_vals
+            report.append(_("%s: %s payslips, %s skipped, %s differences in %.2fs") % (
+                run.name, slip_count, skipped, len(period_vals), time.perf_counter() - t0))
+        self.env['payroll.retro.wizard.line'].create(vals_list)
+        report.append(_("Total: %s differences in %.2fs") % (len(vals_list), time.perf_counter() - started))
+        self.write({'state': 'computed', 'report': '\n'.join(report)})
+        return self._reopen()
+
+    def action_apply(self):
+        """Carry the differences as RETRO_<code> lines on the current batch's draft payslips.
+
+        Lines from an earlier apply for any recomputed past payslip are removed first, including those whose
+        difference is now below the tolerance, so applying twice is safe.
+        """
+        self.ensure_one()
+        if self.state != 'computed':
+            raise UserError(_("Compute the differences first."))
+        targets = {s.employee_id.id: s for s in self.run_id.slip_ids.filtered(lambda s: s.state == 'draft')}
+        by_target = defaultdict(lambda: self.env['payroll.retro.wizard.line'])
+        missing = set()
+        for line in self.line_ids:
+            target = targets.get(line.employee_id.id)
+            if target:
+                by_target[target] |= line
+            else:
+                missing.add(line.employee_id.id)
+        sources = self._source_slips(self.source_run_ids)
+        for target in targets.values():
+            lines = by_target.get(target, self.env['payroll.retro.wizard.line'])
+            commands = [(2, old.id) for old in target.line_ids if old.retro_slip_id in sources]
+            commands += [(0, 0, {
+                'name': _("Retro %s (%s)") % (line.name, line.period_run_id.name),
+                'code': 'RETRO_%s' % line.code,
+                'sequence': RETRO_LINE_SEQUENCE + (line.sequence or 0),
+                'amount': line.delta,
+                'quantity': 1.0,
+                'category_id': line.category_id.id,
+                'retro_slip_id': line.source_slip_id.id,
+                'retro_code': line.code,
+            }) for line in lines]
+            if commands:
+                target.write({'line_ids': commands})
+        report = [self.report or '', _("Applied on %s payslips.") % len(by_target)]
+        if missing:
+            report.append(_("%s employees have no draft payslip in %s; their differences were not carried.") % (
+                len(missing), self.run_id.name))
+        self.write({'state': 'applied', 'report': '\n'.join(report)})
+        return self._reopen()